@@ -0,0 +1,218 @@
+import json
+import math
+from collections import OrderedDict
+from fractions import Fraction
+
+
+def _dyadic(x):
+    """Float x exactly: mantissa * 2 ** exponent."""
+    if not math.isfinite(x):
+        raise ValueError("Accumulated values must be finite, got {}".format(x))
+    numerator, denominator = float(x).as_integer_ratio()
+    return numerator, 1 - denominator.bit_length()
+
+
+def _add_dyadic(total, mantissa, exponent):
+    """Exact sum of dyadic numbers (mantissa, exponent)."""
+    if not mantissa:
+        return total
+    total_mantissa, total_exponent = total
+    if not total_mantissa:
+        return mantissa, exponent
+    if exponent < total_exponent:
+        return (total_mantissa << (total_exponent - exponent)) + mantissa, exponent
+    return total_mantissa + (mantissa << (exponent - total_exponent)), total_exponent
+
+
+def _to_fraction(dyadic):
+    mantissa, exponent = dyadic
+    if exponent < 0:
+        return Fraction(mantissa, 1 << -exponent)
+    return Fraction(mantissa << exponent)
+
+
+class MeanStdAccumulator():
+    """Streaming mean and std_dev of values that have their own std_dev.
+
+    Keeps weighted count, mean and M2 (sum of squared deviations from the
+    mean) of the values and the sum of their variances, so memory does not
+    depend on the number of values. The std_dev of the result is the std of
+    the mixture of the values: sqrt(mean of variances + variance of means),
+    it estimates the spread of one disk (run, node) instead of growing with
+    their number.
+
+    State is kept exactly (sums of weights, values, squares and variances;
+    floats are dyadic rationals, so the sums are integers times powers of
+    2), so merging accumulators of split data in any order gives exactly
+    the result of one pass over all the data. Count, mean and M2 are
+    computed from the sums (Chan et al. merge without rounding).
+    """
+
+    __slots__ = ["n", "_weight", "_sum", "_sum_sq", "_var_sum"]
+
+    def __init__(self):
+        self.n = 0
+        self._weight = (0, 0)
+        self._sum = (0, 0)
+        self._sum_sq = (0, 0)
+        self._var_sum = (0, 0)
+
+    def add(self, mean, std_dev=0, weight=1):
+        '''
+        Args:
+            mean (float): value.
+            std_dev (float): std_dev of the value.
+            weight (float): weight of the value (e.g. number of IOs).
+
+        '''
+        mean_mantissa, mean_exponent = _dyadic(mean)
+        std_mantissa, std_exponent = _dyadic(std_dev)
+        weight_mantissa, weight_exponent = _dyadic(weight)
+        self.n += 1
+        self._weight = _add_dyadic(self._weight, weight_mantissa, weight_exponent)
+        self._sum = _add_dyadic(
+            self._sum, weight_mantissa * mean_mantissa, weight_exponent + mean_exponent)
+        self._sum_sq = _add_dyadic(
+            self._sum_sq, weight_mantissa * mean_mantissa * mean_mantissa,
+            weight_exponent + 2 * mean_exponent)
+        self._var_sum = _add_dyadic(
+            self._var_sum, weight_mantissa * std_mantissa * std_mantissa,
+            weight_exponent + 2 * std_exponent)
+        return self
+
+    def merge(self, other):
+        """Add the values of other accumulator."""
+        self.n += other.n
+        self._weight = _add_dyadic(self._weight, *other._weight)
+        self._sum = _add_dyadic(self._sum, *other._sum)
+        self._sum_sq = _add_dyadic(self._sum_sq, *other._sum_sq)
+        self._var_sum = _add_dyadic(self._var_sum, *other._var_sum)
+        return self
+
+    @property
+    def count(self):
+        """Sum of weights (Fraction)."""
+        return _to_fraction(self._weight)
+
+    @property
+    def mean(self):
+        return _to_fraction(self._sum) / self.count
+
+    @property
+    def m2(self):
+        total = _to_fraction(self._sum)
+        return _to_fraction(self._sum_sq) - total * total / self.count
+
+    def result(self):
+        """Mean and std_dev (floats), nan if there are no values."""
+        if not self._weight[0]:
+            return OrderedDict([("mean", math.nan), ("std_dev", math.nan)])
+        variance = (_to_fraction(self._var_sum) + self.m2) / self.count
+        return OrderedDict([
+            ("mean", float(self.mean)),
+            ("std_dev", math.sqrt(max(float(variance), 0.0))),
+        ])
+
+    def to_dict(self):
+        """Exact state (mantissa, exponent of the sums), see from_dict."""
+        return OrderedDict([
+            ("n", self.n),
+            ("weight", list(self._weight)),
+            ("sum", list(self._sum)),
+            ("sum_sq", list(self._sum_sq)),
+            ("var_sum", list(self._var_sum)),
+        ])
+
+    @classmethod
+    def from_dict(cls, state):
+        accumulator = cls()
+        accumulator.n = state["n"]
+        accumulator._weight = tuple(state["weight"])
+        accumulator._sum = tuple(state["sum"])
+        accumulator._sum_sq = tuple(state["sum_sq"])
+        accumulator._var_sum = tuple(state["var_sum"])
+        return accumulator
+
+    def __repr__(self):
+        return "MeanStdAccumulator(n={}, {})".format(self.n, dict(self.result()))
+
+
+def tree_result(tree):
+    """Nested dict with accumulators -> nested dict with their results
+    (other values are kept). Accumulators without values and dicts left
+    empty are dropped, so there are no nan in the result."""
+    result = OrderedDict()
+    for key, value in tree.items():
+        if isinstance(value, MeanStdAccumulator):
+            if value.n:
+                result[key] = value.result()
+        elif isinstance(value, dict):
+            value = tree_result(value)
+            if value:
+                result[key] = value
+        else:
+            result[key] = value
+    return result
+
+
+def merge_trees(tree, other):
+    """Merge nested dict of accumulators other into tree (in place).
+
+    Keys missing in tree are added, other values of both trees must match.
+
+    Returns:
+        tree (OrderedDict): merged tree.
+
+    """
+    for key, value in other.items():
+        if key not in tree:
+            # a copy, other stays unchanged
+            if isinstance(value, MeanStdAccumulator):
+                tree[key] = MeanStdAccumulator().merge(value)
+            elif isinstance(value, dict):
+                tree[key] = merge_trees(OrderedDict(), value)
+            else:
+                tree[key] = value
+        elif isinstance(value, MeanStdAccumulator):
+            tree[key].merge(value)
+        elif isinstance(value, dict):
+            merge_trees(tree[key], value)
+        elif tree[key] != value:
+            raise ValueError("Can't merge '{}': {} != {}".format(key, tree[key], value))
+    return tree
+
+
+def tree_to_dict(tree):
+    """Nested dict of accumulators -> json-serializable nested dict."""
+    result = OrderedDict()
+    for key, value in tree.items():
+        if isinstance(value, MeanStdAccumulator):
+            result[key] = OrderedDict([("accumulator", value.to_dict())])
+        elif isinstance(value, dict):
+            result[key] = tree_to_dict(value)
+        else:
+            result[key] = value
+    return result
+
+
+def tree_from_dict(tree):
+    """Inverse of tree_to_dict."""
+    result = OrderedDict()
+    for key, value in tree.items():
+        if isinstance(value, dict) and list(value) == ["accumulator"]:
+            result[key] = MeanStdAccumulator.from_dict(value["accumulator"])
+        elif isinstance(value, dict):
+            result[key] = tree_from_dict(value)
+        else:
+            result[key] = value
+    return result
+
+
+def save_accumulators(tree, save_path):
+    with open(save_path, 'w+') as fp:
+        json.dump(tree_to_dict(tree), fp)
+
+
+def read_accumulators(json_path):
+    with open(json_path, 'r') as fp:
+        return tree_from_dict(json.load(fp, object_pairs_hook=OrderedDict))
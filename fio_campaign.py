@@ -0,0 +1,302 @@
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from fio_run_utils import (
+    BLOCK_SIZES, DISKS, RW_LIST, RUNTIME, run_fio, run_disk_tests, disk_config_path,
+    append_journal, iter_journal, prepared_targets, save_json
+)
+from fio_parser_utils import parse_result_metrics
+
+Z_95 = 1.96
+
+
+def plan_cells(block_sizes=BLOCK_SIZES, disks=DISKS, rw_list=RW_LIST):
+    """All (size, disk, rw) cells of a campaign."""
+    return [(str(block_size) + "K", disk, rw)
+            for block_size in block_sizes for disk in disks for rw in rw_list]
+
+
+def relative_ci(values, z=Z_95):
+    """Relative half-width of the confidence interval of the mean."""
+    if len(values) < 2:
+        return np.inf
+    values = np.asarray(values)
+    mean = np.mean(values)
+    if mean == 0:
+        return np.inf
+    return z * np.std(values, ddof=1) / np.sqrt(len(values)) / abs(mean)
+
+
+class Campaign():
+    """fio campaign driven by the variance of the results.
+
+    The campaign runs rows (all read/write tests of one block size on one
+    disk, the unit parse_fio_tests needs) instead of full sweeps:
+
+        1. every row is run min_runs times, rows are picked at random among
+           the rows with the fewest runs, so the sweeps are interleaved and
+           no block size is tested at the same time of day;
+        2. the rest of the time budget goes to the row with the widest
+           relative confidence interval of the metric mean over its cells,
+           until every row is below target_precision. A row with a cell of
+           less than 2 successful tests (dead or busy disk, its interval is
+           infinite) is retried max_retries times at most, then it is left
+           out.
+
+    Every finished test is appended to the journal with its run number and
+    the wall time of its row, so a killed campaign is resumed from the
+    journal, the time of the previous sessions counts to time_budget.
+    """
+
+    def __init__(self, journal_path, block_sizes=BLOCK_SIZES, disks=DISKS,
+                 rw_list=RW_LIST, time_budget=24 * 3600, min_runs=3,
+                 target_precision=0.05, metric='lat', runtime=RUNTIME,
+                 timeout=RUNTIME * 3, iodepth=1, config_path='test.ini',
+                 output_format='normal', random_offset=False, n_workers=1, seed=None,
+                 backend=run_fio, max_retries=2):
+        '''
+        Args:
+            journal_path (str): campaign journal (JSONL).
+            time_budget (float): campaign time (sec).
+            min_runs (int): runs of every row before the variance is used.
+            target_precision (float): target relative half-width of the
+                95% confidence interval of the metric mean.
+            metric ('slat', 'clat', 'lat', 'bw' or 'iops'): metric of precision.
+            n_workers (int): max number of disks tested at the same time.
+            seed (int or None): seed of the row order.
+            max_retries (int): runs over min_runs of a row without enough
+                successful tests for its confidence interval.
+
+        Other args are the same as in fio_run_utils.run_test.
+
+        '''
+        self.journal_path = journal_path
+        self.block_sizes = block_sizes
+        self.rw_list = rw_list
+        self.time_budget = time_budget
+        self.min_runs = min_runs
+        self.target_precision = target_precision
+        self.metric = metric
+        self.runtime = runtime
+        self.timeout = timeout
+        self.iodepth = iodepth
+        self.config_path = config_path
+        self.output_format = output_format
+        self.random_offset = random_offset
+        self.n_workers = n_workers
+        self.seed = seed
+        self.backend = backend
+        self.max_retries = max_retries
+        self._random = random.Random(seed)
+
+        self.rows = [(str(block_size) + "K", disk)
+                     for block_size in block_sizes for disk in disks]
+        self.samples = OrderedDict((cell, []) for cell in plan_cells(
+            block_sizes, disks, rw_list))
+        self.n_runs = OrderedDict((row, 0) for row in self.rows)
+        self.durations = []
+        # time of the previous sessions (sec)
+        self.spent = 0.
+        self._load_journal()
+        self._start = time.time()
+
+    def _load_journal(self):
+        row_durations = OrderedDict()
+        for record in iter_journal(self.journal_path):
+            row = (record["size"], record["disk"])
+            if row not in self.n_runs:
+                continue
+            self.n_runs[row] = max(self.n_runs[row], record["run"] + 1)
+            if "duration" in record:
+                row_durations[(row, record["run"])] = record["duration"]
+            if record["status"] != 'failed':
+                self._add_sample(record["size"], record["disk"], record["rw"],
+                                 record["result"])
+        self.durations = list(row_durations.values())
+        self.spent = sum(self.durations) / self.n_workers
+
+    def _add_sample(self, size, disk, rw, result):
+        """Add the metric of a test, a test that fails to parse is skipped."""
+        try:
+            metrics = parse_result_metrics(result, rw, self.output_format)
+            value = np.mean([m[self.metric][0] for m in metrics.values()])
+        except Exception as e:
+            print("failed to parse: {} {} {}: {!r}".format(size, disk, rw, e))
+            return
+        self.samples[(size, disk, rw)].append(value)
+
+    def row_precision(self, row):
+        """Widest relative confidence interval of the cells of the row."""
+        size, disk = row
+        return max(relative_ci(self.samples[(size, disk, rw)])
+                   for rw in self.rw_list)
+
+    def row_failed(self, row):
+        """Whether the row has a cell of less than 2 successful tests after
+        min_runs + max_retries runs (left out of the precision phase)."""
+        size, disk = row
+        return (self.n_runs[row] >= self.min_runs + self.max_retries and
+                min(len(self.samples[(size, disk, rw)]) for rw in self.rw_list) < 2)
+
+    def elapsed(self):
+        """Campaign time with the previous sessions (sec)."""
+        return self.spent + time.time() - self._start
+
+    def row_time(self):
+        """Mean wall time of one row."""
+        if not self.durations:
+            return len(self.rw_list) * self.runtime / self.n_workers
+        return np.mean(self.durations) / self.n_workers
+
+    def remaining_runs(self):
+        """Estimate of rows to run to reach the target precision."""
+        n = 0
+        for row, n_runs in self.n_runs.items():
+            if self.row_failed(row):
+                continue
+            if n_runs < self.min_runs:
+                n += self.min_runs - n_runs
+                continue
+            precision = self.row_precision(row)
+            if np.isfinite(precision) and precision > self.target_precision:
+                needed = n_runs * (precision / self.target_precision) ** 2
+                n += int(np.ceil(needed)) - n_runs
+        return n
+
+    def eta(self):
+        """Estimated time to the end of the campaign (sec)."""
+        left = max(self.time_budget - self.elapsed(), 0)
+        return min(self.remaining_runs() * self.row_time(), left)
+
+    def next_row(self, busy_disks=()):
+        """Pick the next row or None if the campaign is done.
+
+        Args:
+            busy_disks (set of str): disks that are tested right now.
+
+        """
+        if self.elapsed() + self.row_time() > self.time_budget:
+            return None
+        free_rows = [row for row in self.rows if row[1] not in busy_disks]
+        if not free_rows:
+            return None
+
+        min_runs = min(self.n_runs[row] for row in free_rows)
+        if min_runs < self.min_runs:
+            return self._random.choice(
+                [row for row in free_rows if self.n_runs[row] == min_runs])
+
+        free_rows = [row for row in free_rows if not self.row_failed(row)]
+        if not free_rows:
+            return None
+        precision = {row: self.row_precision(row) for row in free_rows}
+        row = max(free_rows, key=lambda r: (precision[r], self._random.random()))
+        if precision[row] <= self.target_precision:
+            return None
+        return row
+
+    def run_row(self, row, run):
+        size, disk = row
+        block_size = int(size[:-1])
+        path = self.config_path if self.n_workers == 1 else disk_config_path(
+            self.config_path, disk)
+        start = time.time()
+        try:
+            result = run_disk_tests(
+                block_size, disk, self.rw_list, self.runtime, self.iodepth, path,
+                self.output_format, self.random_offset, self.timeout,
+                backend=self.backend)
+        except Exception as e:
+            print("failed: {} {}: {!r}".format(size, disk, e))
+            result = OrderedDict()
+        duration = time.time() - start
+        for rw in self.rw_list:
+            if rw in result:
+                test = result[rw]
+            else:
+                test = OrderedDict([("result", ""), ("status", 'failed')])
+            test["run"] = run
+            test["duration"] = duration
+            append_journal(self.journal_path, size, disk, rw, test)
+        return result, duration
+
+    def print_progress(self):
+        print("#runs: {}, elapsed: {:.2f} h, ETA: {:.2f} h".format(
+            sum(self.n_runs.values()), self.elapsed() / 3600, self.eta() / 3600))
+
+    def run(self):
+        """Run the campaign."""
+        self._start = time.time()
+        print("#start, seed: {}".format(self.seed))
+        disks = list(OrderedDict.fromkeys(disk for _, disk in self.rows))
+        with prepared_targets(disks), ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            running = {}
+            while True:
+                busy_disks = {disk for _, disk in running.values()}
+                while len(running) < self.n_workers:
+                    row = self.next_row(busy_disks)
+                    if row is None:
+                        break
+                    print("\nsize: {}, disk: {}, run: {}".format(
+                        row[0], row[1], self.n_runs[row]))
+                    future = executor.submit(self.run_row, row, self.n_runs[row])
+                    self.n_runs[row] += 1
+                    running[future] = row
+                    busy_disks.add(row[1])
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    size, disk = running.pop(future)
+                    result, duration = future.result()
+                    self.durations.append(duration)
+                    for rw, test in result.items():
+                        if test["status"] != 'failed':
+                            self._add_sample(size, disk, rw, test["result"])
+                self.print_progress()
+        print("\n#done")
+
+    def precision_report(self):
+        """Row -> (runs, relative confidence interval), the interval of a
+        failed row (see row_failed) is inf."""
+        return OrderedDict(
+            ("{} {}".format(*row), (n_runs, self.row_precision(row)))
+            for row, n_runs in self.n_runs.items())
+
+
+def campaign_results(journal_path):
+    """Journal of campaign to results of run_test, one result per run.
+
+    The result of run i has the rows that were run at least i + 1 times,
+    rows with failed tests are skipped.
+
+    Returns:
+        results (list of OrderedDict): size -> disk -> rw -> test.
+
+    """
+    runs = OrderedDict()
+    for record in iter_journal(journal_path):
+        run = record.pop("run")
+        size, disk, rw = record.pop("size"), record.pop("disk"), record.pop("rw")
+        runs.setdefault(run, OrderedDict()).setdefault(
+            size, OrderedDict()).setdefault(disk, OrderedDict())[rw] = record
+
+    results = []
+    for run in sorted(runs):
+        result = OrderedDict()
+        for size, disks in runs[run].items():
+            for disk, tests in disks.items():
+                if all(test["status"] != 'failed' for test in tests.values()):
+                    result.setdefault(size, OrderedDict())[disk] = tests
+        results.append(result)
+    return results
+
+
+def save_campaign_results(journal_path, save_path_format="fiotests/fio_tests_{}.json"):
+    """Save campaign as files of run_test results (see campaign_results)."""
+    for i, result in enumerate(campaign_results(journal_path)):
+        save_json(result, save_path_format.format(i))
@@ -0,0 +1,321 @@
+import argparse
+import math
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_parse_cache import ParseCache
+from fio_parser_batch import expand_tests_path
+from fio_parser_utils import OUTPUT_FORMATS, save_json
+from fio_store import LABELS_FILE, STORE_DIRECTIONS, ResultStore, file_metrics, write_store
+
+TESTS = ["welch", "mannwhitney"]
+CORRECTIONS = ["bh", "holm", "bonferroni"]
+COMPARE_METRICS = ["lat", "bw", "iops"]
+# metrics where lower values are better
+LOWER_IS_BETTER = {"slat", "clat", "lat"}
+
+_lgamma = np.vectorize(math.lgamma, otypes=[float])
+
+
+def betainc(a, b, x, n_iter=300):
+    """Regularized incomplete beta function I_x(a, b), vectorized
+    (continued fraction, modified Lentz's method)."""
+    a, b, x = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (a, b, x)))
+    # the continued fraction converges fast for x < (a + 1) / (a + b + 2)
+    swap = x > (a + 1) / (a + b + 2)
+    a, b, x = np.where(swap, b, a), np.where(swap, a, b), np.where(swap, 1 - x, x)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        front = np.exp(a * np.log(x) + b * np.log1p(-x)
+                       - (_lgamma(a) + _lgamma(b) - _lgamma(a + b))) / a
+        tiny = 1e-300
+        c = np.ones_like(x)
+        d = 1 - (a + b) * x / (a + 1)
+        d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+        f = d.copy()
+        for m in range(1, n_iter + 1):
+            for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                              -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+                d = 1 + numerator * d
+                d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+                c = 1 + numerator / c
+                c = np.where(np.abs(c) < tiny, tiny, c)
+                f *= c * d
+        result = front * f
+    result = np.where(x <= 0, 0.0, np.where(x >= 1, 1.0, result))
+    return np.where(swap, 1 - result, result)
+
+
+def erfc(x):
+    """Complementary error function, vectorized (Chebyshev fit of Numerical
+    Recipes, relative error < 1.2e-7)."""
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+    t = 1 / (1 + 0.5 * z)
+    poly = -z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (
+        0.09678418 + t * (-0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (
+            1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    result = t * np.exp(poly)
+    return np.where(x >= 0, result, 2 - result)
+
+
+def welch_test(a, b):
+    """Welch's t-test of every row of samples (nan are missing samples).
+
+    Returns:
+        t (np.ndarray): t statistics (b - a).
+        p_value (np.ndarray): two-sided p-values, nan if a row has less
+            than 2 samples on a side.
+
+    """
+    n_a = np.sum(~np.isnan(a), axis=1)
+    n_b = np.sum(~np.isnan(b), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_a = np.nanvar(a, axis=1, ddof=1) / n_a
+        var_b = np.nanvar(b, axis=1, ddof=1) / n_b
+        diff = np.nanmean(b, axis=1) - np.nanmean(a, axis=1)
+        se2 = var_a + var_b
+        t = diff / np.sqrt(se2)
+        # Welch-Satterthwaite degrees of freedom
+        df = se2 ** 2 / (var_a ** 2 / (n_a - 1) + var_b ** 2 / (n_b - 1))
+        p_value = betainc(df / 2, 0.5, df / (df + t ** 2))
+    # equal constant samples: no difference
+    p_value = np.where((se2 == 0) & (diff == 0), 1.0, p_value)
+    p_value = np.where((se2 == 0) & (diff != 0), 0.0, p_value)
+    p_value = np.where((n_a < 2) | (n_b < 2), np.nan, p_value)
+    return t, p_value
+
+
+def mannwhitney_test(a, b):
+    """Mann-Whitney U test of every row of samples (nan are missing
+    samples), normal approximation with tie and continuity corrections.
+
+    Returns:
+        u (np.ndarray): U statistics of b.
+        p_value (np.ndarray): two-sided p-values, nan if a row has no
+            samples on a side.
+
+    """
+    n_rows, n_cols = a.shape[0], a.shape[1] + b.shape[1]
+    samples = np.concatenate([a, b], axis=1)
+    is_b = np.concatenate([np.zeros_like(a, dtype=bool), np.ones_like(b, dtype=bool)], axis=1)
+    # nan are sorted last
+    order = np.argsort(samples, axis=1, kind='stable')
+    samples = np.take_along_axis(samples, order, axis=1)
+    is_b = np.take_along_axis(is_b, order, axis=1)
+    valid = ~np.isnan(samples)
+
+    # average ranks of ties: groups of equal values in a sorted row
+    new_group = np.ones(samples.shape, dtype=bool)
+    new_group[:, 1:] = samples[:, 1:] != samples[:, :-1]
+    group = np.cumsum(new_group, axis=1) - 1 + np.arange(n_rows)[:, None] * n_cols
+    positions = np.broadcast_to(np.arange(1, n_cols + 1), samples.shape)
+    group_size = np.bincount(group[valid], minlength=n_rows * n_cols)
+    group_sum = np.bincount(group[valid], weights=positions[valid], minlength=n_rows * n_cols)
+    with np.errstate(invalid='ignore'):
+        ranks = group_sum[group] / group_size[group]
+
+    n_a = np.sum(valid & ~is_b, axis=1)
+    n_b = np.sum(valid & is_b, axis=1)
+    n = n_a + n_b
+    u = np.sum(np.where(valid & is_b, ranks, 0), axis=1) - n_b * (n_b + 1) / 2
+    # sum of t^3 - t over groups of ties = sum of t^2 - 1 over samples
+    ties = np.sum(np.where(valid, group_size[group].astype(float) ** 2 - 1, 0), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(n_a * n_b / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = np.maximum(np.abs(u - n_a * n_b / 2) - 0.5, 0) / sigma
+        p_value = np.where(sigma > 0, erfc(z / np.sqrt(2)), 1.0)
+    p_value = np.where((n_a < 1) | (n_b < 1), np.nan, p_value)
+    return u, p_value
+
+
+def adjust_p_values(p_values, method="bh"):
+    """p-values adjusted for multiple comparisons (nan are skipped).
+
+    Methods:
+        'bh' -- Benjamini-Hochberg (false discovery rate),
+        'holm' -- Holm-Bonferroni (family-wise error rate),
+        'bonferroni' -- Bonferroni (family-wise error rate).
+
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    idx = np.flatnonzero(~np.isnan(p_values))
+    m = len(idx)
+    if not m:
+        return adjusted
+    p = p_values[idx]
+    order = np.argsort(p)
+    ranks = np.arange(1, m + 1)
+    if method == "bh":
+        q = np.minimum.accumulate((p[order] * m / ranks)[::-1])[::-1]
+    elif method == "holm":
+        q = np.maximum.accumulate(p[order] * (m - ranks + 1))
+    elif method == "bonferroni":
+        q = p[order] * m
+    else:
+        raise ValueError("Unknown correction '{}'".format(method))
+    adjusted[idx[order]] = np.minimum(q, 1)
+    return adjusted
+
+
+def open_campaign(path, output_type="normal", cache=None, store_dir=None):
+    """Result store of a campaign.
+
+    Args:
+        path (str): store dir (see fio_store) or dir/glob of test files
+            (parsed, a file is a run).
+        store_dir (str or None): dir of the store of test files.
+
+    Returns:
+        store (fio_store.ResultStore): store.
+
+    """
+    if os.path.exists(os.path.join(path, LABELS_FILE)):
+        return ResultStore(path)
+    metrics = OrderedDict()
+    for test_path in expand_tests_path(path):
+        metrics.update(file_metrics(test_path, output_type, cache=cache))
+    if not metrics:
+        raise ValueError("No tests in '{}'".format(path))
+    write_store(store_dir, metrics)
+    return ResultStore(store_dir)
+
+
+def campaign_samples(store, sizes, rws, metrics):
+    """Samples of every cell of a campaign.
+
+    Returns:
+        samples (np.ndarray): cells (size x rw x direction x metric) x
+            samples (runs x disks), nan where there is no test.
+
+    """
+    values = store.select(size=list(sizes), rw=list(rws), metric=list(metrics), stat="mean")
+    # run, size, disk, rw, direction, metric -> size, rw, direction, metric, run, disk
+    values = np.transpose(values, (1, 3, 4, 5, 0, 2))
+    return values.reshape(-1, values.shape[-2] * values.shape[-1])
+
+
+def compare_stores(store_a, store_b, metrics=COMPARE_METRICS, test="welch", correction="bh",
+                   alpha=0.05, min_change=0.05):
+    """Compare every (size, rw, direction, metric) cell of two campaigns.
+
+    The samples of a cell are the test means of its disks and runs. A cell
+    regressed (improved) if the adjusted p-value is below alpha and the
+    relative change of the mean (Welch) or median (Mann-Whitney) is worse
+    (better) by min_change or more: higher latency, lower bw or IOPS.
+
+    Args:
+        store_a, store_b (fio_store.ResultStore): campaigns, b is compared to a.
+        metrics (list of str): metrics of fio_parser_utils.METRICS.
+        test ('welch' or 'mannwhitney'): test of a cell.
+        correction ('bh', 'holm' or 'bonferroni'): see adjust_p_values.
+        alpha (float): significance level.
+        min_change (float): min relative change.
+
+    Returns:
+        cells (list of OrderedDict): size, rw, direction, metric, n_a, n_b,
+            mean_a, mean_b, median_a, median_b, change, p_value, q_value
+            (adjusted) and verdict ('regressed', 'improved' or 'same') of
+            every cell with samples in both campaigns.
+
+    """
+    if test not in TESTS:
+        raise ValueError("Unknown test '{}'".format(test))
+    sizes = [size for size in store_a.labels["size"] if size in store_b.labels["size"]]
+    rws = [rw for rw in store_a.labels["rw"] if rw in store_b.labels["rw"]]
+    a = campaign_samples(store_a, sizes, rws, metrics)
+    b = campaign_samples(store_b, sizes, rws, metrics)
+    cells = [(size, rw, direction, metric) for size in sizes for rw in rws
+             for direction in STORE_DIRECTIONS for metric in metrics]
+
+    n_a = np.sum(~np.isnan(a), axis=1)
+    n_b = np.sum(~np.isnan(b), axis=1)
+    present = (n_a > 0) & (n_b > 0)
+    a, b = a[present], b[present]
+    cells = [cell for cell, p in zip(cells, present) if p]
+
+    mean_a, mean_b = np.nanmean(a, axis=1), np.nanmean(b, axis=1)
+    median_a, median_b = np.nanmedian(a, axis=1), np.nanmedian(b, axis=1)
+    if test == "welch":
+        _, p_value = welch_test(a, b)
+        change = mean_b / mean_a - 1
+    else:
+        _, p_value = mannwhitney_test(a, b)
+        change = median_b / median_a - 1
+    q_value = adjust_p_values(p_value, correction)
+
+    sign = np.array([1 if metric in LOWER_IS_BETTER else -1 for _, _, _, metric in cells])
+    worse = sign * change
+    significant = q_value < alpha
+    verdicts = np.where(significant & (worse >= min_change), "regressed",
+                        np.where(significant & (worse <= -min_change), "improved", "same"))
+
+    columns = [n_a[present], n_b[present], mean_a, mean_b, median_a, median_b,
+               change, p_value, q_value]
+    report = []
+    for i, (size, rw, direction, metric) in enumerate(cells):
+        row = OrderedDict([("size", size), ("rw", rw), ("direction", direction),
+                           ("metric", metric)])
+        for name, column in zip(["n_a", "n_b", "mean_a", "mean_b", "median_a", "median_b",
+                                 "change", "p_value", "q_value"], columns):
+            row[name] = column[i].item()
+        row["verdict"] = str(verdicts[i])
+        report.append(row)
+    return report
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-a", "--campaign_a", type=str, required=True,
+                        help="baseline: store dir or dir/glob of test files")
+    parser.add_argument("-b", "--campaign_b", type=str, required=True,
+                        help="compared campaign: store dir or dir/glob of test files")
+    parser.add_argument("-test", "--test", type=str, choices=TESTS,
+                        default="welch", required=False)
+    parser.add_argument("-correction", "--correction", type=str, choices=CORRECTIONS,
+                        default="bh", required=False)
+    parser.add_argument("-alpha", "--alpha", type=float, default=0.05, required=False)
+    parser.add_argument("-min_change", "--min_change", type=float, default=0.05, required=False)
+    parser.add_argument("-metrics", "--metrics", type=str, nargs="+",
+                        default=COMPARE_METRICS, required=False)
+    parser.add_argument("-format", "--output_format", type=str, choices=OUTPUT_FORMATS,
+                        default="normal", required=False)
+    parser.add_argument("-cache", "--cache_path", type=str, default=None, required=False,
+                        help="parse cache (see fio_parse_cache)")
+    parser.add_argument("-save", "--save_path", type=str, default=None, required=False)
+
+    args = parser.parse_args(args)
+
+    cache = ParseCache(args.cache_path) if args.cache_path is not None else None
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_a = open_campaign(args.campaign_a, args.output_format, cache,
+                                    os.path.join(tmp_dir, "a"))
+            store_b = open_campaign(args.campaign_b, args.output_format, cache,
+                                    os.path.join(tmp_dir, "b"))
+            report = compare_stores(store_a, store_b, args.metrics, args.test,
+                                    args.correction, args.alpha, args.min_change)
+            # memory maps of the temp stores
+            del store_a, store_b
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if args.save_path is not None:
+        save_json(report, args.save_path)
+    stat = "mean" if args.test == "welch" else "median"
+    for row in report:
+        if row["verdict"] != "same":
+            print("{verdict}: {size} {rw} {direction} {metric}: {a:.4g} -> {b:.4g} "
+                  "({change:+.1%}, q={q_value:.2g})".format(
+                      a=row[stat + "_a"], b=row[stat + "_b"], **row))
+    n_changed = sum(row["verdict"] != "same" for row in report)
+    print("{} of {} cells changed".format(n_changed, len(report)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
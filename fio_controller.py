@@ -0,0 +1,345 @@
+import argparse
+import contextlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from fio_run_utils import (
+    BLOCK_SIZES, RW_LIST, RUNTIME, fio_config, save_fio_config, prepared_targets,
+    test_status, append_journal, iter_journal, save_json
+)
+
+FIO_PORT = 8765
+# sec to wait for fio --client to stop the job of the server after SIGINT
+STOP_TIMEOUT = 30
+
+
+class ServerBusyError(Exception):
+    """fio server of a node didn't stop a job, it may still be running."""
+
+
+def node_name(node):
+    """File-friendly node name ("host,port" -> "host_port")."""
+    return node.replace(",", "_").replace(":", "_")
+
+
+def run_fio_client(node, config_path, runtime=RUNTIME, output_format='json',
+                   timeout=None, stop_timeout=STOP_TIMEOUT):
+    """Run fio job file on the fio server of node (fio --client).
+
+    On timeout the client gets SIGINT, so it tells the server to stop the
+    job (killing the client alone leaves the job running on the server and
+    the next test of the node would run next to it).
+
+    Args:
+        node (str): fio server, "host" or "host,port".
+        stop_timeout (float): sec to wait for the job to stop.
+
+    Returns:
+        output (str): fio output.
+
+    Raises:
+        subprocess.TimeoutExpired: the test timed out, the job is stopped.
+        ServerBusyError: the test timed out and the job didn't stop.
+
+    """
+    cmd = "fio --client={} {} --runtime={} --output-format={}".format(
+        node, config_path, runtime, output_format)
+    process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
+    try:
+        stdout, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.communicate(timeout=stop_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise ServerBusyError("fio server {} didn't stop the job".format(node))
+        raise
+    except:
+        process.kill()
+        process.wait()
+        raise
+    return stdout.decode('utf-8')
+
+
+@contextlib.contextmanager
+def local_fio_servers(n_servers, port=FIO_PORT):
+    """Start fio servers on localhost, they stand in for remote nodes.
+
+    Yields:
+        nodes (list of str): "localhost,<port>" of every server.
+
+    """
+    processes = []
+    nodes = []
+    try:
+        for i in range(n_servers):
+            processes.append(subprocess.Popen(
+                ["fio", "--server=,{}".format(port + i)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            nodes.append("localhost,{}".format(port + i))
+        time.sleep(1)  # wait for servers to listen
+        for node, process in zip(nodes, processes):
+            if process.poll() is not None:
+                raise RuntimeError("fio server {} exited with {}".format(
+                    node, process.returncode))
+        yield nodes
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+class Controller():
+    """Run fio tests on many nodes from one controller.
+
+    Every node runs a fio server (fio --server as root), the controller runs
+    a worker per node which sends the job files of the node's tests with
+    fio --client and appends the results to one journal (see
+    fio_run_utils.append_journal, records have "node").
+
+    Tests are scheduled by cells (size, rw) across the nodes: a free node
+    gets its pending test of the cell with the fewest tests started on all
+    nodes, so every cell is covered by the whole rack evenly, even if the
+    run is cut short or nodes drop out.
+
+    A node that fails max_failures tests in a row, or whose server doesn't
+    stop a timed out job, is dropped, its remaining tests are journaled
+    as failed, so the next run of the controller retries them together with
+    the other failed tests.
+    """
+
+    def __init__(self, nodes, journal_path, block_sizes=BLOCK_SIZES, rw_list=RW_LIST,
+                 runtime=RUNTIME, timeout=RUNTIME * 3, iodepth=1, config_dir='.',
+                 output_format='json', random_offset=False, max_failures=3, local=False):
+        '''
+        Args:
+            nodes (dict): node ("host" or "host,port") -> list of disks.
+            journal_path (str): journal of all nodes (JSONL).
+            config_dir (str): dir for temp job files.
+            max_failures (int): failed tests in a row to drop the node.
+            local (bool): the nodes are fio servers on this host, their
+                targets are probed here (see fio_run_utils.fio_config).
+
+        Other args are the same as in fio_run_utils.run_test.
+
+        '''
+        self.nodes = OrderedDict(nodes)
+        self.journal_path = journal_path
+        self.block_sizes = block_sizes
+        self.rw_list = rw_list
+        self.runtime = runtime
+        self.timeout = timeout
+        self.iodepth = iodepth
+        self.config_dir = config_dir
+        self.output_format = output_format
+        self.random_offset = random_offset
+        self.max_failures = max_failures
+        self.local = local
+        self.dropped = []
+        self._lock = threading.Lock()
+        # node -> pending tests, (size, rw) -> tests started on all nodes
+        self._pending = OrderedDict()
+        self._cell_tests = {}
+
+    def done_tests(self):
+        """(node, size, disk, rw) of tests finished with status 'ok'."""
+        status = OrderedDict()
+        for record in iter_journal(self.journal_path):
+            key = (record.get("node"), record["size"], record["disk"], record["rw"])
+            status[key] = record["status"]
+        return {key for key, s in status.items() if s == 'ok'}
+
+    def node_tests(self, node, done=()):
+        return [(str(block_size) + "K", disk, rw)
+                for block_size in self.block_sizes
+                for disk in self.nodes[node]
+                for rw in self.rw_list
+                if (node, str(block_size) + "K", disk, rw) not in done]
+
+    def next_test(self, node):
+        """Next test of node (see Controller), None if there are no more."""
+        with self._lock:
+            tests = self._pending[node]
+            if not tests:
+                return None
+            i = min(range(len(tests)), key=lambda i: (
+                self._cell_tests.get((tests[i][0], tests[i][2]), 0), i))
+            size, disk, rw = tests.pop(i)
+            self._cell_tests[(size, rw)] = self._cell_tests.get((size, rw), 0) + 1
+            return size, disk, rw
+
+    def drop_node(self, node, error):
+        print("\tnode {} dropped: {}".format(node, error))
+        with self._lock:
+            self.dropped.append(node)
+            tests, self._pending[node] = self._pending[node], []
+        for size, disk, rw in tests:
+            append_journal(self.journal_path, size, disk, rw, OrderedDict([
+                ("node", node), ("result", ""), ("status", 'failed'),
+                ("error", "node dropped")]))
+
+    def run_node_test(self, node, size, disk, rw):
+        config_path = os.path.join(
+            self.config_dir, "test_{}.ini".format(node_name(node)))
+        test = OrderedDict([("node", node), ("config", "")])
+        try:
+            test["config"] = config = fio_config(rw, int(size[:-1]), disk, self.iodepth,
+                                                 self.random_offset, local=self.local)
+            save_fio_config(config, config_path)
+            output = run_fio_client(node, config_path, self.runtime,
+                                    self.output_format, self.timeout)
+            test["result"] = output
+            test["status"] = test_status(output, self.runtime, self.output_format)
+        except ServerBusyError:
+            raise
+        except Exception as e:
+            test["result"] = ""
+            test["status"] = 'failed'
+            test["error"] = repr(e)
+        return test
+
+    def run_node(self, node):
+        failures = 0
+        while True:
+            test_key = self.next_test(node)
+            if test_key is None:
+                return
+            size, disk, rw = test_key
+            print("\t{} {} {} {}".format(node, size, disk, rw))
+            try:
+                test = self.run_node_test(node, size, disk, rw)
+            except ServerBusyError as e:
+                append_journal(self.journal_path, size, disk, rw, OrderedDict([
+                    ("node", node), ("result", ""), ("status", 'failed'),
+                    ("error", repr(e))]))
+                self.drop_node(node, repr(e))
+                return
+            append_journal(self.journal_path, size, disk, rw, test)
+            failures = failures + 1 if test["status"] == 'failed' else 0
+            if failures >= self.max_failures:
+                self.drop_node(node, "{} failed tests in a row".format(failures))
+                return
+
+    def run(self):
+        """Run all tests, tests finished in the journal are skipped."""
+        done = self.done_tests()
+        self.dropped = []
+        self._pending = OrderedDict((node, self.node_tests(node, done)) for node in self.nodes)
+        self._cell_tests = {}
+        for _, size, _, rw in done:
+            self._cell_tests[(size, rw)] = self._cell_tests.get((size, rw), 0) + 1
+        with ThreadPoolExecutor(max_workers=len(self.nodes)) as executor:
+            futures = [executor.submit(self.run_node, node) for node in self.nodes]
+            for future in futures:
+                future.result()
+        if self.dropped:
+            print("#dropped nodes: " + ", ".join(self.dropped))
+
+
+def node_summary(journal_path):
+    """Number of tests of every node by status (the last record of a test wins).
+
+    Returns:
+        summary (OrderedDict): node -> status -> number of tests.
+
+    """
+    status = OrderedDict()
+    for record in iter_journal(journal_path):
+        key = (record.get("node"), record["size"], record["disk"], record["rw"])
+        status[key] = record["status"]
+    summary = OrderedDict()
+    for (node, _, _, _), s in status.items():
+        node_statuses = summary.setdefault(node, OrderedDict())
+        node_statuses[s] = node_statuses.get(s, 0) + 1
+    return summary
+
+
+def node_results(journal_path):
+    """Journal of controller to results of run_test per node.
+
+    Returns:
+        results (OrderedDict): node -> size -> disk -> rw -> test,
+            the last record of a test wins, failed tests are skipped.
+
+    """
+    tests = OrderedDict()
+    for record in iter_journal(journal_path):
+        key = (record.pop("node"), record.pop("size"), record.pop("disk"),
+               record.pop("rw"))
+        tests.pop(key, None)
+        tests[key] = record
+    results = OrderedDict()
+    for (node, size, disk, rw), test in tests.items():
+        if test["status"] != 'failed':
+            results.setdefault(node, OrderedDict()).setdefault(
+                size, OrderedDict()).setdefault(disk, OrderedDict())[rw] = test
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nodes", "--nodes_path", type=str, default=None, required=False,
+                        help='json: {"host[,port]": ["sdb", ...], ...}')
+    parser.add_argument("-local", "--n_local_servers", type=int, default=None, required=False,
+                        help="start fio servers on localhost as the nodes (check without "
+                             "remote hosts)")
+    parser.add_argument("-disks", "--local_disks", type=str, nargs="+",
+                        default=["sparse:/tmp/fio_node{}.dat:256M"], required=False,
+                        help="disks of every local node, {} is the number of the server")
+    parser.add_argument("-port", "--port", type=int, default=FIO_PORT, required=False,
+                        help="port of the first local server")
+    parser.add_argument("-sizes", "--block_sizes", type=int, nargs="+",
+                        default=BLOCK_SIZES, required=False)
+    parser.add_argument("-journal", "--journal_path", type=str,
+                        default="fio_tests/nodes.jsonl", required=False)
+    parser.add_argument("-save", "--save_dir", type=str,
+                        default="fio_tests/nodes", required=False)
+    parser.add_argument("-runtime", "--runtime", type=int,
+                        default=RUNTIME, required=False)
+
+    args = parser.parse_args(args)
+    if (args.nodes_path is None) == (args.n_local_servers is None):
+        parser.error("one of -nodes and -local is required")
+
+    def run(nodes):
+        controller = Controller(nodes, args.journal_path, args.block_sizes,
+                                runtime=args.runtime, timeout=args.runtime * 3,
+                                local=args.n_local_servers is not None)
+        controller.run()
+
+    if args.nodes_path is not None:
+        with open(args.nodes_path, 'r') as fp:
+            run(json.load(fp, object_pairs_hook=OrderedDict))
+    else:
+        with local_fio_servers(args.n_local_servers, args.port) as servers:
+            nodes = OrderedDict(
+                (node, [disk.format(i) for disk in args.local_disks])
+                for i, node in enumerate(servers))
+            # local servers share the file system of the controller
+            with prepared_targets([disk for disks in nodes.values() for disk in disks]):
+                run(nodes)
+
+    os.makedirs(args.save_dir, exist_ok=True)
+    for node, result in node_results(args.journal_path).items():
+        save_json(result, os.path.join(
+            args.save_dir, "fio_tests_{}.json".format(node_name(node))))
+    failed = 0
+    for node, statuses in node_summary(args.journal_path).items():
+        print("{}: {}".format(node, ", ".join(
+            "{} {}".format(n, s) for s, n in statuses.items())))
+        failed += sum(n for s, n in statuses.items() if s == 'failed')
+    if args.n_local_servers is not None and failed:
+        sys.exit("local check: {} failed tests".format(failed))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,266 @@
+import argparse
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_accumulator import tree_result
+from fio_parse_cache import ParseCache
+from fio_parser_batch import expand_tests_path
+from fio_parser_config import accumulate_fio_tests
+from fio_parser_utils import OUTPUT_FORMATS, RW_MODES, save_json
+from utils import NestedDictEncoder, common_dict
+
+# MAD * MAD_SCALE estimates std of normal distribution
+MAD_SCALE = 1.4826
+ROBUST_AGGREGATORS = ["median", "trimmed_mean"]
+# modified z-score of outliers (Iglewicz and Hoaglin)
+OUTLIER_THRESHOLD = 3.5
+# +-inf z-scores (MAD is 0, see robust_z) are written to reports as +-MAX_Z
+MAX_Z = 1e6
+
+
+def trimmed_mean(values, proportion=0.1):
+    """Mean over axis 0 without proportion of the lowest and of the highest
+    values, nan are ignored."""
+    values = np.asarray(values, dtype=float)
+    n = np.sum(~np.isnan(values), axis=0)
+    k = np.floor(n * proportion).astype(int)
+    # nan are sorted last
+    values = np.sort(values, axis=0)
+    idx = np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1))
+    keep = (idx >= k) & (idx < n - k)
+    n_kept = n - 2 * k
+    total = np.sum(np.where(keep, values, 0), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n_kept > 0, total / n_kept, np.nan)
+
+
+def mad(values):
+    """Median absolute deviation over axis 0 (scaled to std), nan are ignored."""
+    values = np.asarray(values, dtype=float)
+    return MAD_SCALE * np.nanmedian(np.abs(values - np.nanmedian(values, axis=0)), axis=0)
+
+
+def robust_z(values):
+    """Modified z-scores over axis 0: (value - median) / (scaled MAD).
+
+    If MAD is 0 (more than half of the values are equal), the values
+    different from the median get +-inf.
+    """
+    values = np.asarray(values, dtype=float)
+    deviation = values - np.nanmedian(values, axis=0)
+    scale = mad(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = deviation / scale
+    return np.where(deviation == 0, 0.0, z)
+
+
+def report_z(z):
+    """z-score for json: None if nan, +-inf clipped to +-MAX_Z."""
+    if np.isnan(z):
+        return None
+    return float(np.clip(z, -MAX_Z, MAX_Z))
+
+
+def aggregate(values, method="median", proportion=0.1):
+    """Robust mean of values over axis 0."""
+    if method == "median":
+        return np.nanmedian(values, axis=0)
+    if method == "trimmed_mean":
+        return trimmed_mean(values, proportion)
+    raise ValueError("Unknown aggregator '{}'".format(method))
+
+
+def disk_profiles(json_paths, output_type="normal", cache=None):
+    """Packet configs of every disk alone.
+
+    Args:
+        json_paths (str or list of str): test files (see
+            fio_run_utils.run_test), the tests of a disk in all files are
+            pooled (random sampling leaves a disk with a few sizes per file).
+
+    Returns:
+        profiles (OrderedDict): disk -> size -> packet config of the size
+            (see fio_parser_config.parse_fio_tests).
+
+    """
+    if isinstance(json_paths, str):
+        json_paths = [json_paths]
+    disk_accumulators = OrderedDict()
+    for json_path in json_paths:
+        accumulate_fio_tests(json_path, output_type, cache=cache,
+                             disk_accumulators=disk_accumulators)
+    return tree_result(disk_accumulators)
+
+
+def robust_packet_config(profiles, method="median", proportion=0.1):
+    """Packet config pooled over disks by a robust aggregator.
+
+    Every mean is the median (or trimmed mean) of the means of the disks,
+    std_dev is the scaled MAD of the means of the disks, so a few
+    degraded disks don't move it.
+
+    Args:
+        profiles (OrderedDict): see disk_profiles.
+        method ('median' or 'trimmed_mean'): aggregator of the means.
+        proportion (float): proportion of trimmed means on every side.
+
+    Returns:
+        packet_config (OrderedDict): packet config.
+
+    """
+    sizes = OrderedDict((size, None) for disk_sizes in profiles.values() for size in disk_sizes)
+    packet_config = OrderedDict()
+    for size in sizes:
+        configs = [disk_sizes[size] for disk_sizes in profiles.values() if size in disk_sizes]
+        encoder = NestedDictEncoder(common_dict(configs))
+        values = encoder.encode_batch(configs)
+        keys = np.array(encoder.keys_list())
+        idx_mean = keys == 'mean'
+        idx_std = keys == 'std_dev'
+
+        robust_values = values[0].copy()
+        robust_values[idx_mean] = aggregate(values[:, idx_mean], method, proportion)
+        robust_values[idx_std] = mad(values[:, idx_mean])
+        packet_config[size] = encoder.decode(robust_values)
+    return packet_config
+
+
+def profile_metrics(profiles):
+    """Latency and IOPS of every disk and size.
+
+    Returns:
+        metrics (OrderedDict): metric -> (values, sign), values are disks x
+            sizes (nan if a disk has no size), sign is 1 if higher values
+            are worse (latency) and -1 otherwise (IOPS).
+        sizes (list): sizes.
+
+    """
+    sizes = list(OrderedDict(
+        (size, None) for disk_sizes in profiles.values() for size in disk_sizes))
+
+    def values(get):
+        return np.array([[get(disk_sizes[size]) if size in disk_sizes else np.nan
+                          for size in sizes] for disk_sizes in profiles.values()])
+
+    metrics = OrderedDict()
+    metrics["latency_time"] = (values(lambda config: config["latency_time"]["mean"]), 1)
+    for mode in RW_MODES.values():
+        # seek time is 1 / IOPS
+        metrics[mode + "_iops"] = (
+            1 / values(lambda config: config[mode]["seek_time"]["mean"]), -1)
+    return metrics, sizes
+
+
+def outlier_report(profiles, threshold=OUTLIER_THRESHOLD, min_fraction=0.5, min_sizes=2):
+    """Disks with latency or IOPS out of family across block sizes.
+
+    For every size and metric the disks get modified z-scores (see
+    robust_z), a disk is out of family at the size if its z-score is worse
+    than threshold (higher latency, lower IOPS). A disk is slow if it is
+    out of family at min_fraction of the sizes or more and at min_sizes
+    sizes at least for some metric. Disks tested at less than min_sizes
+    sizes can't be consistently out of family, they are reported as
+    having insufficient data instead.
+
+    Args:
+        profiles (OrderedDict): see disk_profiles.
+        threshold (float): z-score of outliers.
+        min_fraction (float): fraction of the sizes.
+        min_sizes (int): number of the sizes.
+
+    Returns:
+        report (OrderedDict): "slow_disks" (list), "insufficient_data"
+            (list of disks with less than min_sizes sizes) and "disks":
+            disk -> "slow", "sizes" (number of the sizes of the disk) and
+            metric -> "fraction" (of the sizes out of family), "median_z"
+            (None if the disk has no z-scores) and "z" (size -> z-score,
+            signed as badness), z-scores are clipped to +-MAX_Z.
+
+    """
+    metrics, sizes = profile_metrics(profiles)
+    disks = list(profiles)
+    n_sizes = {disk: len(profiles[disk]) for disk in disks}
+    disk_reports = OrderedDict(
+        (disk, OrderedDict([("slow", False), ("sizes", n_sizes[disk])])) for disk in disks)
+    for metric, (values, sign) in metrics.items():
+        badness = sign * robust_z(values)
+        valid = ~np.isnan(badness)
+        n_valid = np.maximum(valid.sum(axis=1), 1)
+        n_out = np.sum(valid & (badness > threshold), axis=1)
+        fraction = n_out / n_valid
+        slow = (fraction >= min_fraction) & (n_out >= min_sizes)
+        for i, disk in enumerate(disks):
+            disk_reports[disk][metric] = OrderedDict([
+                ("fraction", float(fraction[i])),
+                ("median_z", report_z(np.nanmedian(badness[i])) if valid[i].any() else None),
+                ("z", OrderedDict(
+                    (size, report_z(z)) for size, z, v in zip(sizes, badness[i], valid[i]) if v)),
+            ])
+            if slow[i]:
+                disk_reports[disk]["slow"] = True
+    return OrderedDict([
+        ("threshold", threshold),
+        ("min_fraction", min_fraction),
+        ("min_sizes", min_sizes),
+        ("slow_disks", [disk for disk in disks if disk_reports[disk]["slow"]]),
+        ("insufficient_data", [disk for disk in disks if n_sizes[disk] < min_sizes]),
+        ("disks", disk_reports),
+    ])
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-test", "--test_paths", type=str, nargs="+",
+                        default=["fio_tests/fio_tests_0.json"], required=False,
+                        help="test files, dirs or globs, the tests of a disk are pooled")
+    parser.add_argument("-format", "--output_format", type=str, choices=OUTPUT_FORMATS,
+                        default="normal", required=False)
+    parser.add_argument("-cache", "--cache_path", type=str, default=None, required=False,
+                        help="parse cache (see fio_parse_cache)")
+    parser.add_argument("-profiles", "--save_profiles_path", type=str,
+                        default=None, required=False, help="packet configs of the disks")
+    parser.add_argument("-config", "--save_config_path", type=str,
+                        default=None, required=False, help="robust packet config")
+    parser.add_argument("-aggregate", "--aggregator", type=str, choices=ROBUST_AGGREGATORS,
+                        default="median", required=False)
+    parser.add_argument("-report", "--save_report_path", type=str,
+                        default=None, required=False, help="outlier report")
+    parser.add_argument("-threshold", "--threshold", type=float,
+                        default=OUTLIER_THRESHOLD, required=False)
+    parser.add_argument("-min_fraction", "--min_fraction", type=float,
+                        default=0.5, required=False)
+    parser.add_argument("-min_sizes", "--min_sizes", type=int, default=2, required=False)
+
+    args = parser.parse_args(args)
+
+    test_paths = [path for test_path in args.test_paths
+                  for path in expand_tests_path(test_path)]
+    if args.cache_path is None:
+        profiles = disk_profiles(test_paths, args.output_format)
+    else:
+        with ParseCache(args.cache_path) as cache:
+            profiles = disk_profiles(test_paths, args.output_format, cache)
+    if args.save_profiles_path is not None:
+        save_json(profiles, args.save_profiles_path)
+    if args.save_config_path is not None:
+        save_json(robust_packet_config(profiles, args.aggregator), args.save_config_path)
+
+    report = outlier_report(profiles, args.threshold, args.min_fraction, args.min_sizes)
+    if args.save_report_path is not None:
+        save_json(report, args.save_report_path)
+    for disk in report["slow_disks"]:
+        metrics = ["{} {:.0%}".format(metric, value["fraction"])
+                   for metric, value in report["disks"][disk].items()
+                   if isinstance(value, dict) and value["fraction"] > 0]
+        print("slow disk: {} ({})".format(disk, ", ".join(metrics)))
+    if not report["slow_disks"]:
+        print("no slow disks")
+    if report["insufficient_data"]:
+        print("insufficient data (less than {} sizes): {}".format(
+            args.min_sizes, ", ".join(report["insufficient_data"])))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,242 @@
+import argparse
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_parser_utils import save_json, read_json
+
+# fio >= 3 logs latencies in nsec
+LOG_UNIT = 1e-9
+# direction of a log line (ddir column)
+FIO_DDIRS = ["read", "write", "trim"]
+# clat histogram bins of fio (FIO_IO_U_PLAT_BITS, FIO_IO_U_PLAT_VAL of stat.h)
+FIO_PLAT_BITS = 6
+FIO_PLAT_VAL = 1 << FIO_PLAT_BITS
+
+# log-scale histogram edges (sec): 100 ns ~ 100 s, 20 bins per decade
+HIST_EDGES = np.logspace(-7, 2, 9 * 20 + 1)
+QUANTILES = [0.5, 0.9, 0.99, 0.999, 0.9999]
+# bytes of a log read at once, temp arrays take ~20x of it
+CHUNK_SIZE = 16 * 2**20
+
+_POW10 = 10 ** np.arange(19, dtype=np.int64)
+_NEWLINE = ord("\n")
+
+
+def parse_int_lines(buf):
+    """Parse lines of comma separated non-negative integers (fio log).
+
+    Args:
+        buf (np.ndarray of uint8): text of whole lines.
+
+    Returns:
+        values (np.ndarray of int64): lines x columns.
+
+    """
+    digits = buf - np.uint8(ord("0"))  # not digits wrap above 9
+    is_digit = digits < 10
+    after_digit = np.zeros_like(is_digit)
+    after_digit[1:] = is_digit[:-1]
+    before_digit = np.zeros_like(is_digit)
+    before_digit[:-1] = is_digit[1:]
+    starts = np.flatnonzero(is_digit & ~after_digit)
+    ends = np.flatnonzero(is_digit & ~before_digit)
+    if not len(starts):
+        return np.zeros((0, 0), dtype=np.int64)
+
+    # value of a number = sum of its digits * 10 ** (digits to its end)
+    positions = np.flatnonzero(is_digit)
+    number = np.cumsum(is_digit[positions] & ~after_digit[positions]) - 1
+    weighted = digits[positions].astype(np.int64) * _POW10[ends[number] - positions]
+    values = np.add.reduceat(weighted, np.searchsorted(positions, starts))
+
+    # every line of a log has the same number of columns
+    line_starts = np.searchsorted(np.flatnonzero(buf == _NEWLINE), starts)
+    columns = np.bincount(line_starts)
+    columns = columns[columns > 0]
+    if np.any(columns != columns[0]):
+        raise ValueError("fio log lines have different numbers of columns")
+    return values.reshape(-1, columns[0])
+
+
+def iter_log_chunks(path, chunk_size=CHUNK_SIZE):
+    """Iterate over a fio log by chunks of whole lines, without reading
+    the file into memory (memory map).
+
+    Yields:
+        values (np.ndarray of int64): lines x columns of the chunk.
+
+    """
+    if not os.path.getsize(path):
+        return
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    start = 0
+    while start < len(buf):
+        end = min(start + chunk_size, len(buf))
+        if end < len(buf):
+            newlines = np.flatnonzero(buf[start:end] == _NEWLINE)
+            if len(newlines):
+                end = start + newlines[-1] + 1
+            else:
+                # line longer than chunk
+                newline = np.flatnonzero(buf[end:] == _NEWLINE)
+                end = end + newline[0] + 1 if len(newline) else len(buf)
+        values = parse_int_lines(np.asarray(buf[start:end]))
+        if len(values):
+            yield values
+        start = end
+
+
+def bin_index(values, edges=HIST_EDGES):
+    """Histogram bin of values, values outside edges go to the first/last bin."""
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+
+
+def plat_idx_to_val(idx, edge=0.5):
+    """Latency (log units) of fio histogram bin (fio's plat_idx_to_val).
+
+    Args:
+        idx (array of int): bin indices.
+        edge (float): position in bin, 0.5 is the middle.
+
+    """
+    idx = np.asarray(idx, dtype=np.int64)
+    # bins of 2 * FIO_PLAT_VAL first values are exact
+    error_bits = np.maximum((idx >> FIO_PLAT_BITS) - 1, 0)
+    base = np.left_shift(np.int64(1), error_bits + FIO_PLAT_BITS)
+    value = base + (idx % FIO_PLAT_VAL + edge) * np.left_shift(np.int64(1), error_bits)
+    return np.where(idx < 2 * FIO_PLAT_VAL, idx, value)
+
+
+def lat_log_histogram(path, edges=HIST_EDGES, unit=LOG_UNIT, chunk_size=CHUNK_SIZE):
+    """Histogram of per-IO latency log (write_lat_log).
+
+    Log line: time (msec), latency, ddir, block size[, offset].
+
+    Returns:
+        counts (np.ndarray of int64): direction (FIO_DDIRS) x bins.
+
+    """
+    n_bins = len(edges) - 1
+    counts = np.zeros(len(FIO_DDIRS) * n_bins, dtype=np.int64)
+    for values in iter_log_chunks(path, chunk_size):
+        bins = bin_index(values[:, 1] * unit, edges)
+        counts += np.bincount(values[:, 2] * n_bins + bins,
+                              minlength=len(counts))[:len(counts)]
+    return counts.reshape(len(FIO_DDIRS), n_bins)
+
+
+def hist_log_histogram(path, edges=HIST_EDGES, unit=LOG_UNIT, chunk_size=CHUNK_SIZE):
+    """Histogram of clat histogram log (write_hist_log).
+
+    Log line: time (msec), ddir, block size, counts of fio bins in the
+    interval. fio bins are rebinned by their middle value.
+
+    Returns:
+        counts (np.ndarray of int64): direction (FIO_DDIRS) x bins.
+
+    """
+    fio_counts = None
+    for values in iter_log_chunks(path, chunk_size):
+        if fio_counts is None:
+            fio_counts = np.zeros((len(FIO_DDIRS), values.shape[1] - 3), dtype=np.int64)
+        for ddir in range(len(FIO_DDIRS)):
+            fio_counts[ddir] += values[values[:, 1] == ddir, 3:].sum(axis=0)
+
+    n_bins = len(edges) - 1
+    counts = np.zeros((len(FIO_DDIRS), n_bins), dtype=np.int64)
+    if fio_counts is None:
+        return counts
+    bins = bin_index(plat_idx_to_val(np.arange(fio_counts.shape[1])) * unit, edges)
+    for ddir in range(len(FIO_DDIRS)):
+        counts[ddir] = np.bincount(bins, weights=fio_counts[ddir], minlength=n_bins)
+    return counts
+
+
+def histogram_quantiles(counts, edges=HIST_EDGES, quantiles=QUANTILES):
+    """Quantiles of log-scale histogram (log-linear in a bin).
+
+    Returns:
+        values (np.ndarray): quantile values, nan if the histogram is empty.
+
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum()
+    if not total:
+        return np.full(len(quantiles), np.nan)
+    cdf = np.cumsum(counts) / total
+    idx = np.minimum(np.searchsorted(cdf, quantiles), len(counts) - 1)
+    below = np.where(idx > 0, cdf[idx - 1], 0)
+    position = (np.asarray(quantiles) - below) / np.maximum(cdf[idx] - below, 1e-300)
+    log_edges = np.log(edges)
+    return np.exp(log_edges[idx] + position * (log_edges[idx + 1] - log_edges[idx]))
+
+
+def quantile_name(q):
+    return "p{:g}".format(q * 100)
+
+
+def ingest_logs(logs, edges=HIST_EDGES, unit=LOG_UNIT, chunk_size=CHUNK_SIZE):
+    """Histograms of the fio logs of one test (test["logs"] of run_test).
+
+    Args:
+        logs (dict): kind ('slat', 'clat', 'lat' or 'clat_hist') -> log paths,
+            logs of a kind (job processes) are summed.
+
+    Returns:
+        hists (OrderedDict): kind -> direction -> {"count", "counts",
+            "quantiles"}, directions without IOs are skipped.
+
+    """
+    hists = OrderedDict()
+    for kind, paths in logs.items():
+        log_histogram = hist_log_histogram if kind == 'clat_hist' else lat_log_histogram
+        counts = sum(log_histogram(path, edges, unit, chunk_size) for path in paths)
+        hists[kind] = OrderedDict()
+        for ddir, direction in enumerate(FIO_DDIRS):
+            if not counts[ddir].any():
+                continue
+            hists[kind][direction] = OrderedDict([
+                ("count", int(counts[ddir].sum())),
+                ("counts", counts[ddir].tolist()),
+                ("quantiles", OrderedDict(
+                    (quantile_name(q), value) for q, value in zip(
+                        QUANTILES, histogram_quantiles(counts[ddir], edges).tolist()))),
+            ])
+    return hists
+
+
+def ingest_test_logs(json_path, edges=HIST_EDGES, unit=LOG_UNIT):
+    """Histograms of the fio logs of every test of run_test result.
+
+    Returns:
+        hists (OrderedDict): "edges" (sec) and size -> disk -> rw -> kind ->
+            direction -> histogram (see ingest_logs).
+
+    """
+    hists = OrderedDict([("edges", list(edges))])
+    for size, disks in read_json(json_path).items():
+        for disk, tests in disks.items():
+            for rw, test in tests.items():
+                if test.get("logs"):
+                    hists.setdefault(size, OrderedDict()).setdefault(
+                        disk, OrderedDict())[rw] = ingest_logs(test["logs"], edges, unit)
+    return hists
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-test", "--test_path", type=str,
+                        default="fio_tests/fio_tests_0.json", required=False)
+    parser.add_argument("-save", "--save_path", type=str,
+                        default="hists/log_hists_0.json", required=False)
+
+    args = parser.parse_args(args)
+
+    save_json(ingest_test_logs(args.test_path), args.save_path)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_parser_utils import (
+    METRICS, PARSER_VERSION, parse_result_metrics, parse_result_tails, test_directions
+)
+
+CACHE_PATH = "fio_parse_cache.sqlite"
+CACHE_MAX_BYTES = 2 ** 30
+# puts of one transaction
+CACHE_COMMIT_EVERY = 1000
+
+
+def parse_key(result, test_name, output_format, kind="metrics"):
+    """Content address of a parse: sha256 of parser version, kind of parse
+    ('metrics' or 'tails'), format, test name and fio output."""
+    h = hashlib.sha256()
+    for part in (str(PARSER_VERSION), kind, output_format, test_name):
+        h.update(part.encode('utf-8'))
+        h.update(b"\0")
+    h.update(result.encode('utf-8'))
+    return h.hexdigest()
+
+
+class ParseCache():
+    """On-disk cache of parsed metrics (parse_result_metrics) and tails
+    (parse_result_tails) of fio outputs.
+
+    Entries are keyed by parse_key, so raw results that were parsed once
+    are a lookup afterwards, whatever file they come from. Entries of other
+    parser versions are dropped on open. When the cache grows over
+    max_bytes, the least recently used entries are evicted.
+
+    The cache is an sqlite file, so it can be shared by processes (every
+    process opens its own ParseCache). Puts are committed every
+    CACHE_COMMIT_EVERY puts and on flush/close.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        '''
+        Args:
+            path (str): cache file.
+            max_bytes (int): max size of cached metrics (bytes).
+
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._used = {}
+        self._puts = 0
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, "
+                "version INTEGER, metrics TEXT, size INTEGER, used REAL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self._connection.execute(
+                "DELETE FROM entries WHERE version != ?", (PARSER_VERSION,))
+        self._size = self._total_size()
+
+    def _total_size(self):
+        return self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _get_value(self, key):
+        row = self._connection.execute(
+            "SELECT metrics FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = time.time()
+        return json.loads(row[0])
+
+    def get(self, key, test_name):
+        """Cached metrics of key or None."""
+        values = self._get_value(key)
+        if values is None:
+            return None
+        # flat list: direction -> metric -> mean, std_dev
+        values = iter(values)
+        return OrderedDict(
+            (direction, OrderedDict(
+                (metric, (next(values), next(values))) for metric in METRICS))
+            for direction in test_directions(test_name))
+
+    def get_tails(self, key):
+        """Cached tails of key or None."""
+        value = self._get_value(key)
+        if value is None:
+            return None
+        percentiles, buckets, ios = value
+        return OrderedDict([
+            ("percentiles", OrderedDict(
+                (metric, OrderedDict(
+                    (direction, (np.array(q), np.array(v)))
+                    for direction, (q, v) in directions))
+                for metric, directions in percentiles)),
+            ("lat_buckets", np.array(buckets)),
+            ("ios", OrderedDict(ios)),
+        ])
+
+    def put(self, key, metrics):
+        self._put_value(key, [x for direction_metrics in metrics.values()
+                              for metric in METRICS for x in direction_metrics[metric]])
+
+    def put_tails(self, key, tails):
+        self._put_value(key, [
+            [(metric, [(direction, (q.tolist(), v.tolist()))
+                       for direction, (q, v) in directions.items()])
+             for metric, directions in tails["percentiles"].items()],
+            tails["lat_buckets"].tolist(),
+            list(tails["ios"].items()),
+        ])
+
+    def _put_value(self, key, value):
+        value = json.dumps(value)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            (key, PARSER_VERSION, value, len(value), time.time()))
+        self._size += len(value)
+        self._puts += 1
+        if self._puts % CACHE_COMMIT_EVERY == 0:
+            self._connection.commit()
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def parse(self, result, test_name, output_format="normal"):
+        """parse_result_metrics through the cache."""
+        key = parse_key(result, test_name, output_format)
+        metrics = self.get(key, test_name)
+        if metrics is None:
+            metrics = parse_result_metrics(result, test_name, output_format)
+            self.put(key, metrics)
+        return metrics
+
+    def parse_tails(self, result, test_name, output_format="normal"):
+        """parse_result_tails through the cache."""
+        key = parse_key(result, test_name, output_format, "tails")
+        tails = self.get_tails(key)
+        if tails is None:
+            tails = parse_result_tails(result, test_name, output_format)
+            self.put_tails(key, tails)
+        return tails
+
+    def evict(self, target_ratio=0.9):
+        """Drop least recently used entries until the cache is below
+        target_ratio * max_bytes."""
+        self.flush()
+        # other processes may have added or evicted entries
+        self._size = self._total_size()
+        if self._size <= self.max_bytes:
+            return
+        excess = self._size - target_ratio * self.max_bytes
+        keys = []
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM entries ORDER BY used"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        with self._connection:
+            self._connection.executemany("DELETE FROM entries WHERE key = ?", keys)
+        self._size = self._total_size()
+
+    def flush(self):
+        """Commit puts and save last use times of the hits (LRU order of
+        eviction)."""
+        with self._connection:
+            if self._used:
+                self._connection.executemany(
+                    "UPDATE entries SET used = ? WHERE key = ?",
+                    [(used, key) for key, used in self._used.items()])
+                self._used = {}
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
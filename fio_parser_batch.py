@@ -0,0 +1,175 @@
+import argparse
+import glob
+import os
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fio_accumulator import merge_trees, read_accumulators, save_accumulators, tree_result
+from fio_parse_cache import ParseCache
+from fio_parser_config import accumulate_fio_tests
+from fio_parser_utils import OUTPUT_FORMATS, UNCERTAINTY_METHODS, save_json
+from fio_store import file_metrics, write_store
+from utils import NestedDictEncoder, common_dict
+
+
+def natural_key(path):
+    """Sort key of paths with numbers ("fio_tests_2" < "fio_tests_10")."""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r"(\d+)", path)]
+
+
+def expand_tests_path(tests_path):
+    """Test files of a dir (*.json) or a glob, naturally sorted."""
+    if os.path.isdir(tests_path):
+        tests_path = os.path.join(tests_path, "*.json")
+    return sorted(glob.glob(tests_path), key=natural_key)
+
+
+def config_path(test_path, save_dir):
+    """Packet config path of test file: fio_tests_3.json -> packet_config_3.json."""
+    name = os.path.basename(test_path)
+    if name.startswith("fio_tests"):
+        name = "packet_config" + name[len("fio_tests"):]
+    return os.path.join(save_dir, name)
+
+
+def parse_test_file(test_path, save_path, output_type="normal", uncertainty="delta",
+                    seed=None, with_metrics=False, cache_path=None):
+    """Parse one test file and save its packet config (runs in a worker).
+
+    Returns:
+        accumulators (OrderedDict): accumulators of packet config (see
+            fio_parser_config.accumulate_fio_tests).
+        metrics (OrderedDict or None): metrics of the tests if with_metrics
+            (see fio_store.file_metrics).
+
+    """
+    cache = ParseCache(cache_path) if cache_path is not None else None
+    try:
+        accumulators = accumulate_fio_tests(test_path, output_type, uncertainty, seed, cache)
+        save_json(tree_result(accumulators), save_path)
+        metrics = file_metrics(test_path, output_type, cache=cache) if with_metrics else None
+    finally:
+        if cache is not None:
+            cache.close()
+    return accumulators, metrics
+
+
+def average_configs(configs):
+    """Average packet configs of runs: mean of means, std_dev is the std
+    of means (spread between the runs). Parameters missing in some configs
+    (e.g. optional latency percentiles) are left out."""
+    encoder = NestedDictEncoder(common_dict(configs))
+    values = encoder.encode_batch(configs)
+    keys = np.array(encoder.keys_list())
+    idx_mean = keys == 'mean'
+    idx_std = keys == 'std_dev'
+
+    av_values_sample = values[0].copy()
+    av_values_sample[idx_mean] = np.mean(values[:, idx_mean], axis=0)
+    av_values_sample[idx_std] = np.std(values[:, idx_mean], axis=0)
+    return encoder.decode(av_values_sample)
+
+
+def parse_batch(tests_path, save_dir, output_type="normal", uncertainty="delta",
+                seed=None, n_workers=None, store_path=None, cache_path=None):
+    """Parse test files in parallel.
+
+    Args:
+        tests_path (str): dir or glob of test files (see fio_run_utils.run_test).
+        save_dir (str): dir of packet configs.
+        seed (int or None): seed of bootstrap, file i gets seed + i.
+        n_workers (int or None): worker processes, number of CPUs if None.
+        store_path (str or None): also write metrics of all tests to the
+            columnar store (see fio_store), a file is a run.
+        cache_path (str or None): parse cache shared by the workers (see
+            fio_parse_cache).
+
+    Other args are the same as in fio_parser_config.parse_fio_tests.
+
+    Returns:
+        configs (OrderedDict): test path -> packet config, files that
+            failed to parse are skipped.
+        accumulators (OrderedDict): accumulators of all files merged (see
+            fio_accumulator).
+
+    """
+    test_paths = expand_tests_path(tests_path)
+    os.makedirs(save_dir, exist_ok=True)
+    configs = OrderedDict()
+    accumulators = OrderedDict()
+    metrics = OrderedDict()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(parse_test_file, test_path,
+                                   config_path(test_path, save_dir),
+                                   output_type, uncertainty,
+                                   None if seed is None else seed + i,
+                                   store_path is not None, cache_path)
+                   for i, test_path in enumerate(test_paths)]
+        for test_path, future in zip(test_paths, futures):
+            try:
+                file_accumulators, file_metrics_ = future.result()
+                print("parsed: {}".format(test_path))
+            except Exception as e:
+                print("failed: {}: {!r}".format(test_path, e))
+                continue
+            configs[test_path] = tree_result(file_accumulators)
+            merge_trees(accumulators, file_accumulators)
+            if store_path is not None:
+                metrics.update(file_metrics_)
+    if store_path is not None and metrics:
+        write_store(store_path, metrics)
+    return configs, accumulators
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    # no defaults: a bare run must not overwrite the committed packet configs
+    parser.add_argument("-tests", "--tests_path", type=str, required=True,
+                        help="dir or glob of test files")
+    parser.add_argument("-final", "--final_config_prefix", type=str, required=True,
+                        help="averaged configs: <prefix>_ORIGIN.json (all tests), "
+                             "<prefix>_SAMPLE.json (spread between files)")
+    parser.add_argument("-save_dir", "--save_dir", type=str, default=None, required=False,
+                        help="packet configs of the files, dir of -final if not set")
+    parser.add_argument("-format", "--output_format", type=str, choices=OUTPUT_FORMATS,
+                        default="normal", required=False)
+    parser.add_argument("-uncertainty", "--uncertainty", type=str,
+                        choices=UNCERTAINTY_METHODS, default="delta", required=False)
+    parser.add_argument("-seed", "--seed", type=int, default=None, required=False)
+    parser.add_argument("-workers", "--n_workers", type=int, default=None, required=False)
+    parser.add_argument("-store", "--store_path", type=str, default=None, required=False,
+                        help="dir of columnar store of all metrics (see fio_store)")
+    parser.add_argument("-cache", "--cache_path", type=str, default=None, required=False,
+                        help="parse cache (see fio_parse_cache)")
+    parser.add_argument("-acc", "--save_accumulators_path", type=str, default=None,
+                        required=False, help="save merged accumulators (see fio_accumulator)")
+    parser.add_argument("-merge", "--merge_accumulators_paths", type=str, nargs="*",
+                        default=[], required=False,
+                        help="accumulators of other campaigns/nodes to merge into ORIGIN")
+
+    args = parser.parse_args(args)
+
+    save_dir = args.save_dir
+    if save_dir is None:
+        save_dir = os.path.dirname(args.final_config_prefix) or "."
+    configs, accumulators = parse_batch(
+        args.tests_path, save_dir, args.output_format, args.uncertainty, args.seed,
+        args.n_workers, args.store_path, args.cache_path)
+    if not configs:
+        print("no test files parsed")
+        return
+    for path in args.merge_accumulators_paths:
+        merge_trees(accumulators, read_accumulators(path))
+    if args.save_accumulators_path is not None:
+        save_accumulators(accumulators, args.save_accumulators_path)
+    save_json(tree_result(accumulators), args.final_config_prefix + "_ORIGIN.json")
+    save_json(average_configs(list(configs.values())), args.final_config_prefix + "_SAMPLE.json")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
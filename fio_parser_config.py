@@ -2,181 +2,198 @@ import argparse
 import sys
 from collections import OrderedDict
 
+import numpy as np
+
+from fio_accumulator import MeanStdAccumulator, tree_result
+from fio_parse_cache import ParseCache
 from fio_parser_utils import (
-    TIME_MULTS, READ_TEST_NAMES, WRITE_TEST_NAMES, READ_WRITE_TEST_NAMES,
-    parse_transmission_time, parse_latency_time, parse_processing_time,
-    parse_rate_time, parse_seek_time, parse_overheads_time, aggregate_rw,
-    mean_std_lists_to_Ordered_dict, separate_rw_result, save_json, read_json
+    READ_TEST_NAMES, WRITE_TEST_NAMES, READ_WRITE_TEST_NAMES, RW_MODES,
+    OUTPUT_FORMATS, UNCERTAINTY_METHODS, LAT_BUCKETS, PERCENTILE_METRICS, iter_test_results,
+    parse_result_metrics, parse_result_tails, percentile_values, rate_time,
+    seek_time, parse_overheads_time, save_json
 )
 
+# latency percentiles of the modes in packet config
+TAIL_PERCENTILES = [50, 95, 99, 99.9]
+COMMON_PARAMS = ["transmission_time", "latency_time",
+                 "read_processing_time", "write_processing_time"]
 
-def parse_fio_tests(json_path="fio_tests_node_1.json", output_type="normal"):
-    """Parse fio tests.
 
-    TODO:
-        add "json" to output_type.
+def percentile_name(percentile):
+    return "p{:g}".format(percentile)
+
+
+def bucket_name(bucket):
+    """Name of fio lat bucket: ('usec', '250') -> '250us'."""
+    unit, label = bucket
+    return label + unit[0] + "s"
+
+
+def size_accumulators(block_size):
+    """Accumulators of packet config of one block size.
+
+    Percentiles of a latency ("<metric>_percentiles") are only in the fio
+    output with the job options of the metric (clat ones by default), the
+    accumulators without values are left out of the result (see
+    fio_accumulator.tree_result).
+    """
+    accumulators = OrderedDict([("size", block_size)])
+    for name in COMMON_PARAMS:
+        accumulators[name] = MeanStdAccumulator()
+    for mode in RW_MODES.values():
+        accumulators[mode] = OrderedDict([
+            ("rate_time", MeanStdAccumulator()),
+            ("seek_time", MeanStdAccumulator()),
+            ("overheads_time", MeanStdAccumulator()),
+        ] + [
+            (metric + "_percentiles", OrderedDict(
+                (percentile_name(p), MeanStdAccumulator()) for p in TAIL_PERCENTILES))
+            for metric in PERCENTILE_METRICS
+        ] + [
+            ("lat_buckets", OrderedDict(
+                (bucket_name(bucket), MeanStdAccumulator()) for bucket in LAT_BUCKETS)),
+        ])
+    return accumulators
+
+
+def test_values(test_name, metrics, tails, overheads, block_size, uncertainty="delta",
+                random_state=None):
+    """Values of parsed test for accumulators of its block size.
+
+    Every direction of a test is a value of the common parameters and of
+    the mode of the test. Lat buckets are weighted by numbers of IOs.
+
+    Args:
+        metrics (OrderedDict): see fio_parser_utils.parse_result_metrics.
+        tails (OrderedDict): see fio_parser_utils.parse_result_tails.
+        overheads (tuple): see fio_parser_utils.parse_overheads_time.
+
+    Returns:
+        values (list): (keys of accumulator, mean, std_dev, weight), see
+            size_accumulators.
+
+    """
+    mode = RW_MODES[test_name]
+    directions = list(metrics)
+    bw = np.array([metrics[direction]["bw"] for direction in directions])
+    iops = np.array([metrics[direction]["iops"] for direction in directions])
+    rate_means, rate_std_devs = rate_time(
+        bw[:, 0], bw[:, 1], block_size, uncertainty, random_state)
+    seek_means, seek_std_devs = seek_time(
+        iops[:, 0], iops[:, 1], uncertainty, random_state)
+
+    values = []
+    for i, direction in enumerate(directions):
+        direction_metrics = metrics[direction]
+        values += [
+            (("transmission_time",), *direction_metrics["slat"], 1),
+            (("latency_time",), *direction_metrics["lat"], 1),
+            ((direction + "_processing_time",), *direction_metrics["clat"], 1),
+            ((mode, "rate_time"), rate_means[i], rate_std_devs[i], 1),
+            ((mode, "seek_time"), seek_means[i], seek_std_devs[i], 1),
+            ((mode, "overheads_time"), *overheads, 1),
+        ]
+        for metric in PERCENTILE_METRICS:
+            percentiles = percentile_values(
+                *tails["percentiles"][metric][direction], TAIL_PERCENTILES)
+            for p, value in zip(TAIL_PERCENTILES, percentiles):
+                if not np.isnan(value):
+                    values.append(
+                        ((mode, metric + "_percentiles", percentile_name(p)), value, 0, 1))
+
+    ios = sum(tails["ios"].values()) or 1
+    for bucket, fraction in zip(LAT_BUCKETS, tails["lat_buckets"]):
+        values.append(((mode, "lat_buckets", bucket_name(bucket)), fraction, 0, ios))
+    return values
+
+
+def add_values(accumulators, values):
+    """Add test_values to accumulators of a block size."""
+    for keys, mean, std_dev, weight in values:
+        accumulator = accumulators
+        for key in keys:
+            accumulator = accumulator[key]
+        accumulator.add(mean, std_dev, weight)
+
+
+def accumulate_fio_tests(json_path="fio_tests_node_1.json", output_type="normal",
+                         uncertainty="delta", seed=None, cache=None, disk_accumulators=None):
+    """Parse fio tests into accumulators of packet config (streamed, see
+    fio_accumulator).
+
+    Args:
+        disk_accumulators (dict or None): gets per-disk accumulators if
+            given, disk -> size -> accumulators of the disk alone.
+
+    Other args are the same as in parse_fio_tests.
+
+    Returns:
+        accumulators (OrderedDict): size -> packet config of the size with
+            MeanStdAccumulator values (see size_accumulators).
+
     """
-    test_result = read_json(json_path)
-    packet_config = OrderedDict()
+    accumulators = OrderedDict()
+    disks = OrderedDict()
+    random_state = np.random.RandomState(seed)
+    parse = parse_result_metrics if cache is None else cache.parse
+    parse_tails = parse_result_tails if cache is None else cache.parse_tails
 
-    for size_str, disks in test_result.items():
+    for _, size_str, disk, test_name, result in iter_test_results(json_path, runs=False):
         block_size = int(size_str[:-1]) * 1000
+        if size_str not in accumulators:
+            accumulators[size_str] = size_accumulators(block_size)
+        disks.setdefault(size_str, set()).add(disk)
+        values = test_values(test_name,
+                             parse(result, test_name, output_type),
+                             parse_tails(result, test_name, output_type),
+                             parse_overheads_time(result), block_size,
+                             uncertainty, random_state)
+        # e.g. rate/seek time of a test with zero bw/iops
+        skipped = [keys for keys, mean, std_dev, weight in values
+                   if not np.isfinite([mean, std_dev, weight]).all()]
+        if skipped:
+            print("Skipped non-finite {} of {} {} {}".format(
+                ", ".join("/".join(keys) for keys in skipped), size_str, disk, test_name))
+            values = [value for value in values if np.isfinite(value[1:]).all()]
+        add_values(accumulators[size_str], values)
+        if disk_accumulators is not None:
+            disk_sizes = disk_accumulators.setdefault(disk, OrderedDict())
+            if size_str not in disk_sizes:
+                disk_sizes[size_str] = size_accumulators(block_size)
+            add_values(disk_sizes[size_str], values)
+
+    n_read = len(READ_TEST_NAMES + READ_WRITE_TEST_NAMES)
+    n_write = len(WRITE_TEST_NAMES + READ_WRITE_TEST_NAMES)
+    for size_str, size_accumulators_ in accumulators.items():
+        n_disks = len(disks[size_str])
+        assert size_accumulators_["transmission_time"].n == n_disks * (n_read + n_write)
+        assert size_accumulators_["latency_time"].n == n_disks * (n_read + n_write)
+        assert size_accumulators_["read_processing_time"].n == n_disks * n_read
+        assert size_accumulators_["write_processing_time"].n == n_disks * n_write
+
+    return accumulators
+
+
+def parse_fio_tests(json_path="fio_tests_node_1.json", output_type="normal",
+                    uncertainty="delta", seed=None, cache=None):
+    """Parse fio tests.
 
-        # common parameters
-        trans_mean = []
-        trans_std_dev = []
-        latency_mean = []
-        latency_std_dev = []
-        read_proc_mean = []
-        read_proc_std_dev = []
-        write_proc_mean = []
-        write_proc_std_dev = []
-
-        for disk, tests in disks.items():
-            for test_name, data in tests.items():
-                result = data["result"]
-                if test_name in READ_TEST_NAMES + READ_WRITE_TEST_NAMES:
-                    if test_name in READ_WRITE_TEST_NAMES:
-                        read_result = result[:result.find("write")]
-                    else:
-                        read_result = result
-                    trans_mean_, trans_std_dev_ = parse_transmission_time(
-                        read_result)
-                    latency_mean_, latency_std_dev_ = parse_latency_time(
-                        read_result)
-                    read_proc_mean_, read_proc_std_dev_ = parse_processing_time(
-                        read_result)
-                    trans_mean.append(trans_mean_)
-                    trans_std_dev.append(trans_std_dev_)
-                    latency_mean.append(latency_mean_)
-                    latency_std_dev.append(latency_std_dev_)
-                    read_proc_mean.append(read_proc_mean_)
-                    read_proc_std_dev.append(read_proc_std_dev_)
-                if test_name in WRITE_TEST_NAMES + READ_WRITE_TEST_NAMES:
-                    if test_name in READ_WRITE_TEST_NAMES:
-                        write_result = result[result.find("write"):]
-                    else:
-                        write_result = result
-                    trans_mean_, trans_std_dev_ = parse_transmission_time(
-                        write_result)
-                    latency_mean_, latency_std_dev_ = parse_latency_time(
-                        write_result)
-                    write_proc_mean_, write_proc_std_dev_ = parse_processing_time(
-                        write_result)
-                    trans_mean.append(trans_mean_)
-                    trans_std_dev.append(trans_std_dev_)
-                    latency_mean.append(latency_mean_)
-                    latency_std_dev.append(latency_std_dev_)
-                    write_proc_mean.append(write_proc_mean_)
-                    write_proc_std_dev.append(write_proc_std_dev_)
-
-        n_disks = len(disks)
-        n_read = len(READ_TEST_NAMES + READ_WRITE_TEST_NAMES)
-        n_write = len(WRITE_TEST_NAMES + READ_WRITE_TEST_NAMES)
-        assert len(trans_mean) == n_disks * (n_read + n_write)
-        assert len(trans_std_dev) == n_disks * (n_read + n_write)
-        assert len(latency_mean) == n_disks * (n_read + n_write)
-        assert len(latency_std_dev) == n_disks * (n_read + n_write)
-        assert len(read_proc_mean) == n_disks * n_read
-        assert len(read_proc_std_dev) == n_disks * n_read
-        assert len(write_proc_mean) == n_disks * n_write
-        assert len(write_proc_std_dev) == n_disks * n_write
-
-        transmission_time = mean_std_lists_to_Ordered_dict(
-            trans_mean, trans_std_dev)
-        latency_time = mean_std_lists_to_Ordered_dict(
-            latency_mean, latency_std_dev)
-        read_processing_time = mean_std_lists_to_Ordered_dict(
-            read_proc_mean, read_proc_std_dev)
-        write_processing_time = mean_std_lists_to_Ordered_dict(
-            write_proc_mean, write_proc_std_dev)
-
-        # special parameters
-        spec_params = {}
-        for test_name in READ_TEST_NAMES + WRITE_TEST_NAMES:
-            rate_mean = []
-            rate_std_dev = []
-            seek_mean = []
-            seek_std_dev = []
-            overhead_mean = []
-            overhead_std_dev = []
-            for disk, tests in disks.items():
-                result = tests[test_name]["result"]
-                rate_mean_, rate_std_dev_ = parse_rate_time(result, block_size)
-                seek_mean_, seek_std_dev_ = parse_seek_time(result)
-                overhead_mean_, overhead_std_dev_ = parse_overheads_time(
-                    result)
-                rate_mean.append(rate_mean_)
-                rate_std_dev.append(rate_std_dev_)
-                seek_mean.append(seek_mean_)
-                seek_std_dev.append(seek_std_dev_)
-                overhead_mean.append(overhead_mean_)
-                overhead_std_dev.append(overhead_std_dev_)
-            spec_params[test_name] = OrderedDict([
-                ("rate_time", mean_std_lists_to_Ordered_dict(
-                    rate_mean, rate_std_dev)),
-                ("seek_time", mean_std_lists_to_Ordered_dict(
-                    seek_mean, seek_std_dev)),
-                ("overheads_time", mean_std_lists_to_Ordered_dict(
-                    overhead_mean, overhead_std_dev)),
-            ])
-
-        for test_name in READ_WRITE_TEST_NAMES:
-            rate_mean = []
-            rate_std_dev = []
-            seek_mean = []
-            seek_std_dev = []
-            overhead_mean = []
-            overhead_std_dev = []
-            for disk, tests in disks.items():
-                result = tests[test_name]["result"]
-                read_result = result[:result.find("write")]
-                write_result = result[result.find("write"):]
-                rate_mean_, rate_std_dev_ = aggregate_rw(
-                    parse_rate_time(read_result, block_size),
-                    parse_rate_time(write_result, block_size),
-                )
-                seek_mean_, seek_std_dev_ = aggregate_rw(
-                    parse_seek_time(read_result),
-                    parse_seek_time(write_result),
-                )
-                overhead_mean_, overhead_std_dev_ = aggregate_rw(
-                    parse_overheads_time(read_result),
-                    parse_overheads_time(write_result),
-                )
-                rate_mean.append(rate_mean_)
-                rate_std_dev.append(rate_std_dev_)
-                seek_mean.append(seek_mean_)
-                seek_std_dev.append(seek_std_dev_)
-                overhead_mean.append(overhead_mean_)
-                overhead_std_dev.append(overhead_std_dev_)
-            spec_params[test_name] = OrderedDict([
-                ("rate_time", mean_std_lists_to_Ordered_dict(
-                    rate_mean, rate_std_dev)),
-                ("seek_time", mean_std_lists_to_Ordered_dict(
-                    seek_mean, seek_std_dev)),
-                ("overheads_time", mean_std_lists_to_Ordered_dict(
-                    overhead_mean, overhead_std_dev)),
-            ])
-
-        packet_config[size_str] = OrderedDict()
-        packet_config[size_str]["size"] = block_size
-        packet_config[size_str]["transmission_time"] = transmission_time
-        packet_config[size_str]["latency_time"] = latency_time
-        packet_config[size_str][
-            "read_processing_time"] = read_processing_time
-        packet_config[size_str][
-            "write_processing_time"] = write_processing_time
-        packet_config[size_str]["seq_read"] = spec_params["read"]
-        packet_config[size_str]["seq_write"] = spec_params["write"]
-        packet_config[size_str]["rand_read"] = spec_params["randread"]
-        packet_config[size_str]["rand_write"] = spec_params["randwrite"]
-        packet_config[size_str]["seq_read_write"] = spec_params["rw"]
-        packet_config[size_str]["rand_read_write"] = spec_params["randrw"]
-
-    assert len(packet_config) == len(test_result)
-
-    return packet_config
+    Means and std_devs are over the tests of all disks, std_dev is the std
+    of the mixture of the tests (see fio_accumulator.MeanStdAccumulator).
+
+    Args:
+        json_path (str): path to fio tests (see fio_run_utils.run_test).
+        output_type ('normal', 'json' or 'terse'): fio output format of tests.
+        uncertainty ('delta' or 'bootstrap'): std of rate and seek times,
+            see fio_parser_utils.reciprocal_time.
+        seed (int or None): seed of bootstrap.
+        cache (fio_parse_cache.ParseCache or None): cache of parsed outputs.
+
+    Returns:
+        packet_config (OrderedDict): packet config.
+
+    """
+    return tree_result(accumulate_fio_tests(json_path, output_type, uncertainty, seed, cache))
 
 
 def main(args):
@@ -186,13 +203,25 @@ def main(args):
                         default="fio_tests/fio_tests_0.json", required=False)
     parser.add_argument("-config", "--save_config_path", type=str,
                         default="packet_configs/packet_config_0.json", required=False)
+    parser.add_argument("-format", "--output_format", type=str, choices=OUTPUT_FORMATS,
+                        default="normal", required=False)
+    parser.add_argument("-uncertainty", "--uncertainty", type=str,
+                        choices=UNCERTAINTY_METHODS, default="delta", required=False)
+    parser.add_argument("-seed", "--seed", type=int, default=None, required=False)
+    parser.add_argument("-cache", "--cache_path", type=str, default=None, required=False,
+                        help="parse cache (see fio_parse_cache)")
 
     args = parser.parse_args(args)
 
     test_path = args.test_path
     save_config_path = args.save_config_path
 
-    result = parse_fio_tests(test_path)
+    if args.cache_path is None:
+        result = parse_fio_tests(test_path, args.output_format, args.uncertainty, args.seed)
+    else:
+        with ParseCache(args.cache_path) as cache:
+            result = parse_fio_tests(test_path, args.output_format, args.uncertainty,
+                                     args.seed, cache)
     save_json(result, save_config_path)
 
 if __name__ == "__main__":
@@ -3,14 +3,15 @@ import numpy as np
 from collections import OrderedDict
 from pprint import pprint
 
-from fio_parser_utils import (
-    parse_latency_time, parse_processing_time, parse_transmission_time,
-    save_json, read_json, separate_rw_result
-)
+from fio_parser_utils import parse_result_metrics, save_json, iter_test_results
 
 
-def parse_hist(json_path="fio_tests/fio_tests_node_hist.json"):
-    test_result = read_json(json_path)
+def parse_hist(json_path="fio_tests/fio_tests_node_hist.json", cell=("4K", "sdd", "rw")):
+    """Parse means and stds of one cell (size, disk, rw) of every run.
+
+    The file (run -> size -> disk -> rw -> test) is streamed, so any
+    number of runs is parsed in constant memory.
+    """
     temp = OrderedDict([('mean', []), ('std', [])])
 
     result = OrderedDict([
@@ -26,18 +27,20 @@ def parse_hist(json_path="fio_tests/fio_tests_node_hist.json"):
         ])),
     ])
 
-    param2parse = {
-        'latency_time': parse_latency_time,
-        'processing_time': parse_processing_time,
-        'transmission_time': parse_transmission_time,
+    param2metric = {
+        'latency_time': 'lat',
+        'processing_time': 'clat',
+        'transmission_time': 'slat',
     }
 
-    rw_modes = ['read', 'write']
-    for test in test_result.values():
-        rw_results = separate_rw_result(test['4K']['sdd']['rw']['result'])
-        for rw_mode, rw_result in zip(rw_modes, rw_results):
-            for param, parse_func in param2parse.items():
-                mean, std = parse_func(rw_result)
+    for run, size, disk, rw, test_result in iter_test_results(json_path):
+        if (size, disk, rw) != cell:
+            continue
+        # one pass over the output for all metrics of read and write
+        metrics = parse_result_metrics(test_result, rw)
+        for rw_mode, rw_metrics in metrics.items():
+            for param, metric in param2metric.items():
+                mean, std = rw_metrics[metric]
                 result[rw_mode][param]['mean'].append(mean)
                 result[rw_mode][param]['std'].append(std)
     return result
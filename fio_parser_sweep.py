@@ -0,0 +1,149 @@
+import argparse
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_parser_utils import (
+    OUTPUT_FORMATS, RW_MODES, parse_result_metrics, save_json, read_json
+)
+
+
+def parse_sweep(json_path, output_type="normal"):
+    """Parse iodepth/numjobs sweep (see fio_run_utils.run_sweep).
+
+    Returns:
+        curves (OrderedDict): size -> disk -> rw -> curve, curve has lists
+            (sorted by concurrency = iodepth * numjobs) of iodepth, numjobs,
+            concurrency, iops (total) and latency_time (mean lat, sec).
+
+    """
+    sweep_result = read_json(json_path)
+    curves = OrderedDict()
+    for size, disks in sweep_result.items():
+        curves[size] = OrderedDict()
+        for disk, tests in disks.items():
+            curves[size][disk] = OrderedDict()
+            for rw, points in tests.items():
+                rows = []
+                for test in points.values():
+                    metrics = parse_result_metrics(test["result"], rw, output_type)
+                    iops = sum(m["iops"][0] for m in metrics.values())
+                    latency = np.mean([m["lat"][0] for m in metrics.values()])
+                    rows.append((test["iodepth"] * test["numjobs"], test["iodepth"],
+                                 test["numjobs"], iops, latency))
+                rows.sort()
+                curve = OrderedDict()
+                for i, name in enumerate(["concurrency", "iodepth", "numjobs",
+                                          "iops", "latency_time"]):
+                    curve[name] = [row[i] for row in rows]
+                curves[size][disk][rw] = curve
+    return curves
+
+
+def find_knee(concurrency, iops, min_gain=0.1):
+    """Find saturation point of throughput-versus-concurrency curve.
+
+    The knee is the first point after which doubling the concurrency
+    adds less than min_gain of relative IOPS, more queue depth only adds
+    latency after it (Little's law: latency ~ concurrency / IOPS).
+
+    Args:
+        concurrency (array): iodepth * numjobs, increasing.
+        iops (array): IOPS.
+        min_gain (float): min relative IOPS gain per doubling.
+
+    Returns:
+        idx (int): index of the knee, the last point if IOPS still grow.
+
+    """
+    concurrency = np.asarray(concurrency, dtype=float)
+    iops = np.asarray(iops, dtype=float)
+    if len(iops) < 2:
+        return 0
+    doublings = np.log2(concurrency[1:] / concurrency[:-1])
+    gain = (iops[1:] / iops[:-1] - 1) / doublings
+    # IOPS of the knee should not be passed later (noise)
+    best_after = np.maximum.accumulate(iops[::-1])[::-1]
+    flat = (gain < min_gain) & (best_after[1:] < iops[:-1] * (1 + min_gain))
+    idx = np.flatnonzero(flat)
+    return int(idx[0]) if len(idx) else len(iops) - 1
+
+
+def saturation_points(curves, min_gain=0.1):
+    """Saturation points of every curve.
+
+    Points with the same concurrency (e.g. iodepth=2, numjobs=1 and
+    iodepth=1, numjobs=2) are represented by the one with the highest IOPS.
+
+    Returns:
+        points (OrderedDict): size -> disk -> rw -> point, point has
+            iodepth, numjobs, concurrency, iops and latency_time of the knee.
+
+    """
+    points = OrderedDict()
+    for size, disks in curves.items():
+        points[size] = OrderedDict()
+        for disk, tests in disks.items():
+            points[size][disk] = OrderedDict()
+            for rw, curve in tests.items():
+                concurrency = np.asarray(curve["concurrency"])
+                iops = np.asarray(curve["iops"], dtype=float)
+                # by concurrency, then by IOPS descending
+                order = np.lexsort((-iops, concurrency))
+                _, first = np.unique(concurrency[order], return_index=True)
+                best = order[first]
+                idx = best[find_knee(concurrency[best], iops[best], min_gain)]
+                points[size][disk][rw] = OrderedDict(
+                    (name, values[idx]) for name, values in curve.items())
+    return points
+
+
+def add_saturation(packet_config, points):
+    """Add saturation point of every mode to packet config.
+
+    packet_config[size][mode]["saturation"] gets mean and std_dev over disks
+    of concurrency, iodepth, numjobs, iops and latency_time of the knee.
+    """
+    for size, disks in points.items():
+        if size not in packet_config:
+            continue
+        for rw, mode in RW_MODES.items():
+            disk_points = [tests[rw] for tests in disks.values() if rw in tests]
+            if not disk_points or mode not in packet_config[size]:
+                continue
+            saturation = OrderedDict()
+            for name in ["concurrency", "iodepth", "numjobs", "iops", "latency_time"]:
+                values = [point[name] for point in disk_points]
+                saturation[name] = OrderedDict([
+                    ("mean", np.mean(values)), ("std_dev", np.std(values))])
+            packet_config[size][mode]["saturation"] = saturation
+    return packet_config
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-test", "--test_path", type=str,
+                        default="fio_tests/sweep/fio_sweep_0.json", required=False)
+    parser.add_argument("-config", "--config_path", type=str, required=True,
+                        help="packet config of the disks (see fio_parser_config)")
+    parser.add_argument("-save_config", "--save_config_path", type=str, required=True,
+                        help="packet config with saturation points")
+    parser.add_argument("-curves", "--save_curves_path", type=str,
+                        default=None, required=False)
+    parser.add_argument("-format", "--output_format", type=str, choices=OUTPUT_FORMATS,
+                        default="normal", required=False)
+    parser.add_argument("-min_gain", "--min_gain", type=float, default=0.1, required=False)
+
+    args = parser.parse_args(args)
+
+    curves = parse_sweep(args.test_path, args.output_format)
+    if args.save_curves_path is not None:
+        save_json(curves, args.save_curves_path)
+    packet_config = add_saturation(
+        read_json(args.config_path), saturation_points(curves, args.min_gain))
+    save_json(packet_config, args.save_config_path)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
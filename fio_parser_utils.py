@@ -1,7 +1,14 @@
 import json
+import re
 import numpy as np
 from collections import OrderedDict
 
+from fio_accumulator import MeanStdAccumulator
+from fio_run_utils import (
+    TERSE_VERSION, TERSE_DIRECTION_FIELDS, TERSE_DIRECTION_START, TERSE_FIELDS, TERSE_IOPS,
+    TERSE_RUNTIME
+)
+
 TIME_MULTS = {
     "sec": 1,
     "msec": 1e-3,
@@ -9,12 +16,142 @@ TIME_MULTS = {
     "nsec": 1e-9,
     "KB/s": 1000,
     "KiB/s": 1000,
+    "MB/s": 1000 ** 2,
+    "MiB/s": 1000 ** 2,
+    "GB/s": 1000 ** 3,
+    "GiB/s": 1000 ** 3,
 }
 
 READ_TEST_NAMES = ["read", "randread"]
 WRITE_TEST_NAMES = ["write", "randwrite"]
 READ_WRITE_TEST_NAMES = ["rw", "randrw"]
 
+# fio rw -> packet config mode
+RW_MODES = {
+    "read": "seq_read",
+    "write": "seq_write",
+    "randread": "rand_read",
+    "randwrite": "rand_write",
+    "rw": "seq_read_write",
+    "randrw": "rand_read_write",
+}
+
+# version of parse_result_metrics output, bump it when parsing changes
+# (invalidates fio_parse_cache)
+PARSER_VERSION = 4
+
+OUTPUT_FORMATS = ["normal", "json", "terse"]
+UNCERTAINTY_METHODS = ["delta", "bootstrap"]
+METRICS = ["slat", "clat", "lat", "bw", "iops"]
+
+# fio lat buckets: percents of IOs with latency up to the label (a label is
+# the upper edge, ">=2000" msec is the rest)
+LAT_BUCKET_UNITS = ["nsec", "usec", "msec"]
+LAT_BUCKET_LABELS = {
+    "nsec": ["2", "4", "10", "20", "50", "100", "250", "500", "750", "1000"],
+    "usec": ["2", "4", "10", "20", "50", "100", "250", "500", "750", "1000"],
+    "msec": ["2", "4", "10", "20", "50", "100", "250", "500", "750", "1000", "2000", ">=2000"],
+}
+LAT_BUCKETS = [(unit, label) for unit in LAT_BUCKET_UNITS for label in LAT_BUCKET_LABELS[unit]]
+LAT_BUCKET_INDEX = {bucket: i for i, bucket in enumerate(LAT_BUCKETS)}
+# upper edges of the buckets (sec)
+LAT_BUCKET_EDGES = np.array([
+    np.inf if label.startswith(">=") else int(label) * TIME_MULTS[unit]
+    for unit, label in LAT_BUCKETS])
+# latencies with percentiles in fio output (slat and lat ones only with
+# slat_percentiles/lat_percentiles job options)
+PERCENTILE_METRICS = ["slat", "clat", "lat"]
+# terse v3 fields of clat percentiles (offsets from the direction start),
+# lat buckets of the job (usec, msec) after write, cpu (5) and IO depths (7)
+TERSE_PERCENTILE_FIELDS = (12, 32)
+TERSE_LAT_BUCKET_FIELDS = OrderedDict([
+    ("usec", TERSE_DIRECTION_START["write"] + TERSE_DIRECTION_FIELDS + 12),
+    ("msec", TERSE_DIRECTION_START["write"] + TERSE_DIRECTION_FIELDS + 22),
+])
+
+
+# fio normal output, one pass over the lines of every direction:
+#   read: IOPS=112, BW=448KiB/s (459kB/s)(13.1MiB/30001msec)
+#     slat (usec): min=6, max=1909, avg=19.83, stdev=34.78
+#    bw (  KiB/s): min=  272, max=  640, per=100.00%, avg=448.23, stdev=80.34, samples=60
+#    iops        : min=   68, max=  160, avg=112.03, stdev=20.10, samples=60
+# NORMAL_LINE_RE finds the lines (a literal "\n" at the start lets re skip to
+# line starts quickly), NORMAL_STAT_RE and NORMAL_UNIT_RE read avg, stdev
+# and unit of a line.
+NORMAL_LINE_RE = re.compile(r"\n[ \t]*(read|write|trim|slat|clat|lat|bw|iops)\b([^\n]*)")
+NORMAL_STAT_RE = re.compile(r"avg=[ \t]*([-+.\deE]+),[ \t]*stdev=[ \t]*([-+.\deE]+)")
+NORMAL_UNIT_RE = re.compile(r"[ \t]*\(([^)]*)\)[ \t]*:")
+NORMAL_DIRECTIONS = {"read", "write", "trim"}
+
+# tails of fio normal output:
+#    clat percentiles (usec):     (also slat/lat percentiles)
+#     |  1.00th=[  137],  5.00th=[  163], 10.00th=[  172], 20.00th=[  180],
+#   lat (usec)   : 100=0.03%, 250=23.29%, 500=22.62%, 750=2.10%, 1000=0.22%
+#   lat (msec)   : 2=0.19%, 4=0.38%, 10=50.16%, 20=0.74%, >=2000=0.01%
+#      issued rwts: total=3362,3490,0,0 short=0,0,0,0 dropped=0,0,0,0
+NORMAL_PERCENTILES_RE = re.compile(
+    r"\n[ \t]*(read|write|trim)[ \t]*:"
+    r"|\n[ \t]*(slat|clat|lat) percentiles[ \t]*\(([^)]*)\)[ \t]*:((?:\n[ \t]*\|[^\n]*)+)")
+NORMAL_PERCENTILE_RE = re.compile(r"([.\d]+)th=\[[ \t]*(\d+)\]")
+NORMAL_BUCKETS_RE = re.compile(r"\n[ \t]*lat[ \t]*\(([^)]*)\)[ \t]*:([^\n]*)")
+NORMAL_BUCKET_RE = re.compile(r"(>=)?(\d+)=([.\d]+)%")
+NORMAL_IOS_RE = re.compile(r"issued rwts:[ \t]*total=(\d+),(\d+),(\d+)")
+
+
+class NormalSection():
+    """Metrics of one direction of fio normal output.
+
+    Every metric is (mean, std_dev) in sec or B/s, None if not found.
+    """
+
+    __slots__ = ["direction"] + METRICS
+
+    def __init__(self, direction):
+        self.direction = direction
+        for metric in METRICS:
+            setattr(self, metric, None)
+
+
+def tokenize_normal(result):
+    """Read metrics of all directions of fio normal output in one pass.
+
+    Returns:
+        sections (list of NormalSection): in order of the output, the first
+            line of a metric in a section wins (as in parse_avg_std).
+
+    """
+    sections = []
+    section = None
+    for name, rest in NORMAL_LINE_RE.findall("\n" + result):
+        if name in NORMAL_DIRECTIONS:
+            if rest.lstrip().startswith(":"):
+                section = NormalSection(name)
+                sections.append(section)
+            continue
+        if section is None or getattr(section, name) is not None:
+            continue
+        stat = NORMAL_STAT_RE.search(rest)
+        if stat is None:
+            # clat percentiles, lat buckets
+            continue
+        avg, stdev = stat.groups()
+        unit = NORMAL_UNIT_RE.match(rest)
+        mult = TIME_MULTS.get(unit.group(1).replace(" ", ""), 1) if unit else 1
+        setattr(section, name, (float(avg) * mult, float(stdev) * mult))
+    return sections
+
+
+def section_metric(sections, direction, metric):
+    """(mean, std_dev) of metric of direction (see tokenize_normal)."""
+    for section in sections:
+        if direction in (None, section.direction):
+            value = getattr(section, metric)
+            if value is None:
+                break
+            return value
+    raise Exception("Parameter '{}' of {} not found in test".format(
+        metric, direction or "any direction"))
+
 
 def parse_avg_std(result, parameter, without=[]):
     for line in result.splitlines():
@@ -40,15 +177,275 @@ def parse_avg_std(result, parameter, without=[]):
         "Parameter '{}' not found in test:\n\n{}".format(parameter, result))
 
 
+def test_directions(test_name):
+    """Directions (read and/or write) of fio test."""
+    if test_name in READ_WRITE_TEST_NAMES:
+        return ["read", "write"]
+    if test_name in READ_TEST_NAMES:
+        return ["read"]
+    if test_name in WRITE_TEST_NAMES:
+        return ["write"]
+    raise ValueError("Unknown test name '{}'".format(test_name))
+
+
+def parse_normal_metrics(result, directions):
+    """Parse metrics of fio normal (human-readable) output."""
+    sections = tokenize_normal(result)
+    metrics = OrderedDict()
+    for direction in directions:
+        metrics[direction] = OrderedDict(
+            (metric, section_metric(sections, direction, metric))
+            for metric in METRICS)
+    return metrics
+
+
+def parse_json_metrics(result, directions):
+    """Parse metrics of fio json output (one job)."""
+    fio_json = json.loads(result[result.find("{"):])
+    jobs = fio_json["jobs"] if "jobs" in fio_json else fio_json["client_stats"]
+    job = jobs[0]
+    metrics = OrderedDict()
+    for direction in directions:
+        job_dir = job[direction]
+        metrics[direction] = OrderedDict()
+        for metric in ["slat", "clat", "lat"]:
+            if metric + "_ns" in job_dir:
+                stat, mult = job_dir[metric + "_ns"], TIME_MULTS["nsec"]
+            else:
+                # fio < 3.0
+                stat, mult = job_dir[metric], TIME_MULTS["usec"]
+            metrics[direction][metric] = (
+                stat["mean"] * mult, stat["stddev"] * mult)
+        metrics[direction]["bw"] = (
+            job_dir["bw_mean"] * TIME_MULTS["KiB/s"],
+            job_dir["bw_dev"] * TIME_MULTS["KiB/s"])
+        metrics[direction]["iops"] = (
+            job_dir["iops_mean"], job_dir["iops_stddev"])
+    return metrics
+
+
+def terse_line(result):
+    """Last terse v3 line of fio output (see fio_run_utils.TERSE_VERSION)."""
+    lines = [l for l in result.splitlines() if l.startswith(TERSE_VERSION + ";")]
+    if not lines:
+        raise ValueError("No terse v{} line in fio output".format(TERSE_VERSION))
+    return lines[-1]
+
+
+def parse_terse_metrics(result, directions):
+    """Parse metrics of fio terse (v3) output (one job).
+
+    v3 has the IOPS of a direction but no IOPS stdev, it is the stdev of bw
+    samples scaled to IOPS (the block size is fixed, IOPS are bw / bs).
+    """
+    fields = terse_line(result).split(";")
+    mults = {
+        "slat": TIME_MULTS["usec"],
+        "clat": TIME_MULTS["usec"],
+        "lat": TIME_MULTS["usec"],
+        "bw": TIME_MULTS["KiB/s"],
+    }
+    metrics = OrderedDict()
+    for direction in directions:
+        start = TERSE_DIRECTION_START[direction]
+        metrics[direction] = OrderedDict()
+        for metric in METRICS:
+            if metric == "iops":
+                continue
+            mean_idx, std_idx = TERSE_FIELDS[metric]
+            metrics[direction][metric] = (
+                float(fields[start + mean_idx]) * mults[metric],
+                float(fields[start + std_idx]) * mults[metric])
+        iops = float(fields[start + TERSE_IOPS])
+        bw_mean, bw_std = metrics[direction]["bw"]
+        metrics[direction]["iops"] = (iops, iops * bw_std / bw_mean if bw_mean else 0.0)
+    return metrics
+
+
+def parse_result_metrics(result, test_name, output_format="normal"):
+    """Parse slat/clat/lat/bw/iops of fio test.
+
+    Args:
+        result (str): fio output of one test.
+        test_name (str): name of read/write test.
+        output_format ('normal', 'json' or 'terse'): fio output format.
+
+    Returns:
+        metrics (OrderedDict): direction -> metric -> (mean, std_dev),
+            latencies are in sec, bandwidth in B/s.
+
+    """
+    directions = test_directions(test_name)
+    if output_format == "normal":
+        return parse_normal_metrics(result, directions)
+    if output_format == "json":
+        return parse_json_metrics(result, directions)
+    if output_format == "terse":
+        return parse_terse_metrics(result, directions)
+    raise ValueError("Unknown output format '{}'".format(output_format))
+
+
+def _tails(directions, percentiles, buckets, ios):
+    empty = (np.zeros(0), np.zeros(0))
+    return OrderedDict([
+        ("percentiles", OrderedDict(
+            (metric, OrderedDict(
+                (direction, percentiles.get((metric, direction), empty))
+                for direction in directions))
+            for metric in PERCENTILE_METRICS)),
+        ("lat_buckets", buckets),
+        ("ios", OrderedDict((direction, ios.get(direction, 0)) for direction in directions)),
+    ])
+
+
+def parse_normal_tails(result, directions):
+    """Parse latency percentiles and lat buckets of fio normal output."""
+    text = "\n" + result
+    # buckets and IO counts of the first job
+    ios_match = NORMAL_IOS_RE.search(text)
+    job_text = text[:ios_match.end()] if ios_match else text
+
+    percentiles = OrderedDict()
+    direction = None
+    for name, metric, unit, lines in NORMAL_PERCENTILES_RE.findall(job_text):
+        if name:
+            direction = name
+            continue
+        if direction is None or (metric, direction) in percentiles:
+            continue
+        pairs = NORMAL_PERCENTILE_RE.findall(lines)
+        percentiles[(metric, direction)] = (
+            np.array([float(q) for q, _ in pairs]),
+            np.array([float(v) for _, v in pairs]) * TIME_MULTS.get(unit, 1))
+
+    buckets = np.zeros(len(LAT_BUCKETS))
+    for unit, rest in NORMAL_BUCKETS_RE.findall(job_text):
+        if "avg=" in rest:
+            # lat (usec): min=..., avg=...
+            continue
+        for ge, label, percent in NORMAL_BUCKET_RE.findall(rest):
+            idx = LAT_BUCKET_INDEX.get((unit.strip(), ge + label))
+            if idx is not None:
+                buckets[idx] = float(percent) / 100
+
+    ios = {}
+    if ios_match:
+        ios = dict(zip(["read", "write", "trim"], map(int, ios_match.groups())))
+    return _tails(directions, percentiles, buckets, ios)
+
+
+def parse_json_tails(result, directions):
+    """Parse latency percentiles and lat buckets of fio json output (one job)."""
+    fio_json = json.loads(result[result.find("{"):])
+    jobs = fio_json["jobs"] if "jobs" in fio_json else fio_json["client_stats"]
+    job = jobs[0]
+    percentiles = OrderedDict()
+    ios = {}
+    for direction in directions:
+        job_dir = job[direction]
+        for metric in PERCENTILE_METRICS:
+            if metric + "_ns" in job_dir:
+                stat, mult = job_dir[metric + "_ns"], TIME_MULTS["nsec"]
+            else:
+                # fio < 3.0
+                stat, mult = job_dir.get(metric, {}), TIME_MULTS["usec"]
+            pairs = sorted((float(q), v) for q, v in stat.get("percentile", {}).items())
+            if pairs:
+                percentiles[(metric, direction)] = (
+                    np.array([q for q, _ in pairs]), np.array([v for _, v in pairs]) * mult)
+        ios[direction] = job_dir.get(
+            "total_ios", int(round(job_dir["iops"] * job_dir["runtime"] / 1000)))
+    buckets = np.zeros(len(LAT_BUCKETS))
+    for unit in LAT_BUCKET_UNITS:
+        for label, percent in job.get("latency_" + unit[0] + "s", {}).items():
+            idx = LAT_BUCKET_INDEX.get((unit, label))
+            if idx is not None:
+                buckets[idx] = percent / 100
+    return _tails(directions, percentiles, buckets, ios)
+
+
+def parse_terse_tails(result, directions):
+    """Parse clat percentiles and lat buckets of fio terse (v3) output (one job).
+
+    Terse output has one set of percentiles (of clat, or of lat with
+    lat_percentiles, the fields don't tell), they are read as clat ones.
+    """
+    fields = terse_line(result).split(";")
+    n_fields = TERSE_LAT_BUCKET_FIELDS["msec"] + len(LAT_BUCKET_LABELS["msec"])
+    if len(fields) < n_fields:
+        raise ValueError("Terse line has {} fields, v{} has at least {}".format(
+            len(fields), TERSE_VERSION, n_fields))
+    percentiles = OrderedDict()
+    ios = {}
+    for direction in directions:
+        start = TERSE_DIRECTION_START[direction]
+        pairs = []
+        for field in fields[start + TERSE_PERCENTILE_FIELDS[0]:start + TERSE_PERCENTILE_FIELDS[1]]:
+            if "%=" not in field:
+                raise ValueError("Terse {} percentile field '{}' is not '<percent>%=<usec>'".format(
+                    direction, field))
+            pairs.append(field.split("%="))
+        # unused percentile fields are "0%=0"
+        pairs = [(float(q), float(v)) for q, v in pairs if float(q) > 0]
+        percentiles[("clat", direction)] = (
+            np.array([q for q, _ in pairs]),
+            np.array([v for _, v in pairs]) * TIME_MULTS["usec"])
+        # IOPS * runtime (msec)
+        ios[direction] = int(round(
+            float(fields[start + TERSE_IOPS]) * float(fields[start + TERSE_RUNTIME]) / 1000))
+    buckets = np.zeros(len(LAT_BUCKETS))
+    for unit, start in TERSE_LAT_BUCKET_FIELDS.items():
+        for i, label in enumerate(LAT_BUCKET_LABELS[unit]):
+            buckets[LAT_BUCKET_INDEX[(unit, label)]] = float(
+                fields[start + i].rstrip("%")) / 100
+    return _tails(directions, percentiles, buckets, ios)
+
+
+def parse_result_tails(result, test_name, output_format="normal"):
+    """Parse tail latency of fio test: latency percentiles and lat buckets.
+
+    Args:
+        result (str): fio output of one test.
+        test_name (str): name of read/write test.
+        output_format ('normal', 'json' or 'terse'): fio output format.
+
+    Returns:
+        tails (OrderedDict):
+            "percentiles" -- metric (PERCENTILE_METRICS) -> direction ->
+                (percentiles, values), arrays, values in sec, empty if not
+                found (terse output has clat ones only);
+            "lat_buckets" -- array of fractions of IOs over LAT_BUCKETS
+                (both directions, fio reports them per job);
+            "ios" -- direction -> number of IOs.
+
+    """
+    directions = test_directions(test_name)
+    if output_format == "normal":
+        return parse_normal_tails(result, directions)
+    if output_format == "json":
+        return parse_json_tails(result, directions)
+    if output_format == "terse":
+        return parse_terse_tails(result, directions)
+    raise ValueError("Unknown output format '{}'".format(output_format))
+
+
+def percentile_values(percentiles, values, points):
+    """Values at points (percents), interpolated between fio percentiles,
+    nan if there are no percentiles."""
+    if not len(percentiles):
+        return np.full(len(points), np.nan)
+    return np.interp(points, percentiles, values)
+
+
 def parse_transmission_time(result):
     """Parse transmission time using fio submission latency."""
-    trans_mean, trans_std_dev = parse_avg_std(result, "slat(")
+    trans_mean, trans_std_dev = section_metric(tokenize_normal(result), None, "slat")
     return trans_mean, trans_std_dev
 
 
 def parse_latency_time(result):
     """Parse latency time using fio latency."""
-    lat_mean, lat_std_dev = parse_avg_std(result, "lat(", ["slat", "clat"])
+    lat_mean, lat_std_dev = section_metric(tokenize_normal(result), None, "lat")
     return lat_mean, lat_std_dev
 
 
@@ -56,31 +453,77 @@ def parse_processing_time(result):
     """Parse latency time using fio completion latency."""
 
     # completion latency
-    proc_mean, proc_std_dev = parse_avg_std(result, "clat(")
+    proc_mean, proc_std_dev = section_metric(tokenize_normal(result), None, "clat")
     return proc_mean, proc_std_dev
 
 
-def parse_rate_time(result, block_size):
-    """Parse rate time using fio bandwidth."""
-    bw_mean, bw_std_dev = parse_avg_std(result, "bw(")
-    rate_mean = block_size / bw_mean
-    rate_std_dev = np.std(
-        block_size / np.random.normal(bw_mean, bw_std_dev, 10 ** 4))
-    return rate_mean, rate_std_dev
+def reciprocal_time(scale, mean, std_dev, method="delta", n_samples=10 ** 4,
+                    random_state=None):
+    """Mean and std of scale / X, X has mean and std_dev (bw, IOPS).
 
+    Methods:
+        'delta' -- delta method (first order Taylor expansion of scale / x
+            at the mean): std(scale / X) ~ scale * std(X) / mean(X) ** 2,
+            exact for small std_dev / mean, deterministic and vectorized.
+        'bootstrap' -- parametric bootstrap: n_samples draws of
+            X ~ N(mean, std_dev) for every value, draws <= 0 are dropped
+            (bw and IOPS are positive), seeded by random_state.
 
-def parse_seek_time(result):
-    """Parse seek time using fio IOPS."""
+    Args:
+        scale, mean, std_dev (float or array): broadcast together.
+        method ('delta' or 'bootstrap'): see above.
+        random_state (int, np.random.RandomState or None): seed of bootstrap.
+
+    Returns:
+        time_mean (float or np.ndarray): scale / mean.
+        time_std_dev (float or np.ndarray): std of scale / X.
+
+    """
+    scale, mean, std_dev = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (scale, mean, std_dev)))
+    time_mean = scale / mean
+    if method == "delta":
+        time_std_dev = scale * std_dev / mean ** 2
+    elif method == "bootstrap":
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        draws = random_state.normal(mean[..., None], std_dev[..., None],
+                                    mean.shape + (n_samples,))
+        draws[draws <= 0] = np.nan
+        time_std_dev = np.nanstd(scale[..., None] / draws, axis=-1)
+    else:
+        raise ValueError("Unknown uncertainty method '{}'".format(method))
+    if time_mean.ndim == 0:
+        return float(time_mean), float(time_std_dev)
+    return time_mean, time_std_dev
+
+
+def rate_time(bw_mean, bw_std_dev, block_size, method="delta", random_state=None):
+    """Rate time using bandwidth (see reciprocal_time)."""
+    return reciprocal_time(block_size, bw_mean, bw_std_dev, method,
+                           random_state=random_state)
+
+
+def seek_time(iops_mean, iops_std_dev, method="delta", random_state=None):
+    """Seek time using IOPS (see reciprocal_time)."""
     # seek time
     # = average rotational delay + avg seek time (here)
     # = 1 / IOPS
     # (https://serverfault.com/questions/920433/what-is-the-relation-between-block-size-and-io)
-    # TODO: math approach for std
-    iops_mean, iops_std_dev = parse_avg_std(result, "iops:")
-    seek_mean = 1 / iops_mean
-    see_std_dev = np.std(
-        1 / np.random.normal(iops_mean, iops_std_dev, 10 ** 4))
-    return seek_mean, see_std_dev
+    return reciprocal_time(1, iops_mean, iops_std_dev, method,
+                           random_state=random_state)
+
+
+def parse_rate_time(result, block_size):
+    """Parse rate time using fio bandwidth."""
+    bw_mean, bw_std_dev = section_metric(tokenize_normal(result), None, "bw")
+    return rate_time(bw_mean, bw_std_dev, block_size)
+
+
+def parse_seek_time(result):
+    """Parse seek time using fio IOPS."""
+    iops_mean, iops_std_dev = section_metric(tokenize_normal(result), None, "iops")
+    return seek_time(iops_mean, iops_std_dev)
 
 
 def parse_overheads_time(result):
@@ -102,10 +545,12 @@ def aggregate_rw(tuple_1, tuple_2):
 
 
 def mean_std_lists_to_Ordered_dict(mean_list, std_list):
-    return OrderedDict([
-        ("mean", np.mean(mean_list)),
-        ("std_dev", np.linalg.norm(std_list)),
-    ])
+    """Mean and std_dev of the mixture of values with std_devs (see
+    fio_accumulator.MeanStdAccumulator)."""
+    accumulator = MeanStdAccumulator()
+    for mean, std_dev in zip(mean_list, std_list):
+        accumulator.add(mean, std_dev)
+    return accumulator.result()
 
 
 def separate_rw_result(result):
@@ -124,3 +569,104 @@ def read_json(json_path):
     with open(json_path, 'r') as fp:
         result = json.load(fp)
     return result
+
+
+class _JsonStream():
+    """Text of a json file read by chunks, consumed text is dropped."""
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+
+    def fill(self, size=None):
+        chunk = self.fp.read(size or self.chunk_size)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def next_char(self):
+        """Next not whitespace char, consumed."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                self.pos += 1
+                return self.buf[self.pos - 1]
+            self.fill()
+            if self.eof:
+                raise ValueError("Unexpected end of json")
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char not in chars:
+            raise ValueError("Expected one of '{}', got '{}'".format(chars, char))
+        return char
+
+    def decode(self):
+        """Next json value (key or leaf), read more text until it is complete."""
+        self.expect("\"{[-0123456789tfn")
+        self.pos -= 1  # the char starts the value
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number may continue in the next chunk ("-1." + "5e3")
+                if self.eof or (end < len(self.buf) and self.buf[end] in ",:]} \t\n\r"):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill(size)
+            size *= 2
+
+
+def _iter_json_items(stream, depth, keys):
+    stream.expect("{")
+    if stream.next_char() == "}":
+        return
+    stream.pos -= 1
+    while True:
+        key = stream.decode()
+        stream.expect(":")
+        if depth == 1:
+            yield keys + (key,), stream.decode()
+        else:
+            yield from _iter_json_items(stream, depth - 1, keys + (key,))
+        if stream.expect(",}") == "}":
+            return
+
+
+def iter_json_items(json_path, depth, chunk_size=2 ** 16):
+    """Iterate over the values of nested json dicts at depth without
+    loading the file, memory is bound by the largest value.
+
+    Yields:
+        keys (tuple of str): keys of the value, len(keys) == depth.
+        value: value.
+
+    """
+    with open(json_path, 'r') as fp:
+        yield from _iter_json_items(_JsonStream(fp, chunk_size), depth, ())
+
+
+def iter_test_results(json_path, runs=True):
+    """Iterate over fio outputs of tests file without loading it.
+
+    Args:
+        json_path (str): tests, run -> size -> disk -> rw -> test if runs
+            (e.g. fio_tests_node_hist_1000.json), otherwise the result of
+            fio_run_utils.run_test (size -> disk -> rw -> test).
+
+    Yields:
+        run (str or None), size, disk, rw, result (str).
+
+    """
+    for keys, test in iter_json_items(json_path, 4 if runs else 3):
+        if not runs:
+            keys = (None,) + keys
+        yield keys + (test.get("result", ""),)
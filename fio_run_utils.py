@@ -1,15 +1,23 @@
+import contextlib
+import glob
 import os
 import subprocess
 import time
 import signal
 import json
 import random
+import re
+import tempfile
+import threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 
 N_DISK_SAMPLE = 5
 RUNTIME = 30
 BLOCK_SIZES = [2**x for x in range(2, 12)]  # kB ~ 1000
+SWEEP_IODEPTHS = [2**x for x in range(0, 9)]  # 1 ~ 256
+SWEEP_NUMJOBS = [1]
 
 
 RW_LIST = [
@@ -67,7 +75,217 @@ DISKS = [
 ]
 
 
-def run_cmd(*popenargs, input=None, check=False, **kwargs):
+# fio log files of write_lat_log/write_hist_log: <prefix>_<kind>.<job>.log
+FIO_LOG_RE = re.compile(r"_(slat|clat|lat|clat_hist)\.\d+\.log$")
+
+
+# fio terse v3 line (the default --terse-version): terse version, fio
+# version, job name, group id, error, then read and write (41 fields each,
+# no trim), cpu, IO depths, lat buckets and disk utilization
+# (https://fio.readthedocs.io/en/latest/fio_doc.html#terse-output)
+TERSE_VERSION = "3"
+TERSE_DIRECTION_FIELDS = 41
+TERSE_DIRECTION_START = {"read": 5, "write": 5 + TERSE_DIRECTION_FIELDS}
+# offsets from the direction start: total IO (KiB), bw (KiB/s), IOPS and
+# runtime (msec), then slat, clat (min, max, mean, stdev, usec), 20 clat
+# percentiles, lat (usec) and bw (min, max, percent, mean, stdev)
+TERSE_IO, TERSE_BW, TERSE_IOPS, TERSE_RUNTIME = 0, 1, 2, 3
+TERSE_FIELDS = {
+    "slat": (6, 7),
+    "clat": (10, 11),
+    "lat": (34, 35),
+    "bw": (39, 40),
+}
+
+
+# target kinds, see Target
+TARGET_KINDS = ["dev", "file", "sparse", "loop"]
+SIZE_MULTS = {"k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+
+
+# /sys/block/<disk>/stat, see https://www.kernel.org/doc/Documentation/block/stat.txt
+DISK_STAT_FIELDS = [
+    "r_ios", "r_merges", "r_sectors", "r_ticks",
+    "w_ios", "w_merges", "w_sectors", "w_ticks",
+    "in_flight", "io_ticks", "time_in_queue",
+]
+
+
+def read_disk_stat(disk):
+    """Read disk stats from /sys/block/<disk>/stat or /proc/diskstats.
+
+    Returns:
+        stat (OrderedDict or None): DISK_STAT_FIELDS -> value,
+            None if there is no such disk.
+
+    """
+    disk = Target(disk).stat_disk
+    if disk is None:
+        return None
+    path = "/sys/block/{}/stat".format(disk)
+    fields = None
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            fields = f.read().split()
+    elif os.path.exists("/proc/diskstats"):
+        with open("/proc/diskstats", 'r') as f:
+            for line in f:
+                # major minor name fields...
+                parts = line.split()
+                if parts[2] == disk:
+                    fields = parts[3:]
+                    break
+    if fields is None:
+        return None
+    return OrderedDict(zip(DISK_STAT_FIELDS, map(int, fields)))
+
+
+def disk_stat_delta(stat_1, stat_2, seconds):
+    """Disk activity between two stats.
+
+    Returns:
+        sample (OrderedDict): util (busy fraction), aqu_sz (average queue size),
+            read/write IOs and merged IOs.
+
+    """
+    ms = seconds * 1000
+    return OrderedDict([
+        ("util", (stat_2["io_ticks"] - stat_1["io_ticks"]) / ms),
+        ("aqu_sz", (stat_2["time_in_queue"] - stat_1["time_in_queue"]) / ms),
+        ("r_ios", stat_2["r_ios"] - stat_1["r_ios"]),
+        ("w_ios", stat_2["w_ios"] - stat_1["w_ios"]),
+        ("r_merges", stat_2["r_merges"] - stat_1["r_merges"]),
+        ("w_merges", stat_2["w_merges"] - stat_1["w_merges"]),
+        ("in_flight", stat_2["in_flight"]),
+    ])
+
+
+@contextlib.contextmanager
+def disk_telemetry(disk, interval=None):
+    """Sample disk stats in a background thread while the block runs.
+
+    Yields:
+        telemetry (OrderedDict): filled on exit with interval, start (unix
+            time, sec) and samples (t, sec from start, and disk_stat_delta
+            of every interval), empty if interval is None or the disk has
+            no stats.
+
+    """
+    telemetry = OrderedDict()
+    stat = read_disk_stat(disk) if interval else None
+    if stat is None:
+        yield telemetry
+        return
+
+    samples = []
+    stop = threading.Event()
+    start = time.time()
+
+    def sample_stats():
+        last_stat, last_time = stat, start
+        while not stop.wait(interval):
+            now_stat, now = read_disk_stat(disk), time.time()
+            sample = OrderedDict([("t", round(now - start, 3))])
+            sample.update(disk_stat_delta(last_stat, now_stat, now - last_time))
+            samples.append(sample)
+            last_stat, last_time = now_stat, now
+
+    thread = threading.Thread(target=sample_stats, daemon=True)
+    thread.start()
+    try:
+        yield telemetry
+    finally:
+        stop.set()
+        thread.join()
+        telemetry["interval"] = interval
+        telemetry["start"] = round(start, 3)
+        telemetry["samples"] = samples
+
+
+def slice_telemetry(telemetry, start, end):
+    """Samples of telemetry with start <= t < end (sec)."""
+    if not telemetry:
+        return telemetry
+    sliced = OrderedDict(telemetry)
+    sliced["samples"] = [sample for sample in telemetry["samples"]
+                         if start <= sample["t"] < end]
+    return sliced
+
+
+def discover_disks(sys_block="/sys/block"):
+    """Find disks that can be tested.
+
+    Skips virtual devices (loop, ram, dm, md, ... have no "device"),
+    removable devices, disks with partitions, disks with mounted filesystems
+    or swap and disks used by other devices (LVM, RAID, see "holders").
+
+    Returns:
+        disks (list of str): disk names, e.g. ["sdb", "sdc", ..., "sdaa"].
+
+    """
+    used = set()
+    for path, column in [("/proc/mounts", 0), ("/proc/swaps", 0)]:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    device = line.split()[column]
+                    if device.startswith("/dev/"):
+                        used.add(os.path.basename(os.path.realpath(device)))
+
+    disks = []
+    for disk in os.listdir(sys_block):
+        disk_path = os.path.join(sys_block, disk)
+        if not os.path.exists(os.path.join(disk_path, "device")):
+            continue
+        removable = os.path.join(disk_path, "removable")
+        if os.path.exists(removable):
+            with open(removable, 'r') as f:
+                if f.read().strip() == "1":
+                    continue
+        partitions = [p for p in os.listdir(disk_path) if p.startswith(disk)]
+        if partitions or disk in used:
+            continue
+        holders = os.path.join(disk_path, "holders")
+        if os.path.isdir(holders) and os.listdir(holders):
+            continue
+        disks.append(disk)
+    return sorted(disks, key=lambda disk: (len(disk), disk))
+
+
+def disks_utilization(disks, interval=1.0):
+    """Utilization (busy fraction) of disks over interval sec.
+
+    Returns:
+        utilization (OrderedDict): disk -> utilization, None if the disk
+            has no stats.
+
+    """
+    start = time.time()
+    stats_1 = [read_disk_stat(disk) for disk in disks]
+    time.sleep(interval)
+    stats_2 = [read_disk_stat(disk) for disk in disks]
+    seconds = time.time() - start
+    utilization = OrderedDict()
+    for disk, stat_1, stat_2 in zip(disks, stats_1, stats_2):
+        if stat_1 is None or stat_2 is None:
+            utilization[disk] = None
+        else:
+            utilization[disk] = disk_stat_delta(stat_1, stat_2, seconds)["util"]
+    return utilization
+
+
+def split_idle_disks(disks, max_util=0.1, interval=1.0):
+    """Split disks into idle and busy (utilization > max_util) ones."""
+    utilization = disks_utilization(disks, interval)
+    idle = [disk for disk in disks
+            if utilization[disk] is None or utilization[disk] <= max_util]
+    busy = [disk for disk in disks if disk not in idle]
+    for disk in busy:
+        print("\t{} is busy: util={:.0%}".format(disk, utilization[disk]))
+    return idle, busy
+
+
+def run_cmd(*popenargs, input=None, check=False, timeout=None, **kwargs):
     if input is not None:
         if 'stdin' in kwargs:
             raise ValueError('stdin and input arguments may not both be used.')
@@ -75,7 +293,7 @@ def run_cmd(*popenargs, input=None, check=False, **kwargs):
     kwargs['stdout'] = subprocess.PIPE
     process = subprocess.Popen(*popenargs, **kwargs)
     try:
-        stdout, stderr = process.communicate(input)
+        stdout, stderr = process.communicate(input, timeout=timeout)
     except:
         process.kill()
         process.wait()
@@ -87,31 +305,224 @@ def run_cmd(*popenargs, input=None, check=False, **kwargs):
     return retcode, stdout, stderr
 
 
-def fio_config(rw, block_size=4, disk_name='sda', iodepth=1, random_offset=False):
+def parse_size(size):
+    """Size with fio suffix ("512M", "1g", "4096") to bytes (base 1024)."""
+    size = size.strip().lower().rstrip("ib")
+    if size[-1] in SIZE_MULTS:
+        return int(float(size[:-1]) * SIZE_MULTS[size[-1]])
+    return int(size)
+
+
+def supports_direct(path):
+    """Whether the filesystem of path supports O_DIRECT (tmpfs does not)."""
+    if not hasattr(os, "O_DIRECT"):
+        return False
+    if os.path.exists(path):
+        try:
+            os.close(os.open(path, os.O_RDONLY | os.O_DIRECT))
+            return True
+        except OSError:
+            return False
+    fd, probe = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    try:
+        os.close(os.open(probe, os.O_RDONLY | os.O_DIRECT))
+        return True
+    except OSError:
+        return False
+    finally:
+        os.remove(probe)
+
+
+_loop_devices = {}
+_loop_lock = threading.Lock()
+
+
+def as_root(cmd):
+    """Prefix cmd (list) with sudo unless we are root."""
+    return cmd if os.geteuid() == 0 else ["sudo"] + cmd
+
+
+class Target():
+    """fio target: block device, regular file, sparse file or loop device.
+
+    Targets are given by strings, so they stay keys of results and journals
+    like disk names:
+
+        "sdb" or "/dev/sdb" -- block device (root),
+        "file:<path>[:<size>]" -- regular file, fio lays it out (writes it)
+            if it is smaller than size,
+        "sparse:<path>:<size>" -- sparse file of size, created by setup,
+        "loop:<path>:<size>" -- loop device over a sparse file of size,
+            attached by setup (root for losetup and fio).
+
+    Files are tested without root and with direct IO when their filesystem
+    supports it.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, rest = spec.partition(":")
+        if kind not in TARGET_KINDS[1:]:
+            kind, rest = "dev", spec
+        if kind == "dev":
+            self.path, size = rest, None
+        else:
+            self.path, _, size = rest.partition(":")
+            self.path = os.path.abspath(os.path.expanduser(self.path))
+        if not size and kind in ("sparse", "loop"):
+            raise ValueError("target '{}' needs a size".format(spec))
+        self.kind = kind
+        self.size = size or None
+
+    @property
+    def name(self):
+        """File-friendly name (for temp configs and logs)."""
+        if self.kind == "dev":
+            return os.path.basename(self.path)
+        return "{}_{}".format(self.kind, os.path.basename(self.path))
+
+    @property
+    def loop_device(self):
+        """Loop device attached to the backing file, None if not attached."""
+        with _loop_lock:
+            if self.path in _loop_devices:
+                return _loop_devices[self.path]
+        _, output, _ = run_cmd(["losetup", "-j", self.path])
+        # /dev/loop0: []: (/path/to/file)
+        line = output.decode('utf-8').strip()
+        return line[:line.find(":")] if line else None
+
+    @property
+    def filename(self):
+        """fio filename."""
+        if self.kind == "dev":
+            return self.path if self.path.startswith("/") else "/dev/" + self.path
+        if self.kind == "loop":
+            device = self.loop_device
+            if device is None:
+                raise ValueError("loop target '{}' is not set up".format(self.spec))
+            return device
+        return self.path
+
+    @property
+    def stat_disk(self):
+        """Disk name in /sys/block (for disk stats), None for files."""
+        if self.kind == "dev":
+            return os.path.basename(self.path)
+        if self.kind == "loop":
+            device = self.loop_device
+            return device and os.path.basename(device)
+        return None
+
+    @property
+    def direct(self):
+        if self.kind in ("dev", "loop"):
+            return True
+        return supports_direct(self.path)
+
+    def setup(self):
+        """Create the sparse file and attach the loop device."""
+        if self.kind in ("sparse", "loop"):
+            size = parse_size(self.size)
+            if not os.path.exists(self.path) or os.path.getsize(self.path) < size:
+                with open(self.path, 'a') as f:
+                    f.truncate(size)
+        if self.kind == "loop" and self.loop_device is None:
+            retcode, output, _ = run_cmd(
+                as_root(["losetup", "--find", "--show", self.path]))
+            if retcode:
+                raise RuntimeError("losetup failed for '{}'".format(self.spec))
+            with _loop_lock:
+                _loop_devices[self.path] = output.decode('utf-8').strip()
+            return True
+        return False
+
+    def teardown(self):
+        """Detach the loop device attached by setup."""
+        with _loop_lock:
+            device = _loop_devices.pop(self.path, None)
+        if device is not None:
+            run_cmd(as_root(["losetup", "-d", device]))
+
+
+@contextlib.contextmanager
+def prepared_targets(disks):
+    """Set up targets of disks for the block, loop devices attached here
+    are detached on exit."""
+    attached = []
+    try:
+        for disk in disks:
+            target = Target(disk)
+            if target.setup():
+                attached.append(target)
+        yield
+    finally:
+        for target in attached:
+            target.teardown()
+
+
+def target_name(disk):
+    """File-friendly name of disk or target."""
+    return Target(disk).name
+
+
+def fio_config(rw, block_size=4, disk_name='sda', iodepth=1, random_offset=False,
+               test_name=None, numjobs=1, write_lat_log=None, write_hist_log=None,
+               log_hist_msec=None, local=True):
     """Create fio config.
 
     Args:
         rw (str): name of read/write test.
         blocksize (int): size (kB).
-        disk_name (str): disk name.
+        disk_name (str): disk name or target (see Target).
         iodepth (int): queue depth.
         random_offset (bool): random fio offset (avoid caching).
+        test_name (str or None): job name, "<rw>_test" if None.
+        numjobs (int): number of processes of the job, reported as one.
+        write_lat_log (str or None): prefix of per-IO slat/clat/lat logs.
+        write_hist_log (str or None): prefix of clat histogram log, needs
+            log_hist_msec.
+        log_hist_msec (int or None): histogram log interval (msec).
+        local (bool): the target is on this host, probe it (direct IO
+            support of files, loop devices); a job for a remote fio server
+            gets direct=1 and the target path as is (loop targets need a
+            local setup).
 
     Returns:
         config (str): fio config.
 
     """
-    test_name = rw + "_test"
+    if test_name is None:
+        test_name = rw + "_test"
+    target = Target(disk_name)
+    if local:
+        direct, filename = int(target.direct), target.filename
+    elif target.kind == "loop":
+        raise ValueError("loop target '{}' can't be set up on a remote node".format(disk_name))
+    else:
+        direct = 1
+        filename = target.filename if target.kind == "dev" else target.path
     config = """[{}]
 blocksize={}k
-filename=/dev/{}
+filename={}
 rw={}
-direct=1
-buffered=0
+direct={}
+buffered={}
 ioengine=libaio
-iodepth={}""".format(test_name, block_size, disk_name, rw, iodepth)
+iodepth={}""".format(test_name, block_size, filename, rw, direct,
+                     1 - direct, iodepth)
+    if target.size is not None:
+        config += '\nsize={}'.format(target.size)
     if random_offset:
         config += '\noffset={}%'.format(random.randint(1, 99))
+    if numjobs > 1:
+        config += '\nnumjobs={}\ngroup_reporting'.format(numjobs)
+    if write_lat_log is not None:
+        config += '\nwrite_lat_log={}'.format(write_lat_log)
+    if write_hist_log is not None:
+        config += '\nwrite_hist_log={}\nlog_hist_msec={}'.format(
+            write_hist_log, log_hist_msec)
     return config
 
 # test = """[readtest]
@@ -126,31 +537,629 @@ iodepth={}""".format(test_name, block_size, disk_name, rw, iodepth)
 # assert test == create_fio_config('read', 4, 'sda', 16)
 
 
+def log_options(log_dir, size, disk, rw, log_hist_msec=None):
+    """fio_config log kwargs of one cell, logs are <log_dir>/<size>_<disk>_<rw>_*.log.
+
+    Args:
+        log_dir (str or None): dir of fio logs, no logs if None.
+        log_hist_msec (int or None): also write clat histogram log with
+            this interval (msec).
+
+    """
+    if log_dir is None:
+        return {}
+    prefix = os.path.join(log_dir, "{}_{}_{}".format(size, target_name(disk), rw))
+    options = {"write_lat_log": prefix}
+    if log_hist_msec is not None:
+        options.update(write_hist_log=prefix, log_hist_msec=log_hist_msec)
+    return options
+
+
+def collect_logs(log_prefix):
+    """fio log files written for the job with log prefix.
+
+    Returns:
+        logs (OrderedDict): kind ('slat', 'clat', 'lat' or 'clat_hist') ->
+            list of log paths (one per job process).
+
+    """
+    logs = OrderedDict()
+    for path in sorted(glob.glob(glob.escape(log_prefix) + "_*.log")):
+        match = FIO_LOG_RE.search(path)
+        if match is not None and path[:match.start()] == log_prefix:
+            logs.setdefault(match.group(1), []).append(path)
+    return logs
+
+
+def add_logs(test, options):
+    """Save log files of the test written with fio_config log options."""
+    if options:
+        test["logs"] = collect_logs(options["write_lat_log"])
+
+
+def batch_test_name(rw, block_size):
+    return "{}_{}K_test".format(rw, block_size)
+
+
+def fio_batch_config(tests, disk_name='sda', iodepth=1, random_offset=False,
+                     runtime=RUNTIME, log_dir=None, log_hist_msec=None):
+    """Create one fio config with several tests of one disk.
+
+    Every test is a separate job, "stonewall" makes fio wait for the
+    previous job, so the tests don't overlap.
+
+    Args:
+        tests (list of (int, str)): block size (kB) and read/write test.
+        log_dir, log_hist_msec: fio logs of every job, see log_options.
+
+    Returns:
+        config (str): fio config.
+        job_configs (OrderedDict): (size, rw) -> (job name, job config).
+
+    """
+    sections = ["[global]\nruntime={}".format(runtime)]
+    job_configs = OrderedDict()
+    for block_size, rw in tests:
+        test_name = batch_test_name(rw, block_size)
+        job_config = fio_config(rw, block_size, disk_name, iodepth,
+                                random_offset, test_name,
+                                **log_options(log_dir, str(block_size) + "K",
+                                              disk_name, rw, log_hist_msec))
+        job_configs[(str(block_size) + "K", rw)] = (test_name, job_config)
+        sections.append(job_config + "\nstonewall")
+    return "\n\n".join(sections), job_configs
+
+
+def split_fio_output(output, test_names, output_format='normal'):
+    """Split output of a multi-job fio run into outputs of single jobs.
+
+    Args:
+        output (str): fio output.
+        test_names (list of str): job names.
+        output_format ('normal', 'json' or 'terse'): fio output format.
+
+    Returns:
+        outputs (OrderedDict): job name -> job output,
+            jobs missing in the output are skipped.
+
+    """
+    outputs = OrderedDict()
+    if output_format == 'terse':
+        # one line per job: terse_version;fio_version;jobname;...
+        lines = {line.split(";")[2]: line for line in output.splitlines()
+                 if line.startswith("3;")}
+        for test_name in test_names:
+            if test_name in lines:
+                outputs[test_name] = lines[test_name]
+        return outputs
+    if output_format == 'json':
+        fio_json = json.loads(output[output.find("{"):])
+        jobs = {job["jobname"]: job for job in fio_json.pop("jobs")}
+        for test_name in test_names:
+            if test_name in jobs:
+                job_json = OrderedDict(fio_json)
+                job_json["jobs"] = [jobs[test_name]]
+                outputs[test_name] = json.dumps(job_json, indent=2)
+        return outputs
+
+    starts = OrderedDict()
+    for test_name in test_names:
+        # at a line start: "read_4K_test" is also the end of "randread_4K_test"
+        match = re.search(r"^" + re.escape(test_name) + r": \(groupid=", output, re.M)
+        if match:
+            starts[test_name] = match.start()
+    end = output.find("\nRun status group")
+    sorted_starts = sorted(starts.values())
+    ends = sorted_starts[1:] + [end if end != -1 else len(output)]
+    bounds = dict(zip(sorted_starts, ends))
+    for test_name, start in starts.items():
+        outputs[test_name] = output[start:bounds[start]]
+    return outputs
+
+
 def save_fio_config(config, filepath='test.ini'):
     with open(filepath, "w+") as f:
         f.write(config)
 
 
+def disk_config_path(config_path, disk):
+    """Per-disk temp config path, so parallel workers don't share one file."""
+    root, ext = os.path.splitext(config_path)
+    return "{}_{}{}".format(root, target_name(disk), ext)
+
+
+def fio_needs_root(config_path):
+    """Whether fio needs root for the files of the job file.
+
+    Every filename of the job file must be readable and writable (or
+    creatable) by the user to run fio without sudo.
+    """
+    if os.geteuid() == 0:
+        return False
+    with open(config_path, 'r') as f:
+        filenames = re.findall(r"^\s*filename\s*=\s*(.+?)\s*$", f.read(), re.MULTILINE)
+    for filename in filenames:
+        if os.path.exists(filename):
+            if not os.access(filename, os.R_OK | os.W_OK):
+                return True
+        elif not os.access(os.path.dirname(filename) or ".", os.W_OK):
+            return True
+    return False
+
+
+def fio_cmd(config_path, sudo=None):
+    """fio command of job file, with sudo if needed (see fio_needs_root) or asked."""
+    if sudo is None:
+        sudo = fio_needs_root(config_path)
+    return ["sudo", "fio"] if sudo else ["fio"]
+
+
+def run_fio(config_path, runtime=RUNTIME, output_format='normal', timeout=None,
+            sudo=None):
+    """Run fio with the given job file and return its output.
+
+    fio runs with sudo only if the job file needs it (see fio_needs_root),
+    unless sudo is given.
+    """
+    cmd = fio_cmd(config_path, sudo) + "{} --runtime={} --output-format={}".format(
+        config_path, runtime, output_format).split()
+    return run_cmd(cmd, timeout=timeout)[1].decode('utf-8')
+
+
+def terse_metric(line, metric='iops'):
+    """Read metric of both directions from fio terse (v3) line.
+
+    Args:
+        metric ('iops', 'bw' or 'lat'): total IOPS, total bandwidth (KiB/s)
+            or mean total latency (usec, weighted by IO of directions).
+
+    """
+    fields = line.split(";")
+    starts = TERSE_DIRECTION_START.values()
+    ios = [float(fields[start + TERSE_IO]) for start in starts]
+    if metric == 'iops':
+        return sum(float(fields[start + TERSE_IOPS]) for start in starts)
+    if metric == 'bw':
+        return sum(float(fields[start + TERSE_BW]) for start in starts)
+    if metric == 'lat':
+        if sum(ios) == 0:
+            return 0.
+        return sum(io * float(fields[start + TERSE_FIELDS["lat"][0]])
+                   for io, start in zip(ios, starts)) / sum(ios)
+    raise ValueError("metric must be 'iops', 'bw' or 'lat'")
+
+
+def is_converged(values, tolerance=0.05, window=5):
+    """Check that the last window values are within +-tolerance of their mean."""
+    if len(values) < window:
+        return False
+    values = values[-window:]
+    mean = sum(values) / window
+    if mean == 0:
+        return False
+    return (max(values) - min(values)) / 2 <= tolerance * abs(mean)
+
+
+def run_fio_adaptive(config_path, runtime=RUNTIME, metric='iops', tolerance=0.05,
+                     min_runtime=5, window=5, interval=1, timeout=None, sudo=None):
+    """Run fio until the running mean of metric settles.
+
+    fio prints terse status every interval seconds, the running (since start)
+    IOPS, bandwidth or latency is read from every status and fio is stopped
+    (SIGINT, fio still prints the final result) as soon as min_runtime passed
+    and the last window values stay within the relative tolerance band.
+    runtime is the max runtime.
+
+    Returns:
+        output (str): final fio terse output.
+        convergence (OrderedDict): metric, tolerance, converged, runtime (sec)
+            and trace ([[sec, value], ...]).
+
+    """
+    cmd = fio_cmd(config_path, sudo) + (
+        "{} --runtime={} --output-format=terse --status-interval={}".format(
+            config_path, runtime, interval).split())
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+    start = time.time()
+    lines = []
+    trace = []
+    converged = False
+    try:
+        for line in process.stdout:
+            if not line.startswith("3;"):
+                continue
+            lines.append(line.rstrip("\n"))
+            elapsed = time.time() - start
+            trace.append([round(elapsed, 3), terse_metric(line, metric)])
+            if (not converged and elapsed >= min_runtime and
+                    is_converged([v for _, v in trace], tolerance, window)):
+                converged = True
+                process.send_signal(signal.SIGINT)
+        process.wait()
+    except:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    convergence = OrderedDict([
+        ("metric", metric),
+        ("tolerance", tolerance),
+        ("converged", converged),
+        ("runtime", round(time.time() - start, 3)),
+        ("trace", trace[:-1]),  # the last line is the final result
+    ])
+    return (lines[-1] if lines else ""), convergence
+
+
+def fio_errors_runtimes(output, output_format='normal'):
+    """Errors and runtimes of fio output.
+
+    Returns:
+        errors (list of int): error of every job, empty if the output has
+            no result.
+        runtimes (list of int): runtime (msec) of every direction with IO.
+
+    """
+    errors = []
+    runtimes = []
+    if output_format == 'json':
+        try:
+            fio_json = json.loads(output[output.find("{"):])
+        except ValueError:
+            return [], []
+        for job in fio_json.get("jobs", fio_json.get("client_stats", [])):
+            errors.append(job["error"])
+            runtimes += [job[d]["runtime"] for d in ("read", "write")
+                         if job[d]["io_bytes"] > 0]
+    elif output_format == 'terse':
+        for line in output.splitlines():
+            if not line.startswith(TERSE_VERSION + ";"):
+                continue
+            fields = line.split(";")
+            errors.append(int(fields[4]))
+            # total io (KiB) and runtime (msec) of read and write
+            for start in TERSE_DIRECTION_START.values():
+                if int(fields[start + TERSE_IO]) > 0:
+                    runtimes.append(int(fields[start + TERSE_RUNTIME]))
+    else:
+        errors = [int(err) for err in re.findall(r"err=\s*(\d+)", output)]
+        # read: IOPS=5699, BW=22.3MiB/s (23.3MB/s)(668MiB/30001msec)
+        runtimes = [int(t) for t in re.findall(r"/(\d+)msec\)", output)]
+    return errors, runtimes
+
+
+def job_windows(outputs, test_names, output_format='normal', start=0.0, end=0.0):
+    """Time windows of stonewalled jobs of one fio run (see fio_batch_config).
+
+    A job of json output with job_start (fio >= 3.28) gets its own window.
+    The others are placed back to back from the end of the run: every job
+    ends where the next one starts and lasts its runtime from the output,
+    so fio startup and layout, early-stopped jobs and jobs missing in the
+    output don't shift the windows.
+
+    Args:
+        outputs (dict): job name -> job output, see split_fio_output.
+        test_names (list of str): job names in the order of the job file.
+        start (float): unix time (sec) the windows are relative to.
+        end (float): unix time (sec) fio exited.
+
+    Returns:
+        windows (OrderedDict): job name -> (start, end), sec from start,
+            jobs of outputs only.
+
+    """
+    windows = OrderedDict()
+    cursor = end - start
+    for test_name in reversed(test_names):
+        if test_name not in outputs:
+            continue
+        output = outputs[test_name]
+        job = None
+        if output_format == 'json':
+            try:
+                fio_json = json.loads(output[output.find("{"):])
+                job = fio_json["jobs"][0]
+            except (ValueError, KeyError, IndexError):
+                job = None
+        if job is not None and "job_start" in job and "job_runtime" in job:
+            job_start = job["job_start"] / 1000 - start
+            windows[test_name] = (job_start, job_start + job["job_runtime"] / 1000)
+            cursor = job_start
+            continue
+        runtimes = fio_errors_runtimes(output, output_format)[1]
+        runtime = max(runtimes) / 1000 if runtimes else 0.0
+        windows[test_name] = (cursor - runtime, cursor)
+        cursor -= runtime
+    return OrderedDict((name, windows[name]) for name in test_names if name in windows)
+
+
+def test_status(output, runtime=RUNTIME, output_format='normal', min_runtime_ratio=0.99):
+    """Check how fio test finished.
+
+    Args:
+        output (str): fio output of one test.
+        runtime (int): requested runtime (sec).
+        output_format ('normal', 'json' or 'terse'): fio output format.
+        min_runtime_ratio (float): test is short if it ran less than
+            min_runtime_ratio * runtime.
+
+    Returns:
+        status ('ok', 'failed' or 'short'): 'failed' if fio reported
+            an error or no result.
+
+    """
+    errors, runtimes = fio_errors_runtimes(output, output_format)
+    if not errors or any(errors) or not runtimes:
+        return 'failed'
+    if min(runtimes) < min_runtime_ratio * runtime * 1000:
+        return 'short'
+    return 'ok'
+
+
+_journal_lock = threading.Lock()
+
+
+def append_journal(journal_path, size, disk, rw, test):
+    """Append finished test to the journal (one json per line)."""
+    record = OrderedDict([("size", size), ("disk", disk), ("rw", rw)])
+    record.update(test)
+    line = json.dumps(record) + "\n"
+    with _journal_lock:
+        with open(journal_path, 'a') as fp:
+            fp.write(line)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+
+def iter_journal(journal_path):
+    """Iterate over journal records (tests with size, disk and rw)."""
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'r') as fp:
+        for line in fp:
+            try:
+                yield json.loads(line, object_pairs_hook=OrderedDict)
+            except ValueError:
+                # line cut by a crash
+                continue
+
+
+def read_journal(journal_path):
+    """Read journal of tests.
+
+    Returns:
+        tests (OrderedDict): (size, disk, rw) -> test, the last record
+            of a test wins.
+
+    """
+    tests = OrderedDict()
+    for record in iter_journal(journal_path):
+        key = (record.pop("size"), record.pop("disk"), record.pop("rw"))
+        tests.pop(key, None)
+        tests[key] = record
+    return tests
+
+
+def journal_to_result(tests):
+    """Journal tests to the result of run_test (size -> disk -> rw -> test)."""
+    result = OrderedDict()
+    for (size, disk, rw), test in tests.items():
+        if test["status"] != 'failed':
+            result.setdefault(size, OrderedDict()).setdefault(
+                disk, OrderedDict())[rw] = test
+    return result
+
+
+def finish_test(test, size, disk, rw, journal_path=None):
+    """Log test status and append test to the journal."""
+    if test["status"] != 'ok':
+        print("\t\t{} {} {}: {} {}".format(
+            disk, size, rw, test["status"], test.get("error", "")))
+    if journal_path is not None:
+        append_journal(journal_path, size, disk, rw, test)
+
+
+def run_disk_tests(block_size, disk, rw_list=RW_LIST, runtime=RUNTIME, iodepth=1,
+                   config_path='test.ini', output_format='normal', random_offset=False,
+                   timeout=None, done=None, journal_path=None, adaptive=None,
+                   telemetry_interval=None, backend=run_fio, log_dir=None,
+                   log_hist_msec=None, seed=None):
+    """Run all read/write tests of one block size on one disk.
+
+    Args:
+        done (dict or None): (size, disk, rw) -> test, tests to skip.
+        journal_path (str or None): journal for finished tests.
+        adaptive (dict or None): kwargs of run_fio_adaptive, fixed runtime if None.
+        telemetry_interval (float or None): disk stats sampling interval (sec).
+        backend (callable): runs fio job file, see run_fio.
+        log_dir, log_hist_msec: fio latency/histogram logs, see log_options.
+        seed (int or None): seed of disk sampling, saved in every test
+            (and in the journal).
+
+    Returns:
+        result (OrderedDict): rw -> {"config", "result", "status"},
+            failed tests are skipped.
+
+    """
+    size = str(block_size) + "K"
+    done = done or {}
+    result = OrderedDict()
+    for rw in rw_list:
+        if (size, disk, rw) in done:
+            result[rw] = done[(size, disk, rw)]
+            continue
+        print("\t\t{} test_name: {}".format(disk, rw))
+        logs = log_options(log_dir, size, disk, rw, log_hist_msec)
+        config = fio_config(rw, block_size, disk, iodepth, random_offset, **logs)
+        test = OrderedDict([("config", config)])
+        if seed is not None:
+            test["seed"] = seed
+        try:
+            save_fio_config(config, config_path)
+            with disk_telemetry(disk, telemetry_interval) as telemetry:
+                if adaptive is None:
+                    output = backend(config_path, runtime, output_format, timeout)
+                else:
+                    output, test["convergence"] = run_fio_adaptive(
+                        config_path, runtime, timeout=timeout, **adaptive)
+            test["result"] = output
+            if adaptive is None:
+                test["status"] = test_status(output, runtime, output_format)
+            else:
+                test["status"] = test_status(
+                    output, adaptive.get('min_runtime', 5), output_format)
+            if telemetry:
+                test["telemetry"] = telemetry
+            add_logs(test, logs)
+        except Exception as e:
+            test["result"] = ""
+            test["status"] = 'failed'
+            test["error"] = repr(e)
+        finish_test(test, size, disk, rw, journal_path)
+        if test["status"] != 'failed':
+            result[rw] = test
+    return result
+
+
+def run_disk_batch(block_sizes, disk, rw_list=RW_LIST, runtime=RUNTIME, iodepth=1,
+                   config_path='test.ini', output_format='normal', random_offset=False,
+                   timeout=None, done=None, journal_path=None, telemetry_interval=None,
+                   backend=run_fio, log_dir=None, log_hist_msec=None, seed=None):
+    """Run all tests of one disk with one fio process.
+
+    Args:
+        done (dict or None): (size, disk, rw) -> test, tests to skip.
+        journal_path (str or None): journal for finished tests.
+        telemetry_interval (float or None): disk stats sampling interval (sec),
+            every test gets the samples of its time window (the jobs run
+            one after another, see job_windows).
+        backend (callable): runs fio job file, see run_fio.
+        log_dir, log_hist_msec: fio latency/histogram logs, see log_options.
+        seed (int or None): seed of disk sampling, saved in every test
+            (and in the journal).
+
+    Returns:
+        result (OrderedDict): size -> rw -> {"config", "result", "status"},
+            failed tests are skipped.
+
+    """
+    done = done or {}
+    tests = [(block_size, rw) for block_size in block_sizes for rw in rw_list
+             if (str(block_size) + "K", disk, rw) not in done]
+    new_tests = OrderedDict()
+    if tests:
+        print("\t\t{} batch: {} tests".format(disk, len(tests)))
+        config, job_configs = fio_batch_config(
+            tests, disk, iodepth, random_offset, runtime, log_dir, log_hist_msec)
+        telemetry = OrderedDict()
+        try:
+            save_fio_config(config, config_path)
+            with disk_telemetry(disk, telemetry_interval) as telemetry:
+                output = backend(config_path, runtime, output_format,
+                                 timeout and timeout * len(tests))
+                fio_end = time.time()
+            test_names = [test_name for test_name, _ in job_configs.values()]
+            outputs = split_fio_output(output, test_names, output_format)
+            windows = {}
+            if telemetry:
+                windows = job_windows(outputs, test_names, output_format,
+                                      telemetry["start"], fio_end)
+            error = None
+        except Exception as e:
+            outputs = {}
+            error = repr(e)
+        for (size, rw), (test_name, job_config) in job_configs.items():
+            test = OrderedDict([("config", job_config)])
+            if seed is not None:
+                test["seed"] = seed
+            if test_name in outputs:
+                test["result"] = outputs[test_name]
+                test["status"] = test_status(
+                    test["result"], runtime, output_format)
+                if telemetry:
+                    test["telemetry"] = slice_telemetry(telemetry, *windows[test_name])
+                add_logs(test, log_options(log_dir, size, disk, rw, log_hist_msec))
+            else:
+                test["result"] = ""
+                test["status"] = 'failed'
+                test["error"] = error or "job not found in fio output"
+            finish_test(test, size, disk, rw, journal_path)
+            new_tests[(size, rw)] = test
+
+    result = OrderedDict()
+    for block_size in block_sizes:
+        size = str(block_size) + "K"
+        result[size] = OrderedDict()
+        for rw in rw_list:
+            test = done.get((size, disk, rw), new_tests.get((size, rw)))
+            if test["status"] != 'failed':
+                result[size][rw] = test
+    return result
+
+
 def run_test(block_sizes=BLOCK_SIZES, disks=DISKS, n_disks_sample=N_DISK_SAMPLE,
              runtime=RUNTIME, timeout=RUNTIME * 3, iodepth=1, config_path='test.ini',
-             rw_list=RW_LIST, output_format='normal', random_offset=False):
+             rw_list=RW_LIST, output_format='normal', random_offset=False, n_workers=1,
+             batch=None, journal_path=None, adaptive=None, telemetry_interval=None,
+             backend=run_fio, seed=None, max_util=None, busy_retries=2, busy_delay=60,
+             log_dir=None, log_hist_msec=None):
     """Run fio tests.
 
     Args:
         block_size (int): size (kB).
         n_disks_sample (int or None): test all disks without sampling if None,
             otherwise number sampling of tested disks.
-        disks (list of str): list of available disks.
+        disks (list of str): list of available disks, or files and loop
+            devices (see Target), e.g. ["sparse:/tmp/fio.dat:1G"].
         runtime(int): test runtime (sec).
         timeout (int): timeout (sec).
         iodepth (int): queue depth.
         config_path (str): temp path to config.
         rw_list (list of str): list of read/write tests.
-        output_format ('normal' or 'json'): fio output format.
+        output_format ('normal', 'json' or 'terse'): fio output format,
+            'json' and 'terse' are parsed without scanning of text.
         random_offset (bool): random fio offset (avoid caching).
+        n_workers (int): max number of disks tested at the same time,
+            1 runs the tests one by one.
+        batch (None, 'rw' or 'sizes'): run every test with its own fio process
+            if None, otherwise one fio process per disk with all read/write
+            tests of a block size ('rw') or all tests of the disk ('sizes').
+        journal_path (str or None): every finished test is appended to this
+            journal (see append_journal), tests of the journal with status
+            'ok' are not run again, so a killed run can be resumed.
+        adaptive (dict or None): stop every test as soon as its IOPS, bandwidth
+            or latency settles, e.g. {'metric': 'lat', 'tolerance': 0.02,
+            'min_runtime': 5} (see run_fio_adaptive), runtime is the max
+            runtime then. The convergence trace is saved next to the result.
+            Needs output_format='terse' and batch=None.
+        telemetry_interval (float or None): sample disk stats (utilization,
+            queue size, merged IOs, see disk_telemetry) every
+            telemetry_interval sec during the tests, samples are saved
+            next to the result.
+        backend (callable): backend(config_path, runtime, output_format, timeout)
+            runs fio job file and returns fio output, fio (run_fio, with
+            sudo only if a target needs root) by default, see fio_simulator.FioSimulator for a simulator.
+        seed (int or None): seed of disk sampling, random if None (the seed
+            of the journal when resumed), saved in every test.
+        max_util (float or None): pre-flight check, disks busier than
+            max_util (e.g. 0.1, production IO) are postponed to the end of
+            the block size, checked again up to busy_retries times
+            (busy_delay sec apart) and skipped if still busy.
+        log_dir (str or None): dir of fio per-IO latency logs (write_lat_log),
+            the paths of the logs of a test are saved in test["logs"],
+            see fio_log_ingest for histograms of them.
+        log_hist_msec (int or None): also write fio clat histogram logs
+            (write_hist_log) with this interval (msec), needs log_dir.
 
     Returns:
-        result (OrderedDict): results of fio tests.
+        result (OrderedDict): results of fio tests, failed tests are skipped.
 
     Note:
         It is a question how to define iodepth,
@@ -160,35 +1169,160 @@ def run_test(block_sizes=BLOCK_SIZES, disks=DISKS, n_disks_sample=N_DISK_SAMPLE,
             https://tobert.github.io/post/2014-04-17-fio-output-explained.html
         So I compared iops with iodepth=1 and iodepth=16 -- there was no difference,
         So we took 1.
+
+        With n_workers > 1 every disk gets its own worker and temp config
+        (see disk_config_path), the disks are independent, so the tests of
+        one block size take about as long as the tests of one disk.
     """
+    if batch not in (None, 'rw', 'sizes'):
+        raise ValueError("batch must be None, 'rw' or 'sizes'")
+    if adaptive is not None and (output_format != 'terse' or batch is not None):
+        raise ValueError("adaptive runtime needs output_format='terse' and batch=None")
+    if adaptive is not None and backend is not run_fio:
+        raise ValueError("adaptive runtime runs fio itself, it can't use a backend")
+    if log_hist_msec is not None and log_dir is None:
+        raise ValueError("log_hist_msec needs log_dir")
+
+    done = OrderedDict()
+    if journal_path is not None:
+        skipped = 0
+        for key, test in read_journal(journal_path).items():
+            if test["status"] != 'ok':
+                continue
+            # without the seed the disks of the test can't be sampled again
+            if "seed" not in test:
+                skipped += 1
+                continue
+            done[key] = test
+        if skipped:
+            print("\nresume: {} tests without seed are run again".format(skipped))
+        if done:
+            print("\nresume: {} tests done".format(len(done)))
+            if seed is None:
+                seed = next(iter(done.values()))["seed"]
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+    print("\nseed: {}".format(seed))
+    disks_random = random.Random(seed)
+
     result = OrderedDict()
+    if batch == 'sizes':
+        size_groups = [block_sizes]
+    else:
+        size_groups = [[block_size] for block_size in block_sizes]
 
-    try:
-        for block_size in block_sizes:
-            print("\nsize: {}K".format(block_size))
-            size = str(block_size) + "K"
-            result[size] = OrderedDict()
+    def run_disk(disk):
+        path = config_path if n_workers == 1 else disk_config_path(
+            config_path, disk)
+        if batch is None:
+            block_size = sizes[0]
+            return OrderedDict([(str(block_size) + "K", run_disk_tests(
+                block_size, disk, rw_list, runtime, iodepth, path,
+                output_format, random_offset, timeout, done, journal_path,
+                adaptive, telemetry_interval, backend, log_dir, log_hist_msec,
+                seed))])
+        return run_disk_batch(sizes, disk, rw_list, runtime, iodepth, path,
+                              output_format, random_offset, timeout, done,
+                              journal_path, telemetry_interval, backend,
+                              log_dir, log_hist_msec, seed)
+
+    with prepared_targets(disks), ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for sizes in size_groups:
+            print("\nsize: {}".format(
+                ", ".join(str(block_size) + "K" for block_size in sizes)))
             if n_disks_sample is not None:
-                disks_sample = random.choice(disks, n_disks_sample)
+                disks_sample = disks_random.sample(disks, n_disks_sample)
             else:
                 disks_sample = disks
+            busy = list(disks_sample)
+            for attempt in range(busy_retries + 1 if max_util is not None else 1):
+                if attempt > 0:
+                    print("\n\tpostponed: " + ", ".join(busy))
+                    time.sleep(busy_delay)
+                if max_util is None:
+                    ready, busy = busy, []
+                else:
+                    ready, busy = split_idle_disks(busy, max_util)
+                print("\n\tdisks: " + ", ".join(ready))
+                # map keeps the order of disks
+                for disk, disk_result in zip(ready, executor.map(run_disk, ready)):
+                    for size, rw_result in disk_result.items():
+                        if rw_result:
+                            result.setdefault(size, OrderedDict())[disk] = rw_result
+                if not busy:
+                    break
+            if busy:
+                print("\n\tskipped busy disks: " + ", ".join(busy))
+    return result
+
+
+def sweep_point_name(iodepth, numjobs):
+    return "qd{}_nj{}".format(iodepth, numjobs)
+
+
+def run_sweep(block_sizes=BLOCK_SIZES, disks=DISKS, rw_list=RW_LIST,
+              iodepths=SWEEP_IODEPTHS, numjobs_list=SWEEP_NUMJOBS, runtime=RUNTIME,
+              timeout=RUNTIME * 3, config_path='test.ini', output_format='normal',
+              random_offset=False, journal_path=None, backend=run_fio):
+    """Run fio tests for every iodepth and numjobs.
+
+    Args:
+        iodepths (list of int): queue depths.
+        numjobs_list (list of int): numbers of processes.
+        journal_path (str or None): journal of tests, rw of a record is
+            "<rw>:<point>", tests with status 'ok' are not run again.
+
+    Other args are the same as in run_test.
+
+    Returns:
+        result (OrderedDict): size -> disk -> rw -> point -> test,
+            point is sweep_point_name(iodepth, numjobs), the test has
+            iodepth and numjobs. Failed tests are skipped.
+
+    """
+    done = OrderedDict()
+    if journal_path is not None:
+        for key, test in read_journal(journal_path).items():
+            if test["status"] == 'ok':
+                done[key] = test
+
+    result = OrderedDict()
+    with prepared_targets(disks):
+        for block_size in block_sizes:
+            size = str(block_size) + "K"
+            print("\nsize: " + size)
+            result[size] = OrderedDict()
             for disk in disks:
-                print("\n\tdisk: " + disk)
                 result[size][disk] = OrderedDict()
                 for rw in rw_list:
-                    print("\t\ttest_name:", rw)
-                    config = fio_config(
-                        rw, block_size, disk, iodepth, random_offset)
-                    save_fio_config(config, config_path)
-                    cmd = "sudo fio {} --runtime={} --output-format={}".format(
-                        config_path, runtime, output_format)
-                    output = run_cmd(cmd.split())[1].decode('utf-8')
                     result[size][disk][rw] = OrderedDict()
-                    result[size][disk][rw]["config"] = config
-                    result[size][disk][rw]["result"] = output
-    except:
-        print("\t\terror")
-
+                    for numjobs in numjobs_list:
+                        for iodepth in iodepths:
+                            point = sweep_point_name(iodepth, numjobs)
+                            key = (size, disk, "{}:{}".format(rw, point))
+                            if key in done:
+                                result[size][disk][rw][point] = done[key]
+                                continue
+                            print("\t\t{} {} {}".format(disk, rw, point))
+                            config = fio_config(rw, block_size, disk, iodepth,
+                                                random_offset, numjobs=numjobs)
+                            test = OrderedDict([("config", config),
+                                                ("iodepth", iodepth),
+                                                ("numjobs", numjobs)])
+                            try:
+                                save_fio_config(config, config_path)
+                                output = backend(config_path, runtime, output_format, timeout)
+                                test["result"] = output
+                                test["status"] = test_status(output, runtime, output_format)
+                            except Exception as e:
+                                test["result"] = ""
+                                test["status"] = 'failed'
+                                test["error"] = repr(e)
+                            finish_test(test, *key, journal_path=journal_path)
+                            if test["status"] != 'failed':
+                                result[size][disk][rw][point] = test
     return result
 
 
@@ -0,0 +1,37 @@
+# fio campaign for the gotatlin node, repeats are driven by the variance of results.
+
+from fio_campaign import Campaign, save_campaign_results
+
+RUNTIME = 30
+TIME_BUDGET = 12 * 3600  # sec
+MIN_RUNS = 3
+TARGET_PRECISION = 0.05  # relative half-width of 95% CI of latency mean
+N_WORKERS = 5  # disks tested at the same time
+BLOCK_SIZES = [2**x for x in range(2, 12)]  # kB ~ 1000
+
+
+RW_LIST = [
+    'read',
+    'write',
+    'randread',
+    'randwrite',
+    'rw',
+    'randrw',
+]
+
+DISKS = ["sdf", "sdd", "sdp", "sdw", "sdah"]
+
+
+def main():
+    campaign = Campaign("fiotests/campaign.jsonl", block_sizes=BLOCK_SIZES, disks=DISKS,
+                        rw_list=RW_LIST, time_budget=TIME_BUDGET, min_runs=MIN_RUNS,
+                        target_precision=TARGET_PRECISION, metric='lat', runtime=RUNTIME,
+                        timeout=RUNTIME * 3, iodepth=1, config_path='test.ini',
+                        output_format='normal', random_offset=True, n_workers=N_WORKERS)
+    campaign.run()
+    for row, (n_runs, precision) in campaign.precision_report().items():
+        print("{}: {} runs, +-{:.1%}".format(row, n_runs, precision))
+    save_campaign_results("fiotests/campaign.jsonl", "fiotests/fio_tests_{}.json")
+
+if __name__ == '__main__':
+    main()
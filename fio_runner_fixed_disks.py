@@ -4,6 +4,9 @@ from collections import OrderedDict
 from fio_run_utils import run_test, save_json
 
 N_DISK_SAMPLE = None
+N_WORKERS = 5  # disks tested at the same time
+BATCH = 'sizes'  # one fio process per disk
+TELEMETRY_INTERVAL = 1  # sec, disk stats sampling
 RUNTIME = 30
 BLOCK_SIZES = [2**x for x in range(2, 12)]  # kB ~ 1000
 
@@ -22,7 +25,8 @@ DISKS = ["sdf", "sdd", "sdp", "sdw", "sdah"]
 
 def print_start(n_tests):
     print("#start")
-    test_time = len(DISKS) * len(RW_LIST) * RUNTIME * len(BLOCK_SIZES)
+    n_rounds = -(-len(DISKS) // N_WORKERS)  # ceil
+    test_time = n_rounds * len(RW_LIST) * RUNTIME * len(BLOCK_SIZES)
     print("#time of one test: {} min".format(test_time / 60))
     print("#test time: {} h".format(test_time * n_tests / 3600))
 
@@ -36,10 +40,13 @@ def main():
     print_start(n_tests)
     for i in range(n_tests):
         print("###", i)
+        save_path = "fiotests/fio_tests_{}.json".format(i)
         result = run_test(block_sizes=BLOCK_SIZES, disks=DISKS, n_disks_sample=None,
                           runtime=RUNTIME, timeout=RUNTIME * 3, iodepth=1,
-                          config_path='test.ini', rw_list=RW_LIST, output_format='normal', random_offset=True)
-        save_json(result, "fiotests/fio_tests_{}.json".format(i))
+                          config_path='test.ini', rw_list=RW_LIST, output_format='normal', random_offset=True,
+                          n_workers=N_WORKERS, batch=BATCH, telemetry_interval=TELEMETRY_INTERVAL,
+                          journal_path="fiotests/fio_tests_{}.jsonl".format(i))
+        save_json(result, save_path)
     print_end()
 
 if __name__ == '__main__':
@@ -1,9 +1,10 @@
 # fio tests for the gotatlin node.
 
 from collections import OrderedDict
-from fio_run_utils import run_test, save_json
+from fio_run_utils import run_test, save_json, discover_disks
 
 N_DISK_SAMPLE = 5
+MAX_UTIL = 0.1  # disks busier than this are postponed or skipped
 RUNTIME = 30
 BLOCK_SIZES = [2**x for x in range(2, 12)]  # kB ~ 1000
 
@@ -30,11 +31,15 @@ def print_end():
 
 def main():
     print_start()
+    disks = discover_disks()
+    print("#disks: " + ", ".join(disks))
     for i in range(100):
-        result = run_test(block_sizes=BLOCK_SIZES, n_disks_sample=N_DISK_SAMPLE,
+        save_path = "fiotests/fio_tests_{}.json".format(i)
+        result = run_test(block_sizes=BLOCK_SIZES, disks=disks, n_disks_sample=N_DISK_SAMPLE,
                           runtime=RUNTIME, timeout=RUNTIME * 3, iodepth=1,
-                          config_path='test.ini', rw_list=RW_LIST, output_format='normal', random_offset=False)
-        save_json(result, "fiotests/fio_tests_{}.json".format(i))
+                          config_path='test.ini', rw_list=RW_LIST, output_format='normal', random_offset=False,
+                          journal_path="fiotests/fio_tests_{}.jsonl".format(i), max_util=MAX_UTIL)
+        save_json(result, save_path)
     print_end()
 
 if __name__ == '__main__':
@@ -0,0 +1,270 @@
+import argparse
+import json
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_run_utils import (
+    BLOCK_SIZES, RW_LIST, RUNTIME, TERSE_DIRECTION_FIELDS, TERSE_VERSION, run_test, save_json
+)
+from fio_parser_utils import (
+    LAT_BUCKET_EDGES, LAT_BUCKET_INDEX, LAT_BUCKET_LABELS, RW_MODES, test_directions
+)
+from packet_config import INTERPOLATIONS, PacketConfig
+
+
+# clat percentiles fio reports by default (20 fields in terse output, the
+# unused ones are "0%=0")
+FIO_PERCENTILES = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99, 99.5, 99.9, 99.95, 99.99]
+TERSE_PERCENTILES = 20
+
+
+def read_fio_jobs(config_path):
+    """Read jobs of fio job file.
+
+    Returns:
+        jobs (list of OrderedDict): name, rw and blocksize (kB) of every job,
+            options of [global] are applied to every job.
+
+    """
+    global_options = OrderedDict()
+    jobs = []
+    options = None
+    with open(config_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith((";", "#")):
+                continue
+            if line.startswith("["):
+                name = line[1:line.find("]")]
+                if name == "global":
+                    options = global_options
+                else:
+                    options = OrderedDict(global_options)
+                    options["name"] = name
+                    jobs.append(options)
+                continue
+            key, _, value = line.partition("=")
+            options[key.strip()] = value.strip()
+    for job in jobs:
+        job["blocksize"] = int(job.get("blocksize", "4k").lower().rstrip("k"))
+        job.setdefault("rw", "read")
+    return jobs
+
+
+class FioSimulator():
+    """fio backend which samples fio results from a packet config.
+
+    FioSimulator(packet_config) is a drop-in replacement for
+    fio_run_utils.run_fio (see the backend arg of run_test): it reads the
+    job file and writes fio output (normal, json or terse) at once, without
+    root and disks. The metrics of a job are sampled from the packet config
+    at its block size (see packet_config.PacketConfig, the nearest size by
+    default):
+
+        slat -- transmission_time,
+        clat -- read/write_processing_time,
+        lat -- latency_time,
+        bw -- size / rate_time of the mode,
+        iops -- 1 / seek_time of the mode.
+
+    The avg of a metric is drawn from N(mean, std_dev / sqrt(samples)),
+    the stdev from N(std_dev, std_dev / sqrt(2 * samples)). Terse output
+    has clat percentiles and lat buckets of ios latencies drawn from the
+    lognormal distribution with the avg and stdev of clat/lat.
+    """
+
+    def __init__(self, packet_config, seed=None, samples=60, interpolation="nearest",
+                 ios=10000):
+        '''
+        Args:
+            packet_config (str or dict): packet config or path to it.
+            seed (int or None): seed of sampling.
+            samples (int): number of fio samples of a test (bw and iops).
+            ios (int): number of sampled IO latencies of a direction (terse
+                percentiles and lat buckets).
+            interpolation ('nearest', 'linear' or 'pchip'): of the metrics
+                over block sizes, see packet_config.PacketConfig.
+
+        '''
+        self.packet_config = PacketConfig(packet_config, interpolation)
+        self.samples = samples
+        self.ios = ios
+        self._random = np.random.RandomState(seed)
+
+    def __call__(self, config_path, runtime=RUNTIME, output_format='normal', timeout=None):
+        jobs = read_fio_jobs(config_path)
+        runtime = int(jobs[0].get("runtime", runtime)) if jobs else runtime
+        job_metrics = [self.sample_job(job) for job in jobs]
+        if output_format == 'json':
+            return self.json_output(jobs, job_metrics, runtime)
+        if output_format == 'terse':
+            return self.terse_output(jobs, job_metrics, runtime)
+        return self.normal_output(jobs, job_metrics, runtime)
+
+    def _sample(self, mean, std_dev):
+        avg = abs(self._random.normal(mean, std_dev / np.sqrt(self.samples)))
+        stdev = abs(self._random.normal(std_dev, std_dev / np.sqrt(2 * self.samples)))
+        return avg, stdev
+
+    def sample_job(self, job):
+        """Sample metrics of job.
+
+        Returns:
+            metrics (OrderedDict): direction -> metric -> (avg, stdev),
+                latencies in sec, bw in B/s (as fio_parser_utils).
+
+        """
+        mode = RW_MODES[job["rw"]]
+        size = job["blocksize"] * 1000
+
+        def predict(metric):
+            return (self.packet_config.predict(size, mode, metric, "mean"),
+                    self.packet_config.predict(size, mode, metric, "std_dev"))
+
+        metrics = OrderedDict()
+        for direction in test_directions(job["rw"]):
+            metrics[direction] = OrderedDict([
+                ("slat", self._sample(*predict("transmission_time"))),
+                ("clat", self._sample(*predict(direction + "_processing_time"))),
+                ("lat", self._sample(*predict("latency_time"))),
+                ("bw", self._sample(*predict("bw"))),
+                ("iops", self._sample(*predict("iops"))),
+            ])
+        return metrics
+
+    def normal_output(self, jobs, job_metrics, runtime):
+        lines = []
+        for groupid, (job, metrics) in enumerate(zip(jobs, job_metrics)):
+            lines.append("{}: (groupid={}, jobs=1): err= 0: pid={}: simulated".format(
+                job["name"], groupid, groupid + 1))
+            for direction, m in metrics.items():
+                iops = m["iops"][0]
+                kib_s = m["bw"][0] / 1000
+                lines.append("  {}: IOPS={:.0f}, BW={:.0f}KiB/s ({:.0f}kB/s)({:.0f}KiB/{}msec)".format(
+                    direction, iops, kib_s, kib_s, kib_s * runtime, runtime * 1000))
+                for metric, name in [("slat", "    slat"), ("clat", "    clat"),
+                                     ("lat", "     lat")]:
+                    avg, stdev = (v * 1e6 for v in m[metric])
+                    lines.append("{} (usec): min={:.0f}, max={:.0f}, avg={:.2f}, stdev={:.2f}".format(
+                        name, avg / 2, avg + 3 * stdev, avg, stdev))
+                avg, stdev = (v / 1000 for v in m["bw"])
+                lines.append("   bw (  KiB/s): min={:.0f}, max={:.0f}, per=100.00%, avg={:.2f}, "
+                             "stdev={:.2f}, samples={}".format(
+                                 avg / 2, avg + 3 * stdev, avg, stdev, self.samples))
+                avg, stdev = m["iops"]
+                lines.append("   iops        : min={:.0f}, max={:.0f}, avg={:.2f}, "
+                             "stdev={:.2f}, samples={}".format(
+                                 avg / 2, avg + 3 * stdev, avg, stdev, self.samples))
+        for groupid in range(len(jobs)):
+            lines.append("\nRun status group {} (all jobs):".format(groupid))
+        return "\n".join(lines) + "\n"
+
+    def json_output(self, jobs, job_metrics, runtime):
+        fio_jobs = []
+        for groupid, (job, metrics) in enumerate(zip(jobs, job_metrics)):
+            fio_job = OrderedDict([
+                ("jobname", job["name"]), ("groupid", groupid), ("error", 0)])
+            for direction in ["read", "write", "trim"]:
+                fio_dir = OrderedDict([("io_bytes", 0), ("bw", 0), ("iops", 0),
+                                       ("runtime", 0)])
+                for metric in ["slat", "clat", "lat"]:
+                    fio_dir[metric + "_ns"] = OrderedDict([("mean", 0), ("stddev", 0)])
+                fio_dir.update([("bw_mean", 0), ("bw_dev", 0),
+                                ("iops_mean", 0), ("iops_stddev", 0)])
+                if direction in metrics:
+                    m = metrics[direction]
+                    fio_dir["io_bytes"] = int(m["bw"][0] * runtime)
+                    fio_dir["bw"] = int(m["bw"][0] / 1000)
+                    fio_dir["iops"] = m["iops"][0]
+                    fio_dir["runtime"] = runtime * 1000
+                    for metric in ["slat", "clat", "lat"]:
+                        fio_dir[metric + "_ns"] = OrderedDict([
+                            ("mean", m[metric][0] * 1e9), ("stddev", m[metric][1] * 1e9)])
+                    fio_dir.update([
+                        ("bw_mean", m["bw"][0] / 1000), ("bw_dev", m["bw"][1] / 1000),
+                        ("iops_mean", m["iops"][0]), ("iops_stddev", m["iops"][1])])
+                fio_job[direction] = fio_dir
+            fio_jobs.append(fio_job)
+        return json.dumps(OrderedDict([("fio version", "fio-simulator"),
+                                       ("jobs", fio_jobs)]), indent=2)
+
+    def _latencies(self, avg, stdev):
+        """IO latencies (sec) with avg and stdev, lognormal."""
+        if avg <= 0:
+            return np.zeros(self.ios)
+        sigma2 = np.log1p((stdev / avg) ** 2)
+        return self._random.lognormal(np.log(avg) - sigma2 / 2, np.sqrt(sigma2), self.ios)
+
+    def terse_output(self, jobs, job_metrics, runtime):
+        """fio terse v3 output, see fio_run_utils.TERSE_DIRECTION_START."""
+        usec_min_max_mean_std = "{:.0f};{:.0f};{:.6f};{:.6f}".format
+        lines = []
+        for groupid, (job, metrics) in enumerate(zip(jobs, job_metrics)):
+            fields = [TERSE_VERSION, "fio-simulator", job["name"], str(groupid), "0"]
+            latencies = []
+            for direction in ["read", "write"]:
+                if direction not in metrics:
+                    fields += (["0"] * 12 + ["0%=0"] * TERSE_PERCENTILES + ["0"] * 6
+                               + ["0.000000%", "0.000000", "0.000000"])
+                    continue
+                m = metrics[direction]
+                kib_s = m["bw"][0] / 1000
+                fields += [str(int(kib_s * runtime)), str(int(kib_s)),
+                           str(int(m["iops"][0])), str(runtime * 1000)]
+                for metric in ["slat", "clat", "lat"]:
+                    avg, stdev = (v * 1e6 for v in m[metric])
+                    fields.append(usec_min_max_mean_std(avg / 2, avg + 3 * stdev, avg, stdev))
+                    if metric == "clat":
+                        clat = self._latencies(*m["clat"]) * 1e6
+                        fields += ["{:.6f}%={:.0f}".format(q, v) for q, v in zip(
+                            FIO_PERCENTILES, np.percentile(clat, FIO_PERCENTILES))]
+                        fields += ["0%=0"] * (TERSE_PERCENTILES - len(FIO_PERCENTILES))
+                latencies.append(self._latencies(*m["lat"]))
+                avg, stdev = (v / 1000 for v in m["bw"])
+                fields += ["{:.0f}".format(avg / 2), "{:.0f}".format(avg + 3 * stdev),
+                           "100.000000%", "{:.6f}".format(avg), "{:.6f}".format(stdev)]
+            # cpu: usr, sys, ctx, majf, minf; IO depths: 1, 2, 4, 8, 16, 32, >=64
+            fields += ["0.000000%", "0.000000%", "0", "0", "0"]
+            fields += ["100.0%"] + ["0.0%"] * 6
+            # lat buckets (usec, msec) of both directions, the ones below
+            # 2 usec are in the first usec bucket
+            buckets = [LAT_BUCKET_INDEX[(unit, label)] for unit in ["usec", "msec"]
+                       for label in LAT_BUCKET_LABELS[unit]]
+            counts = np.bincount(
+                np.searchsorted(LAT_BUCKET_EDGES[buckets], np.concatenate(latencies)),
+                minlength=len(buckets))
+            fields += ["{:.2f}%".format(100 * c / counts.sum()) for c in counts]
+            lines.append(";".join(fields))
+        return "\n".join(lines) + "\n"
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-config", "--packet_config_path", type=str,
+                        default="packet_configs/FINAL_PACKET_CONFIG_ORIGIN.json", required=False)
+    parser.add_argument("-save", "--save_path_format", type=str,
+                        default="fio_tests/simulated/fio_tests_{}.json", required=False)
+    parser.add_argument("-runs", "--n_runs", type=int, default=1, required=False)
+    parser.add_argument("-disks", "--n_disks", type=int, default=5, required=False)
+    parser.add_argument("-format", "--output_format", type=str, default="normal",
+                        choices=["normal", "json", "terse"], required=False)
+    parser.add_argument("-seed", "--seed", type=int, default=None, required=False)
+    parser.add_argument("-interpolation", "--interpolation", type=str, choices=INTERPOLATIONS,
+                        default="nearest", required=False)
+
+    args = parser.parse_args(args)
+
+    simulator = FioSimulator(args.packet_config_path, args.seed,
+                             interpolation=args.interpolation)
+    disks = ["sim{}".format(i) for i in range(args.n_disks)]
+    for i in range(args.n_runs):
+        result = run_test(block_sizes=BLOCK_SIZES, disks=disks, n_disks_sample=None,
+                          rw_list=RW_LIST, output_format=args.output_format,
+                          config_path="simulator_test.ini", backend=simulator)
+        save_json(result, args.save_path_format.format(i))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,129 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from fio_parser_utils import METRICS, iter_test_results, parse_result_metrics
+
+STORE_DIMS = ["run", "size", "disk", "rw", "direction", "metric", "stat"]
+STORE_DIRECTIONS = ["read", "write"]
+STORE_STATS = ["mean", "std_dev"]
+VALUES_FILE = "values.npy"
+LABELS_FILE = "labels.json"
+
+
+def file_metrics(json_path, output_type="normal", runs=False, run=None, cache=None):
+    """Parse metrics of every test of tests file (streamed).
+
+    Args:
+        json_path (str): tests, see fio_parser_utils.iter_test_results.
+        runs (bool): whether the file has runs (run -> size -> ...).
+        run (str or None): run label of a file without runs, the file name
+            without extension if None.
+        cache (fio_parse_cache.ParseCache or None): cache of parsed outputs.
+
+    Returns:
+        metrics (OrderedDict): (run, size, disk, rw) -> direction -> metric ->
+            (mean, std_dev), failed tests are skipped.
+
+    """
+    if run is None:
+        run = os.path.splitext(os.path.basename(json_path))[0]
+    parse = parse_result_metrics if cache is None else cache.parse
+    metrics = OrderedDict()
+    for test_run, size, disk, rw, result in iter_test_results(json_path, runs):
+        if result:
+            metrics[(test_run if runs else run, size, disk, rw)] = parse(
+                result, rw, output_type)
+    return metrics
+
+
+def write_store(store_path, metrics):
+    """Write metrics to columnar store.
+
+    The store is a dir with values.npy, a dense float array over STORE_DIMS
+    (nan where there is no test or direction), and labels.json with the
+    labels of every dim.
+
+    Args:
+        metrics (dict): (run, size, disk, rw) -> direction -> metric ->
+            (mean, std_dev), see file_metrics.
+
+    """
+    labels = OrderedDict((dim, OrderedDict()) for dim in STORE_DIMS[:4])
+    for key in metrics:
+        for dim, label in zip(STORE_DIMS, key):
+            labels[dim].setdefault(label, len(labels[dim]))
+    labels["direction"] = OrderedDict((d, i) for i, d in enumerate(STORE_DIRECTIONS))
+    labels["metric"] = OrderedDict((m, i) for i, m in enumerate(METRICS))
+    labels["stat"] = OrderedDict((s, i) for i, s in enumerate(STORE_STATS))
+
+    os.makedirs(store_path, exist_ok=True)
+    values = np.lib.format.open_memmap(
+        os.path.join(store_path, VALUES_FILE), mode='w+', dtype=np.float64,
+        shape=tuple(len(labels[dim]) for dim in STORE_DIMS))
+    values[...] = np.nan
+    for key, test_metrics in metrics.items():
+        idx = tuple(labels[dim][label] for dim, label in zip(STORE_DIMS, key))
+        for direction, direction_metrics in test_metrics.items():
+            values[idx + (labels["direction"][direction],)] = [
+                direction_metrics[metric] for metric in METRICS]
+    values.flush()
+    del values
+
+    with open(os.path.join(store_path, LABELS_FILE), 'w') as fp:
+        json.dump(OrderedDict((dim, list(labels[dim])) for dim in STORE_DIMS), fp, indent=2)
+
+
+class ResultStore():
+    """Memory-mapped columnar store of fio metrics (see write_store).
+
+    store.select(disk="sdd", metric="clat", stat="mean") is a view (no copy)
+    of clat means of sdd over run x size x rw x direction, a list of labels
+    selects several labels of a dim (a copy).
+    """
+
+    def __init__(self, store_path):
+        with open(os.path.join(store_path, LABELS_FILE), 'r') as fp:
+            self.labels = json.load(fp, object_pairs_hook=OrderedDict)
+        self.values = np.load(os.path.join(store_path, VALUES_FILE), mmap_mode='r')
+        self._index = {dim: {label: i for i, label in enumerate(labels)}
+                       for dim, labels in self.labels.items()}
+
+    def index(self, dim, label):
+        return self._index[dim][label]
+
+    def select(self, **selection):
+        """Values of the selection.
+
+        Args:
+            selection: dim -> label (the dim is dropped) or list of labels.
+
+        Returns:
+            values (np.ndarray): over the dims not selected by one label
+                (see dims).
+
+        """
+        unknown = set(selection) - set(STORE_DIMS)
+        if unknown:
+            raise ValueError("Unknown dims: {}".format(", ".join(sorted(unknown))))
+        values = self.values
+        # one dim at a time, from the last, so the axes don't shift
+        for axis in reversed(range(len(STORE_DIMS))):
+            dim = STORE_DIMS[axis]
+            if dim not in selection:
+                continue
+            labels = selection[dim]
+            if isinstance(labels, (list, tuple)):
+                values = np.take(values, [self.index(dim, l) for l in labels], axis=axis)
+            else:
+                values = values[(slice(None),) * axis + (self.index(dim, labels),)]
+        return values
+
+    def dims(self, **selection):
+        """Dims of select(**selection) with their labels."""
+        return OrderedDict(
+            (dim, list(selection.get(dim, self.labels[dim])))
+            for dim in STORE_DIMS
+            if not (dim in selection and not isinstance(selection[dim], (list, tuple))))
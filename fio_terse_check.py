@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from fio_parser_utils import METRICS, parse_result_metrics, parse_result_tails
+from fio_run_utils import RW_LIST, terse_metric, test_status
+from fio_simulator import FIO_PERCENTILES, FioSimulator
+
+# fio 3.12 terse v3 line (default --terse-version) of read_test 4K on sdg,
+# the values are those of the normal output of the same run
+# (fio_tests/fio_tests_0.json, "4K" -> "sdg" -> "read")
+TERSE_READ_LINE = (
+    "3;fio-3.12;read_test;0;0;"
+    # read: io, bw, iops, runtime, slat, clat, clat percentiles, lat, bw
+    "683984;22798;5699;30001;5;5365;14.630000;21.850000;1;16808;156.748360;247.192640;"
+    "1.000000%=115;5.000000%=120;10.000000%=125;20.000000%=131;30.000000%=137;"
+    "40.000000%=139;50.000000%=143;60.000000%=145;70.000000%=149;80.000000%=153;"
+    "90.000000%=163;95.000000%=172;99.000000%=314;99.500000%=668;99.900000%=4080;"
+    "99.950000%=6063;99.990000%=9634;0%=0;0%=0;0%=0;"
+    "106;16859;172.010000;248.190000;16400;27800;99.990000%;22796.230000;2244.330000;"
+    # write
+    "0;0;0;0;0;0;0;0;0;0;0;0;"
+    "0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;"
+    "0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;0%=0;"
+    "0;0;0;0;0;0;0.000000%;0.000000;0.000000;"
+    # cpu, IO depths, lat buckets (usec, msec), disk util
+    "3.670000%;10.380000%;172325;0;6;"
+    "100.0%;0.0%;0.0%;0.0%;0.0%;0.0%;0.0%;"
+    "0.02%;0.01%;0.01%;0.01%;0.01%;0.03%;98.56%;0.71%;0.19%;0.10%;"
+    "0.16%;0.09%;0.09%;0.01%;0.00%;0.00%;0.00%;0.00%;0.00%;0.00%;0.00%;0.00%;"
+    "sdg;170471;0;0;0;26290;0;26290;87.71%\n"
+)
+
+
+def check_metrics(terse, normal, rtol, iops_std=True):
+    """Compare metrics of terse and normal output of one test.
+
+    Args:
+        iops_std (bool): compare IOPS stdev too (terse one is derived from bw).
+
+    Returns:
+        errors (list of str): mismatching metrics.
+
+    """
+    errors = []
+    for direction in normal:
+        for metric in METRICS:
+            n = 2 if iops_std or metric != "iops" else 1
+            # terse IOPS are whole
+            atol = 1 if metric == "iops" else 0
+            if not np.allclose(terse[direction][metric][:n], normal[direction][metric][:n],
+                               rtol=rtol, atol=atol):
+                errors.append("{} {}: terse {} != normal {}".format(
+                    direction, metric, terse[direction][metric], normal[direction][metric]))
+    return errors
+
+
+def check_tails(terse, normal, rtol):
+    """Compare clat percentiles, lat buckets and IOs of terse and normal
+    output of one test.
+
+    Returns:
+        errors (list of str): mismatching tails.
+
+    """
+    errors = []
+    for direction, (percentiles, values) in normal["percentiles"]["clat"].items():
+        terse_percentiles, terse_values = terse["percentiles"]["clat"][direction]
+        if (len(terse_percentiles) != len(percentiles)
+                or not np.allclose(terse_percentiles, percentiles)
+                or not np.allclose(terse_values, values, rtol=rtol)):
+            errors.append("{} clat percentiles: terse {} != normal {}".format(
+                direction, list(zip(terse_percentiles, terse_values)),
+                list(zip(percentiles, values))))
+        if not np.isclose(terse["ios"][direction], normal["ios"][direction], rtol=rtol):
+            errors.append("{} ios: terse {} != normal {}".format(
+                direction, terse["ios"][direction], normal["ios"][direction]))
+    if not np.allclose(terse["lat_buckets"], normal["lat_buckets"], atol=1e-4):
+        errors.append("lat buckets: terse {} != normal {}".format(
+            terse["lat_buckets"], normal["lat_buckets"]))
+    return errors
+
+
+def check_simulator(packet_config_path, rtol, seed=0):
+    """Round trip of fio_simulator terse output: its metrics against json
+    output of the same sampling, its tails against fio defaults.
+
+    Returns:
+        errors (list of str): mismatches.
+
+    """
+    errors = []
+    job_path = os.path.join(tempfile.mkdtemp(), "terse_check.ini")
+    for rw in RW_LIST:
+        with open(job_path, 'w') as f:
+            f.write("[{}_test]\nrw={}\nblocksize=4k\nruntime=30\n".format(rw, rw))
+        outputs = {output_format: FioSimulator(packet_config_path, seed)(job_path, 30, output_format)
+                   for output_format in ["terse", "json"]}
+        errors += ["simulator {}: {}".format(rw, error) for error in check_metrics(
+            parse_result_metrics(outputs["terse"], rw, "terse"),
+            parse_result_metrics(outputs["json"], rw, "json"),
+            rtol, iops_std=False)]
+        tails = parse_result_tails(outputs["terse"], rw, "terse")
+        for direction, (percentiles, values) in tails["percentiles"]["clat"].items():
+            if list(percentiles) != FIO_PERCENTILES or np.any(np.diff(values) < 0):
+                errors.append("simulator {} {} clat percentiles: {}".format(
+                    rw, direction, list(zip(percentiles, values))))
+        if not np.isclose(tails["lat_buckets"].sum(), 1, atol=1e-3):
+            errors.append("simulator {} lat buckets sum to {}".format(
+                rw, tails["lat_buckets"].sum()))
+        status = test_status(outputs["terse"], runtime=30, output_format="terse")
+        if status != "ok":
+            errors.append("simulator {} test_status: {} != ok".format(rw, status))
+    os.remove(job_path)
+    return errors
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-test", "--test_path", type=str,
+                        default="fio_tests/fio_tests_0.json", required=False)
+    parser.add_argument("-config", "--packet_config_path", type=str,
+                        default="packet_configs/FINAL_PACKET_CONFIG_ORIGIN.json", required=False)
+    parser.add_argument("-rtol", "--rtol", type=float, default=1e-2, required=False)
+
+    args = parser.parse_args(args)
+
+    with open(args.test_path, 'r') as f:
+        test = json.load(f)["4K"]["sdg"]["read"]
+    errors = check_metrics(parse_result_metrics(TERSE_READ_LINE, "read", "terse"),
+                           parse_result_metrics(test["result"], "read", "normal"),
+                           args.rtol)
+    errors += check_tails(parse_result_tails(TERSE_READ_LINE, "read", "terse"),
+                          parse_result_tails(test["result"], "read", "normal"),
+                          args.rtol)
+    status = test_status(TERSE_READ_LINE, runtime=30, output_format="terse")
+    if status != "ok":
+        errors.append("test_status: {} != ok".format(status))
+    # terse_metric of status lines (see fio_run_utils.run_fio_adaptive)
+    line = TERSE_READ_LINE.strip()
+    for metric, value in [("iops", 5699), ("bw", 22798), ("lat", 172.01)]:
+        if not np.isclose(terse_metric(line, metric), value):
+            errors.append("terse_metric {}: {} != {}".format(metric, terse_metric(line, metric), value))
+    errors += check_simulator(args.packet_config_path, args.rtol)
+    for error in errors:
+        print(error)
+    print("{} errors".format(len(errors)))
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
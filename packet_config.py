@@ -0,0 +1,280 @@
+import math
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from fio_parser_utils import read_json
+
+INTERPOLATIONS = ["nearest", "linear", "pchip"]
+STATS = ["mean", "std_dev"]
+# parameters of a size that don't depend on the mode
+COMMON_PARAMS = ["transmission_time", "latency_time",
+                 "read_processing_time", "write_processing_time"]
+# mode -> (read fraction, random fraction)
+MODE_MIXES = {
+    "seq_read": (1.0, 0.0),
+    "seq_write": (0.0, 0.0),
+    "rand_read": (1.0, 1.0),
+    "rand_write": (0.0, 1.0),
+    "seq_read_write": (0.5, 0.0),
+    "rand_read_write": (0.5, 1.0),
+}
+# metrics computed as scale / time metric (scale is 1 or the block size)
+RECIPROCAL_METRICS = {"iops": "seek_time", "bw": "rate_time"}
+
+
+def pchip_slopes(x, y):
+    """Slopes of monotone piecewise cubic Hermite interpolation (PCHIP,
+    Fritsch-Carlson) of y (last axis) at x, as scipy's PchipInterpolator."""
+    y = np.asarray(y, dtype=float)
+    slopes = np.zeros_like(y)
+    if len(x) < 2:
+        return slopes
+    h = np.diff(x)
+    delta = np.diff(y, axis=-1) / h
+    if len(x) == 2:
+        slopes[...] = delta
+        return slopes
+    # interior points: weighted harmonic mean of the secant slopes, 0 at extrema
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic = (w1 + w2) / (w1 / delta[..., :-1] + w2 / delta[..., 1:])
+    same_sign = delta[..., :-1] * delta[..., 1:] > 0
+    slopes[..., 1:-1] = np.where(same_sign, harmonic, 0)
+    # end points: shape preserving three point formula
+    for end, (h0, h1, d0, d1) in [(0, (h[0], h[1], delta[..., 0], delta[..., 1])),
+                                  (-1, (h[-1], h[-2], delta[..., -1], delta[..., -2]))]:
+        slope = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        slope = np.where(np.sign(slope) != np.sign(d0), 0, slope)
+        slope = np.where((np.sign(d0) != np.sign(d1)) & (np.abs(slope) > np.abs(3 * d0)),
+                         3 * d0, slope)
+        slopes[..., end] = slope
+    return slopes
+
+
+class Curve():
+    """Interpolation of values over log block sizes (one statistic of a
+    query), constant outside the sizes.
+
+    curve(log_size) is a scalar fast path (bisect over Python floats, no
+    numpy overhead), curve.vector(log_sizes) works on arrays.
+    """
+
+    __slots__ = ["interpolation", "x", "y", "bounds", "coefficients",
+                 "_x", "_y", "_bounds", "_coefficients"]
+
+    def __init__(self, log_sizes, values, interpolation="linear"):
+        self.interpolation = interpolation
+        self.x = np.asarray(log_sizes, dtype=float)
+        self.y = np.asarray(values, dtype=float)
+        self.bounds = (self.x[1:] + self.x[:-1]) / 2
+        self.coefficients = None
+        if interpolation == "pchip" and len(self.x) > 1:
+            # cubic of interval i: y[i] + c1 t + c2 t^2 + c3 t^3, t = x - x[i]
+            slopes = pchip_slopes(self.x, self.y)
+            h = np.diff(self.x)
+            delta = np.diff(self.y) / h
+            self.coefficients = np.stack([
+                self.y[:-1], slopes[:-1],
+                (3 * delta - 2 * slopes[:-1] - slopes[1:]) / h,
+                (slopes[:-1] + slopes[1:] - 2 * delta) / h ** 2], axis=-1)
+            self._coefficients = self.coefficients.tolist()
+        self._x = self.x.tolist()
+        self._y = self.y.tolist()
+        self._bounds = self.bounds.tolist()
+
+    def __call__(self, log_size):
+        x = self._x
+        if self.interpolation == "nearest" or len(x) < 2:
+            return self._y[bisect_left(self._bounds, log_size)]
+        if log_size <= x[0]:
+            return self._y[0]
+        if log_size >= x[-1]:
+            return self._y[-1]
+        i = bisect_right(x, log_size) - 1
+        if self.interpolation == "linear":
+            y = self._y
+            return y[i] + (log_size - x[i]) * (y[i + 1] - y[i]) / (x[i + 1] - x[i])
+        c0, c1, c2, c3 = self._coefficients[i]
+        t = log_size - x[i]
+        return ((c3 * t + c2) * t + c1) * t + c0
+
+    def vector(self, log_sizes):
+        if self.interpolation == "nearest" or len(self.x) < 2:
+            return self.y[np.searchsorted(self.bounds, log_sizes)]
+        if self.interpolation == "linear":
+            return np.interp(log_sizes, self.x, self.y)
+        log_sizes = np.clip(log_sizes, self.x[0], self.x[-1])
+        i = np.clip(np.searchsorted(self.x, log_sizes, side='right') - 1, 0, len(self.x) - 2)
+        c0, c1, c2, c3 = self.coefficients[i].T
+        t = log_sizes - self.x[i]
+        return ((c3 * t + c2) * t + c1) * t + c0
+
+
+def mix_weights(read_fraction, random_fraction):
+    """Weights of the modes of a read/write and sequential/random mix.
+
+    Read/write is piecewise linear between write (0), read_write (0.5) and
+    read (1), sequential/random is linear.
+
+    Returns:
+        weights (dict): mode -> weight.
+
+    """
+    if not 0 <= read_fraction <= 1 or not 0 <= random_fraction <= 1:
+        raise ValueError("Fractions must be in [0, 1]: {}, {}".format(
+            read_fraction, random_fraction))
+    if read_fraction >= 0.5:
+        rw_weights = {"read": 2 * read_fraction - 1, "read_write": 2 - 2 * read_fraction}
+    else:
+        rw_weights = {"write": 1 - 2 * read_fraction, "read_write": 2 * read_fraction}
+    weights = {}
+    for access, access_weight in [("seq", 1 - random_fraction), ("rand", random_fraction)]:
+        for rw, rw_weight in rw_weights.items():
+            if access_weight * rw_weight:
+                weights[access + "_" + rw] = access_weight * rw_weight
+    return weights
+
+
+class PacketConfig():
+    """Packet config as arrays, with interpolation over block sizes.
+
+    config.predict(block_sizes, "rand_read", "seek_time") is the seek time
+    of the block sizes (bytes, any, not only the sizes of the config),
+    interpolated over log size; config.predict(sizes, "rand_read_write",
+    "iops", read_fraction=0.7) is the IOPS of a 70/30 random mix.
+
+    Metrics:
+        parameters of a mode -- "rate_time", "seek_time", "overheads_time",
+            nested ones as "clat_percentiles/p99", "lat_buckets/250us";
+        "iops" (1 / seek_time), "bw" (block size / rate_time, B/s) -- times
+            are blended and interpolated, then inverted (std_dev by the
+            delta method);
+        common parameters -- "transmission_time", "latency_time",
+            "read/write_processing_time", "processing_time" (read and write
+            blended by the read fraction), the mode only matters for
+            "processing_time".
+
+    Mixes blend the modes of the config linearly (see mix_weights), time per
+    IO of a mix is the mix of times per IO.
+    """
+
+    def __init__(self, packet_config, interpolation="linear"):
+        '''
+        Args:
+            packet_config (str or dict): packet config or path to it.
+            interpolation ('nearest', 'linear' or 'pchip'): over log block
+                size, 'linear' -- piecewise linear, 'pchip' -- monotone cubic
+                spline, 'nearest' -- value of the nearest size. Values
+                outside the sizes of the config are the values of the
+                smallest/largest size.
+
+        '''
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError("Unknown interpolation '{}'".format(interpolation))
+        if isinstance(packet_config, str):
+            packet_config = read_json(packet_config)
+        self.interpolation = interpolation
+        configs = sorted(packet_config.values(), key=lambda config: config["size"])
+        self.sizes = np.array([config["size"] for config in configs], dtype=float)
+        self._log_sizes = np.log(self.sizes)
+
+        columns = {}
+        for i, config in enumerate(configs):
+            for key, stats in self._iter_params(config, ""):
+                if key not in columns:
+                    columns[key] = np.full((len(STATS), len(configs)), np.nan)
+                columns[key][:, i] = [stats[stat] for stat in STATS]
+        self.keys = list(columns)
+        self._index = {key: i for i, key in enumerate(self.keys)}
+        # parameter x stat x size
+        self.values = np.array([columns[key] for key in self.keys])
+        self._curves = {}
+
+    def _iter_params(self, config, prefix):
+        for key, value in config.items():
+            if not isinstance(value, dict):
+                continue
+            if "mean" in value and "std_dev" in value:
+                yield prefix + key, value
+            else:
+                yield from self._iter_params(value, prefix + key + "/")
+
+    def _mix(self, mode, read_fraction, random_fraction):
+        if mode not in MODE_MIXES:
+            raise ValueError("Unknown mode '{}'".format(mode))
+        mode_read, mode_random = MODE_MIXES[mode]
+        return (mode_read if read_fraction is None else read_fraction,
+                mode_random if random_fraction is None else random_fraction)
+
+    def column_weights(self, mode, metric, read_fraction=None, random_fraction=None):
+        """Columns (keys) of the config and their weights of a metric of a mix."""
+        read_fraction, random_fraction = self._mix(mode, read_fraction, random_fraction)
+        metric = RECIPROCAL_METRICS.get(metric, metric)
+        if metric == "processing_time":
+            weights = {"read_processing_time": read_fraction,
+                       "write_processing_time": 1 - read_fraction}
+            weights = {key: weight for key, weight in weights.items() if weight}
+        elif metric in COMMON_PARAMS:
+            weights = {metric: 1.0}
+        else:
+            weights = {mix_mode + "/" + metric: weight for mix_mode, weight in
+                       mix_weights(read_fraction, random_fraction).items()}
+        for key in weights:
+            if key not in self._index:
+                raise KeyError("No '{}' in packet config".format(key))
+        return weights
+
+    def curves(self, mode, metric, read_fraction=None, random_fraction=None):
+        """Curves (see Curve) of the statistics of a query, cached."""
+        key = (mode, metric, read_fraction, random_fraction)
+        curves = self._curves.get(key)
+        if curves is None:
+            weights = self.column_weights(mode, metric, read_fraction, random_fraction)
+            values = sum(weight * self.values[self._index[column]]
+                         for column, weight in weights.items())
+            curves = self._curves[key] = tuple(
+                Curve(self._log_sizes, stat_values, self.interpolation)
+                for stat_values in values)
+        return curves
+
+    def predict(self, block_sizes, mode, metric, stat="mean", read_fraction=None,
+                random_fraction=None):
+        """Metric of block sizes.
+
+        Args:
+            block_sizes (float or array): block sizes (bytes).
+            mode (str): mode of packet config ('seq_read', ..., 'rand_read_write').
+            metric (str): see PacketConfig.
+            stat ('mean' or 'std_dev'): statistic.
+            read_fraction (float or None): fraction of reads of the mix, of
+                the mode if None (1 for reads, 0.5 for read_write).
+            random_fraction (float or None): fraction of random IOs of the
+                mix, of the mode if None.
+
+        Returns:
+            values (float or np.ndarray): of the shape of block_sizes.
+
+        """
+        curves = self._curves.get((mode, metric, read_fraction, random_fraction))
+        if curves is None:
+            curves = self.curves(mode, metric, read_fraction, random_fraction)
+        scalar = np.ndim(block_sizes) == 0
+        if scalar:
+            log_size = math.log(block_sizes)
+        else:
+            block_sizes = np.asarray(block_sizes, dtype=float)
+            log_size = np.log(block_sizes)
+        if metric not in RECIPROCAL_METRICS:
+            curve = curves[STATS.index(stat)]
+            return curve(log_size) if scalar else curve.vector(log_size)
+
+        mean_curve, std_curve = curves
+        mean = mean_curve(log_size) if scalar else mean_curve.vector(log_size)
+        scale = block_sizes if metric == "bw" else 1.0
+        if stat == "mean":
+            return scale / mean
+        # delta method: std(scale / x) ~ scale * std(x) / mean(x) ** 2
+        std_dev = std_curve(log_size) if scalar else std_curve.vector(log_size)
+        return scale * std_dev / mean ** 2
@@ -1,11 +1,33 @@
 import json
+import threading
 import numpy as np
-from copy import deepcopy
 from collections import OrderedDict
 
 
+def common_dict(nested_dicts):
+    """First nested dict with only the keys that all nested dicts have
+    (e.g. schema of NestedDictEncoder for dicts with optional parts)."""
+    first = nested_dicts[0]
+    result = OrderedDict()
+    for key, value in first.items():
+        if not all(key in d for d in nested_dicts[1:]):
+            continue
+        if isinstance(value, dict):
+            value = common_dict([d[key] for d in nested_dicts])
+            if not value:
+                continue
+        result[key] = value
+    return result
+
+
 class NestedDictEncoder():
-    """Encode/decode nested dicts."""
+    """Encode/decode nested dicts.
+
+    The schema (initial dict) is compiled once: encoding walks it and
+    decoding builds the dicts from a flat list of its entries, nothing is
+    copied and no state is kept between calls (thread-safe, the code
+    tables of categorical features are guarded by a lock).
+    """
 
     def __init__(self, features_types_dict, all_nums=True):
         '''
@@ -18,111 +40,139 @@ class NestedDictEncoder():
             VAE and/or other encoders
 
         '''
-        self.features_types_dict = OrderedDict(deepcopy(features_types_dict))
-
-        self._features_types = list(
-            self._get_nested_dict_values(self.features_types_dict))
+        # schema: list of (key, schema of dict or None for leaf)
+        self._schema = self._compile(features_types_dict)
+        # entries of schema in order: (parent dict idx, key, leaf idx or None)
+        self._entries = []
+        self._keys = []
+        self._add_entries(self._schema, 0, [1])
+
+        types = list(self._iter_leaves(features_types_dict))
         if all_nums:
-            self._features_types = ['num' for _ in self._features_types]
+            types = ['num' for _ in types]
         else:
-            for f in self._features_types:
+            for f in types:
                 if f not in ['num', 'cat']:
                     raise ValueError('Values must be "num" or "cat"')
-        self._num_features_idx = [i for i, t in enumerate(
-            self._features_types) if t == 'num']
-        self._cat_features_idx = [i for i, t in enumerate(
-            self._features_types) if t == 'cat']
+        self._features_types = types
+        self._num_features_idx = [i for i, t in enumerate(types) if t == 'num']
+        self._cat_features_idx = [i for i, t in enumerate(types) if t == 'cat']
         self._cat_val_to_code = {}
         self._code_to_cat_val = {}
-        self._clean_temp()
+        self._lock = threading.Lock()
+
+    @property
+    def features_types_dict(self):
+        """Schema with features types ("num" or "cat") as values."""
+        return self.decode(self._features_types, categorical=False)
 
     def encode(self, nested_dict):
         """Encodes nested dict."""
-        nested_dict = deepcopy(nested_dict)
-        nested_dict = self.order_dict(nested_dict)
-        values = list(self._get_nested_dict_values(nested_dict))
-        values = self._encode_categorical_features(values)
+        values = []
+        self._append_values(self._schema, nested_dict, values)
+        if self._cat_features_idx:
+            self._encode_categorical_features(values)
         return values
 
-    def decode(self, values):
+    def decode(self, values, categorical=True):
         """Decodes nested dict."""
-        values = deepcopy(values)
-        temp_dict = deepcopy(self.features_types_dict)
-        self._temp_idx = 0
-        self._temp_values = list(deepcopy(values))
-        self._temp_values = self._decode_categorical_features(
-            self._temp_values)
-        self._set_nested_dict_values(temp_dict)
-        decoded_dict = temp_dict
-        self._clean_temp()
-        return decoded_dict
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        if categorical and self._cat_features_idx:
+            values = self._decode_categorical_features(values)
+        dicts = [OrderedDict()]
+        for parent, key, leaf in self._entries:
+            if leaf is None:
+                d = OrderedDict()
+                dicts[parent][key] = d
+                dicts.append(d)
+            else:
+                dicts[parent][key] = values[leaf]
+        return dicts[0]
+
+    def encode_batch(self, nested_dicts):
+        """Encodes nested dicts.
+
+        Returns:
+            values (np.ndarray): dicts x features.
+
+        """
+        return np.array([self.encode(nested_dict) for nested_dict in nested_dicts], dtype=float)
+
+    def decode_batch(self, values):
+        """Decodes rows of values (dicts x features)."""
+        return [self.decode(row) for row in np.asarray(values).tolist()]
 
     def order_dict(self, nested_dict):
         """Orders dict by initial dict."""
-        nested_dict = deepcopy(nested_dict)
-        temp_dict = self.features_types_dict.copy()
-        self._temp_values = list(self._get_nested_dict_values_by_order(
-            nested_dict, self.features_types_dict))
-        self._temp_idx = 0
-        self._set_nested_dict_values(temp_dict)
-        ordered_dict = temp_dict
-        self._clean_temp()
-        return ordered_dict
+        return self.decode(self.encode(nested_dict))
 
     def keys_list(self):
-        return list(self._get_nested_dict_keys(self.features_types_dict))
-
-    def _clean_temp(self):
-        self._temp_idx = None
-        self._temp_values = None
+        return list(self._keys)
+
+    def save(self, save_path):
+        """Save schema and code tables of categorical features."""
+        with self._lock:
+            categories = [[code, value] for code, value in self._code_to_cat_val.items()]
+        with open(save_path, 'w+') as fp:
+            json.dump(OrderedDict([
+                ("schema", self.features_types_dict),
+                ("categories", categories),
+            ]), fp, indent=2)
+
+    @classmethod
+    def load(cls, json_path):
+        """Encoder saved by save."""
+        with open(json_path, 'r') as fp:
+            saved = json.load(fp, object_pairs_hook=OrderedDict)
+        encoder = cls(saved["schema"], all_nums=False)
+        for code, value in saved["categories"]:
+            encoder._code_to_cat_val[code] = value
+            encoder._cat_val_to_code[value] = code
+        return encoder
+
+    def _compile(self, d):
+        return [(k, self._compile(v) if isinstance(v, dict) else None) for k, v in d.items()]
+
+    def _add_entries(self, schema, parent, n_dicts):
+        for key, child in schema:
+            if child is None:
+                self._entries.append((parent, key, len(self._keys)))
+                self._keys.append(key)
+            else:
+                self._entries.append((parent, key, None))
+                idx = n_dicts[0]
+                n_dicts[0] += 1
+                self._add_entries(child, idx, n_dicts)
 
-    def _get_nested_dict_values(self, d):
+    def _iter_leaves(self, d):
         for v in d.values():
             if isinstance(v, dict):
-                yield from self._get_nested_dict_values(v)
+                yield from self._iter_leaves(v)
             else:
                 yield v
 
-    def _get_nested_dict_keys(self, d):
-        for k, v in d.items():
-            if isinstance(v, dict):
-                yield from self._get_nested_dict_keys(v)
-            else:
-                yield k
-
-    def _set_nested_dict_values(self, d):
-        for k, v in d.items():
-            if isinstance(v, dict):
-                self._set_nested_dict_values(d[k])
+    def _append_values(self, schema, d, values):
+        for key, child in schema:
+            if child is None:
+                values.append(d[key])
             else:
-                d[k] = self._temp_values[self._temp_idx]
-                self._temp_idx += 1
-
-    def _get_nested_dict_values_by_order(self, d, ordered_d):
-        for k in ordered_d:
-            v = d[k]
-            if isinstance(v, dict):
-                v_ordered = ordered_d[k]
-                yield from self._get_nested_dict_values_by_order(v, v_ordered)
-            else:
-                yield v
+                self._append_values(child, d[key], values)
 
     def _encode_categorical_features(self, values):
-        encoded_values = deepcopy(values)
-        for i in self._cat_features_idx:
-            v = values[i]
-            if v not in self._cat_val_to_code:
-                code = len(self._cat_val_to_code)
-                self._cat_val_to_code[v] = code
-                self._code_to_cat_val[code] = v
-            encoded_values[i] = self._cat_val_to_code[v]
-        return encoded_values
+        with self._lock:
+            for i in self._cat_features_idx:
+                v = values[i]
+                if v not in self._cat_val_to_code:
+                    code = len(self._cat_val_to_code)
+                    self._cat_val_to_code[v] = code
+                    self._code_to_cat_val[code] = v
+                values[i] = self._cat_val_to_code[v]
 
     def _decode_categorical_features(self, values, default='-999'):
-        decoded_values = deepcopy(values)
-        for i in self._cat_features_idx:
-            v = values[i]
-            cat = self._code_to_cat_val[
-                v] if v in self._code_to_cat_val else default
-            decoded_values[i] = cat
+        decoded_values = list(values)
+        with self._lock:
+            for i in self._cat_features_idx:
+                v = values[i]
+                decoded_values[i] = self._code_to_cat_val.get(v, default)
         return decoded_values